@@ -0,0 +1,311 @@
+"""
+Controle de admissão das chamadas à OpenAI (LLM e embeddings).
+
+Num pico de tráfego, cada requisição ia direto ao provedor: batíamos no rate
+limit, o cliente entrava em retentativas longas e a requisição terminava em
+500. Aqui cada cliente passa por um AdmissionLimiter:
+
+- no máximo `limit` chamadas simultâneas; as demais esperam numa fila
+  limitada (ADMISSION_*_QUEUE_SIZE), por até ADMISSION_WAIT_TIMEOUT segundos;
+- fila cheia, espera estourada ou provedor pedindo pausa (429 com
+  Retry-After) -> Overloaded, que os endpoints transformam em 429 com o
+  cabeçalho Retry-After (falha rápida em vez de acumular requisições);
+- justiça por sessão: a fila é uma por sessão (current_session) e as vagas
+  são distribuídas em rodízio entre as sessões, então uma conversa com várias
+  chamadas pendentes não passa na frente das outras;
+- limite adaptativo (AIMD): um 429 do provedor divide o limite por dois e
+  cabeçalhos x-ratelimit-remaining-* abaixo de ADMISSION_LOW_REMAINING o
+  reduzem em um; cada `limit` chamadas bem-sucedidas seguidas devolvem uma
+  vaga, até o máximo configurado.
+
+Funciona tanto para threads (modo Flask, `slot`) quanto para corrotinas
+(modo ASGI, `aslot`): o estado é protegido por um lock de thread e quem
+espera num event loop é acordado com call_soon_threadsafe.
+"""
+import os
+import re
+import math
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+import openai
+
+from telemetry import ADMISSION_REJECTED, ADMISSION_WAIT, PROVIDER_RATE_LIMITED, register_collector
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "32"))
+# Embeddings das requisições; a indexação tem o seu próprio limite (EMBEDDING_MAX_CONCURRENCY)
+EMBEDDING_ADMISSION_CONCURRENCY = int(os.getenv("EMBEDDING_ADMISSION_CONCURRENCY", "16"))
+EMBEDDING_QUEUE_SIZE = int(os.getenv("EMBEDDING_QUEUE_SIZE", "64"))
+ADMISSION_WAIT_TIMEOUT = float(os.getenv("ADMISSION_WAIT_TIMEOUT", "20"))  # segundos na fila
+# Fração restante da cota do provedor abaixo da qual o limite de concorrência diminui
+ADMISSION_LOW_REMAINING = float(os.getenv("ADMISSION_LOW_REMAINING", "0.1"))
+# Pausa após um 429 do provedor sem Retry-After
+ADMISSION_RATE_LIMIT_BACKOFF = float(os.getenv("ADMISSION_RATE_LIMIT_BACKOFF", "5"))
+
+# Sessão da requisição atual (definida nos endpoints; vale para as threads/tasks do grafo)
+current_session = contextvars.ContextVar("admission_session", default=None)
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class Overloaded(Exception):
+    """Sem capacidade para atender agora; `retry_after` em segundos inteiros."""
+
+    def __init__(self, client, reason, retry_after):
+        super().__init__(f"{client}: {reason} (tente novamente em {retry_after}s)")
+        self.client = client
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _duration(value):
+    """Segundos de '20', '1.5', '6m0s', '250ms' (formatos de Retry-After e x-ratelimit-reset-*)."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        parts = _DURATION_RE.findall(value)
+        return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts) if parts else None
+
+
+def _remaining_fraction(headers):
+    """Menor fração restante entre as cotas de requisições e de tokens, ou None sem os cabeçalhos."""
+    fractions = []
+    for kind in ("requests", "tokens"):
+        try:
+            remaining = float(headers[f"x-ratelimit-remaining-{kind}"])
+            limit = float(headers[f"x-ratelimit-limit-{kind}"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if limit > 0:
+            fractions.append(remaining / limit)
+    return min(fractions) if fractions else None
+
+
+class _Waiter:
+    __slots__ = ("session", "granted", "event", "loop", "future")
+
+    def __init__(self, session, loop=None):
+        self.session = session
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def grant(self):
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class AdmissionLimiter:
+    def __init__(self, name, max_concurrency, queue_size, wait_timeout=ADMISSION_WAIT_TIMEOUT, min_concurrency=1):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.queue_size = queue_size
+        self.wait_timeout = wait_timeout
+        self.limit = self.max_concurrency
+        self.active = 0
+        self.queued = 0
+        self._waiting = OrderedDict()  # sessão -> deque de _Waiter (ordem = rodízio)
+        self._hold = 1.0  # média móvel do tempo de uso de uma vaga (s), para estimar o Retry-After
+        self._successes = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # ----- Fila -----
+
+    def _retry_after(self, now):
+        if self._paused_until > now:
+            return max(1, math.ceil(self._paused_until - now))
+        # Tempo para a fila andar até esta chamada
+        return max(1, math.ceil((self.queued + 1) / self.limit * self._hold))
+
+    def _reject(self, reason, now=None):
+        now = now or time.monotonic()
+        ADMISSION_REJECTED.inc(client=self.name, reason=reason)
+        return Overloaded(self.name, reason, self._retry_after(now))
+
+    def check(self):
+        """Falha rápida antes de começar uma requisição (ex.: stream SSE) se não houver como atendê-la."""
+        with self._lock:
+            now = time.monotonic()
+            if self._paused_until > now:
+                raise self._reject("rate_limited", now)
+            if self.active >= self.limit and self.queued >= self.queue_size:
+                raise self._reject("queue_full", now)
+
+    def saturated(self):
+        """Todas as vagas ocupadas (trabalho especulativo deve esperar)."""
+        return self.active >= self.limit
+
+    def _enter(self, loop=None):
+        """Ocupa uma vaga (retorna None) ou entra na fila da sessão (retorna o _Waiter)."""
+        with self._lock:
+            now = time.monotonic()
+            if self._paused_until > now:
+                raise self._reject("rate_limited", now)
+            if self.active < self.limit and not self.queued:
+                self.active += 1
+                return None
+            if self.queued >= self.queue_size:
+                raise self._reject("queue_full", now)
+            session = current_session.get()
+            waiter = _Waiter(session, loop)
+            self._waiting.setdefault(session, deque()).append(waiter)
+            self.queued += 1
+            return waiter
+
+    def _grant_locked(self):
+        while self._waiting and self.active < self.limit:
+            # Próxima sessão do rodízio; se ela ainda tiver chamadas esperando, volta para o fim
+            session, waiters = self._waiting.popitem(last=False)
+            waiter = waiters.popleft()
+            if waiters:
+                self._waiting[session] = waiters
+            self.queued -= 1
+            self.active += 1
+            waiter.grant()
+
+    def _cancel(self, waiter):
+        """Desiste da espera. Retorna True se a vaga chegou a ser concedida (e precisa ser liberada)."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiters = self._waiting.get(waiter.session)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiting[waiter.session]
+                self.queued -= 1
+            return False
+
+    def _release(self, held, success):
+        with self._lock:
+            self.active -= 1
+            self._hold = 0.8 * self._hold + 0.2 * held
+            if success:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._grant_locked()
+
+    # ----- Sinais do provedor -----
+
+    def on_rate_limited(self, headers=None):
+        """429 do provedor: corta o limite pela metade e pausa as novas chamadas pelo Retry-After."""
+        headers = headers or {}
+        pause = _duration(headers.get("retry-after-ms"))
+        pause = pause / 1000 if pause is not None else _duration(headers.get("retry-after"))
+        with self._lock:
+            self.limit = max(self.min_concurrency, self.limit // 2)
+            self._successes = 0
+            self._paused_until = max(self._paused_until,
+                                     time.monotonic() + (pause if pause is not None else ADMISSION_RATE_LIMIT_BACKOFF))
+        PROVIDER_RATE_LIMITED.inc(client=self.name)
+        logger.warning(f"Admissão {self.name}: rate limit do provedor, concorrência reduzida para {self.limit}.")
+
+    def observe_headers(self, headers):
+        """Cabeçalhos x-ratelimit-* de uma resposta: cota quase no fim reduz o limite em um."""
+        fraction = _remaining_fraction(headers) if headers else None
+        if fraction is None or fraction >= ADMISSION_LOW_REMAINING:
+            return
+        with self._lock:
+            if self.limit > self.min_concurrency:
+                self.limit -= 1
+                logger.info(f"Admissão {self.name}: cota do provedor em {fraction:.0%}, concorrência {self.limit}.")
+            self._successes = 0
+
+    # ----- Uso -----
+
+    def _rate_limited(self, e):
+        response = getattr(e, "response", None)
+        self.on_rate_limited(response.headers if response is not None else None)
+        return Overloaded(self.name, "rate_limited", self._retry_after(time.monotonic()))
+
+    @contextmanager
+    def slot(self):
+        """Ocupa uma vaga durante o bloco (threads)."""
+        start = time.perf_counter()
+        waiter = self._enter()
+        if waiter is not None and not waiter.event.wait(self.wait_timeout) and not self._cancel(waiter):
+            raise self._reject("timeout")
+        ADMISSION_WAIT.observe(time.perf_counter() - start, client=self.name)
+
+        held = time.perf_counter()
+        success = False
+        try:
+            yield
+            success = True
+        except openai.RateLimitError as e:
+            raise self._rate_limited(e) from e
+        finally:
+            self._release(time.perf_counter() - held, success)
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Versão assíncrona de `slot` (modo ASGI)."""
+        start = time.perf_counter()
+        waiter = self._enter(asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.wait_timeout)
+            except asyncio.TimeoutError:
+                if not self._cancel(waiter):
+                    raise self._reject("timeout")
+            except asyncio.CancelledError:
+                if self._cancel(waiter):
+                    self._release(0.0, False)
+                raise
+        ADMISSION_WAIT.observe(time.perf_counter() - start, client=self.name)
+
+        held = time.perf_counter()
+        success = False
+        try:
+            yield
+            success = True
+        except openai.RateLimitError as e:
+            raise self._rate_limited(e) from e
+        finally:
+            self._release(time.perf_counter() - held, success)
+
+    def stats(self):
+        return {"limit": self.limit, "active": self.active, "queued": self.queued}
+
+
+llm_limiter = AdmissionLimiter("llm", LLM_MAX_CONCURRENCY, LLM_QUEUE_SIZE)
+embedding_limiter = AdmissionLimiter("embedding", EMBEDDING_ADMISSION_CONCURRENCY, EMBEDDING_QUEUE_SIZE)
+
+
+def _metricas_admissao():
+    samples = []
+    for limiter in (llm_limiter, embedding_limiter):
+        labels = {"client": limiter.name}
+        samples += [
+            ("admission_queue_depth", "gauge", "Chamadas esperando vaga.", labels, limiter.queued),
+            ("admission_in_flight", "gauge", "Chamadas em andamento no provedor.", labels, limiter.active),
+            ("admission_concurrency_limit", "gauge", "Limite de concorrência atual (adaptativo).", labels, limiter.limit),
+        ]
+    return samples
+
+
+register_collector(_metricas_admissao)
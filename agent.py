@@ -0,0 +1,134 @@
+"""
+Agente LangGraph (loop ReAct) compilado uma única vez por processo.
+
+O grafo compilado não guarda estado entre execuções (não há checkpointer),
+então a mesma instância pode ser reutilizada por várias threads ao mesmo tempo.
+O nó do LLM tem versão síncrona e assíncrona: `invoke`/`stream` (Flask) e
+`ainvoke`/`astream` (modo ASGI, ver asgi.py) usam o mesmo grafo.
+O prompt do sistema é um template: data e dia da semana entram no estado
+de cada execução, e não na construção do grafo.
+"""
+import threading
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Annotated, TypedDict
+
+from langgraph.graph import StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode, tools_condition
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda
+
+SYSTEM_PROMPT = """Você é Gustavo Mota Macedo.
+### CONTEXTO TEMPORAL CRÍTICO ###
+- Data de Hoje: {data_extenso} ({dia_semana})
+- Sua Localização Atual: São Paulo, Brasil (Fuso Horário BRT)
+
+### DIRETRIZES DE RACIOCÍNIO (ReAct) ###
+Ao receber uma pergunta, você deve pensar passo a passo:
+1. **Thought (Raciocínio):** O que eu preciso saber para responder isso? Qual ferramenta devo usar?
+2. **Action (Ação):** Acionar a ferramenta necessária. Você pode acionar várias em sequência se a primeira não retornar tudo que precisa.
+3. **Observation (Observação):** O resultado me permite responder completamente? Se o usuário fala MÚLTIPLOS TÓPICOS, busque todos.
+4. **Considerar o Tempo**: Se o usuário perguntar "há quanto tempo", chame OBRIGATORIAMENTE a ferramenta `obter_tempo_experiencia` passando a data que encontrou para que o cálculo seja exato, baseado na Data de Hoje.
+5. **Priorizar o Recente**: Dê mais peso a informações recentes (próximas a {ano}) ou atuações descritas como 'Atual'.
+
+=== REGRAS DE IDIOMA (ESTRITAS E INVIOLÁVEIS) ===
+VOCÊ ESTÁ PROIBIDO DE FALAR QUALQUER IDIOMA QUE NÃO SEJA PORTUGUÊS OU INGLÊS.
+SE O USUÁRIO FALAR ESPANHOL, FRANCÊS, ITALIANO, ETC:
+-> IGNORE O IDIOMA DELE E RESPONDA DIRETO EM INGLÊS.
+
+=== REGRAS DE CONTEÚDO (NUNCA VIOLE) ===
+1. VOCÊ NÃO PODE INVENTAR INFORMAÇÕES
+2. VOCÊ SÓ PODE RESPONDER COM BASE NOS RESULTADOS DAS FERRAMENTAS
+3. SE A FERRAMENTA NÃO RETORNAR INFORMAÇÃO, VOCÊ DEVE DIZER QUE NÃO SABE
+
+=== DIRETRIZES DE VENDAS E RECRUTAMENTO (PRIORIDADE MÁXIMA) ===
+Se você identificar que o usuário é um **Recrutador** ou **Cliente Potencial**:
+1. **Adote uma postura proativa e entusiasta.**
+2. **REDIRECIONE PARA O WHATSAPP IMEDIATAMENTE.**
+Exemplo: "Isso soa ótimo! Como hoje é {dia_semana} e estou em São Paulo, se você me chamar no WhatsApp agora, é provável que eu te responda rapidamente! Vamos conversar?"
+Link direto: `https://wa.me/5573998061168`
+
+=== GESTÃO DE CONHECIMENTO ===
+- **Curriculo, habilidades, experiência profissional e contato**: `consultar_curriculo`
+- **TCC, Monografia, trabalho de conclusão**: `consultar_tcc`
+- **IC (Iniciação Científica), Hidrodinâmica, pesquisa**: `consultar_iniciacao_cientifica`
+- **Orçamento de software, estimativas, preço**: `calcular_orcamento_software`
+- **Cálculo de tempo de experiência**: `obter_tempo_experiencia`
+
+LEMBRE-SE: É MELHOR DIZER "NÃO SEI" DO QUE INVENTAR INFORMAÇÕES!
+"""
+
+
+class GraphState(TypedDict):
+    messages: Annotated[list, add_messages]
+    # Variáveis do prompt do sistema, injetadas a cada execução
+    data_extenso: str
+    dia_semana: str
+    ano: int
+
+
+def prompt_variables(now=None):
+    """Variáveis temporais do prompt do sistema para a execução atual."""
+    now = now or datetime.now()
+    return {
+        "data_extenso": now.strftime("%d/%m/%Y"),
+        "dia_semana": now.strftime("%A"),
+        "ano": now.year,
+    }
+
+
+def build_agent(llm, tools, limiter=None):
+    """
+    Monta e compila o grafo ReAct (chatbot <-> tools). Com `limiter`
+    (admission.AdmissionLimiter), cada chamada ao LLM ocupa uma vaga e os
+    cabeçalhos de rate limit da resposta ajustam a concorrência.
+    """
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_PROMPT),
+        MessagesPlaceholder("messages"),
+    ])
+    chain = prompt | llm.bind_tools(tools)
+
+    def observe(message):
+        if limiter:
+            limiter.observe_headers(message.response_metadata.get("headers"))
+        return {"messages": [message]}
+
+    def chatbot(state: GraphState):
+        with limiter.slot() if limiter else nullcontext():
+            return observe(chain.invoke(state))
+
+    async def achatbot(state: GraphState):
+        async with limiter.aslot() if limiter else nullcontext():
+            return observe(await chain.ainvoke(state))
+
+    graph_builder = StateGraph(GraphState)
+    graph_builder.add_node("chatbot", RunnableLambda(chatbot, afunc=achatbot))
+    graph_builder.add_node("tools", ToolNode(tools=tools))
+
+    graph_builder.add_conditional_edges("chatbot", tools_condition)
+    graph_builder.add_edge("tools", "chatbot")
+    graph_builder.set_entry_point("chatbot")
+
+    return graph_builder.compile()
+
+
+class AgentHolder:
+    """Guarda o agente compilado e o constrói sob demanda (thread-safe)."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._agent = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._agent is None:
+            with self._lock:
+                if self._agent is None:
+                    self._agent = self._factory()
+        return self._agent
+
+    def reset(self):
+        with self._lock:
+            self._agent = None
@@ -0,0 +1,168 @@
+"""
+Cache semântico de respostas para perguntas repetidas.
+
+Só perguntas de primeiro turno (sem histórico na sessão) são elegíveis:
+nesse caso a resposta depende apenas da pergunta e dos documentos de data/.
+Uma pergunta nova reaproveita a resposta de outra com o mesmo idioma, a
+mesma versão do corpus e similaridade de cosseno >= ANSWER_CACHE_THRESHOLD,
+pulando o grafo do agente inteiro.
+
+A versão do corpus é o hash do manifesto de indexação: qualquer alteração
+em data/ invalida as respostas anteriores.
+
+O prompt do sistema traz a data, o dia da semana e o ano (agent.prompt_variables),
+e uma resposta pode depender deles sem passar por obter_tempo_experiencia: uma
+entrada só vale no dia em que foi gerada. Desligado por padrão
+(ANSWER_CACHE_ENABLED=true liga).
+"""
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from langchain_core.messages import AIMessage
+
+from database import session_scope, AnswerCacheEntry, DocumentManifest
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # similaridade de cosseno
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))  # segundos
+ANSWER_CACHE_MAX_CHARS = int(os.getenv("ANSWER_CACHE_MAX_CHARS", "300"))
+# Intervalo (s) para recalcular a versão do corpus a partir do manifesto
+CORPUS_VERSION_REFRESH = float(os.getenv("CORPUS_VERSION_REFRESH", "30"))
+
+# Ferramentas cujo resultado não deve ser reaproveitado (valores aleatórios / dependem da data)
+NON_CACHEABLE_TOOLS = {"calcular_orcamento_software", "obter_tempo_experiencia"}
+
+_PT_WORDS = {"o", "a", "os", "as", "de", "do", "da", "em", "que", "com", "você", "voce", "seu", "sua",
+             "qual", "quais", "como", "sobre", "é", "e", "um", "uma", "para", "por", "me", "fale", "quanto"}
+_EN_WORDS = {"the", "of", "in", "what", "with", "you", "your", "is", "are", "and", "a", "an", "to", "for",
+             "about", "how", "tell", "me", "do", "does", "which", "much"}
+
+
+def detect_language(text):
+    """Heurística barata pt/en por contagem de palavras funcionais."""
+    words = [w.strip("?!.,;:()\"'").casefold() for w in text.split()]
+    pt = sum(w in _PT_WORDS for w in words)
+    en = sum(w in _EN_WORDS for w in words)
+    return "en" if en > pt else "pt"
+
+
+def used_tools(messages):
+    return {call["name"] for msg in messages if isinstance(msg, AIMessage) for call in msg.tool_calls}
+
+
+class AnswerCache:
+    def __init__(self, embeddings, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL,
+                 enabled=ANSWER_CACHE_ENABLED):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.enabled = enabled
+        self.counters = {"hits": 0, "misses": 0, "stored": 0}
+        self._version = None
+        self._version_checked_at = 0.0
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        # Consultas simultâneas das threads do Flask e do asyncio.to_thread do modo ASGI
+        with self._lock:
+            self.counters[name] += 1
+
+    def is_eligible(self, question, is_first_turn):
+        return self.enabled and is_first_turn and 0 < len(question.strip()) <= ANSWER_CACHE_MAX_CHARS
+
+    def corpus_version(self, db):
+        """Hash de (arquivo, hash do arquivo) do manifesto, recalculado a cada CORPUS_VERSION_REFRESH s."""
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._version_checked_at < CORPUS_VERSION_REFRESH:
+                return self._version
+        digest = hashlib.sha256()
+        for source, file_hash in db.query(DocumentManifest.source, DocumentManifest.file_hash)\
+                                   .order_by(DocumentManifest.source):
+            digest.update(f"{source}:{file_hash}\n".encode("utf-8"))
+        with self._lock:
+            self._version = digest.hexdigest()
+            self._version_checked_at = now
+            return self._version
+
+    def valid_since(self, now=None):
+        """Entradas mais antigas que isso não valem: TTL ou virada do dia (data do prompt)."""
+        now = now or datetime.now()
+        return max(now - timedelta(seconds=self.ttl), now.replace(hour=0, minute=0, second=0, microsecond=0))
+
+    def lookup(self, question, vector=None):
+        """Resposta em cache para uma pergunta semelhante, ou None (`vector`: embedding já calculado)."""
+        with session_scope() as db:
+            try:
+                if vector is None:
+                    vector = self.embeddings.embed_query(question)
+                distance = AnswerCacheEntry.embedding.cosine_distance(vector)
+                row = db.query(AnswerCacheEntry, distance.label("distance")).filter(
+                    AnswerCacheEntry.language == detect_language(question),
+                    AnswerCacheEntry.corpus_version == self.corpus_version(db),
+                    AnswerCacheEntry.created_at >= self.valid_since(),
+                ).order_by(distance).first()
+
+                if row is None or 1 - row.distance < self.threshold:
+                    self._count("misses")
+                    return None
+
+                entry = row.AnswerCacheEntry
+                entry.hits = (entry.hits or 0) + 1
+                db.commit()
+                self._count("hits")
+                logger.info(f"Cache de respostas: HIT (similaridade {1 - row.distance:.3f}) "
+                            f"para '{question}' ~ '{entry.question}'")
+                return entry.answer
+            except Exception as e:
+                logger.warning(f"Cache de respostas: falha na consulta: {e}")
+                db.rollback()
+                return None
+
+    async def alookup(self, question):
+        """`lookup` do modo ASGI: embedding pelo cliente assíncrono, consulta ao banco numa thread."""
+        try:
+            vector = await self.embeddings.aembed_query(question)
+        except Exception as e:
+            logger.warning(f"Cache de respostas: falha na consulta: {e}")
+            return None
+        return await asyncio.to_thread(self.lookup, question, vector)
+
+    def store(self, question, answer, messages):
+        """Guarda a resposta, a menos que a execução tenha usado ferramentas não determinísticas."""
+        if not answer or used_tools(messages) & NON_CACHEABLE_TOOLS:
+            return
+        with session_scope() as db:
+            try:
+                db.add(AnswerCacheEntry(
+                    language=detect_language(question),
+                    question=question,
+                    embedding=self.embeddings.embed_query(question),
+                    answer=answer,
+                    corpus_version=self.corpus_version(db),
+                ))
+                self._purge(db)
+                db.commit()
+                self._count("stored")
+            except Exception as e:
+                logger.warning(f"Cache de respostas: falha ao gravar: {e}")
+                db.rollback()
+
+    def _purge(self, db):
+        # Remove entradas vencidas ou de versões antigas do corpus, no máximo uma vez por hora
+        now = time.monotonic()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        db.query(AnswerCacheEntry).filter(
+            (AnswerCacheEntry.created_at < self.valid_since())
+            | (AnswerCacheEntry.corpus_version != self.corpus_version(db))
+        ).delete(synchronize_session=False)
@@ -1,26 +1,62 @@
+import os
 from flask import Flask, render_template
 from flask_cors import CORS
 # Main application entry point
-from blueprints.chat import chat_bp
-
-app = Flask(__name__)
-
-# Configurar CORS para permitir requisições do frontend
-CORS(app, resources={
-    r"/api/*": {
-        "origins": ["http://localhost:3000", "http://127.0.0.1:3000", "https://portfolio-frontend-green-zeta.vercel.app", "https://portfolio-backend-iota-rose.vercel.app", "https://gustavomacedo-dev.com", "https://www.gustavomacedo-dev.com"],
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
-        "supports_credentials": True
-    }
-})
-
-# Registrar o blueprint com o prefixo /api
-app.register_blueprint(chat_bp, url_prefix='/api')
-
-@app.route('/')
-def home():
-    return render_template('index.html')
+from blueprints.chat import chat_bp, warmup_agent
+from blueprints.health import health_bp
+from indexing import INDEX_ON_STARTUP, start_background_indexing
+from database import engine
+from request_db import init_app
+import telemetry
+
+# Política de CORS da API: flask-cors aqui e CORSMiddleware nas rotas assíncronas do asgi.py
+CORS_ORIGINS = ["http://localhost:3000", "http://127.0.0.1:3000", "https://portfolio-frontend-green-zeta.vercel.app", "https://portfolio-backend-iota-rose.vercel.app", "https://gustavomacedo-dev.com", "https://www.gustavomacedo-dev.com"]
+CORS_METHODS = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+CORS_HEADERS = ["Content-Type", "Authorization"]
+
+def create_app():
+    """
+    Cria o app sem nenhum I/O (nada de DDL, varredura de data/ ou embeddings),
+    para que o cold start seja só o custo de import.
+    """
+    app = Flask(__name__)
+
+    # Configurar CORS para permitir requisições do frontend
+    CORS(app, resources={
+        r"/api/*": {
+            "origins": CORS_ORIGINS,
+            "methods": CORS_METHODS,
+            "allow_headers": CORS_HEADERS,
+            "supports_credentials": True
+        }
+    })
+
+    # Registrar os blueprints com o prefixo /api
+    app.register_blueprint(chat_bp, url_prefix='/api')
+    app.register_blueprint(health_bp, url_prefix='/api')
+
+    # Sessão de banco por requisição, fechada no teardown
+    init_app(app)
+
+    # Span raiz + métricas HTTP por requisição e métricas/spans das queries SQL
+    telemetry.init_app(app)
+    telemetry.instrument_engine(engine)
+
+    @app.route('/')
+    def home():
+        return render_template('index.html')
+
+    # Pré-compilar o agente na subida do processo (opcional)
+    if os.getenv("AGENT_WARMUP", "false").lower() == "true":
+        warmup_agent()
+
+    # Indexação em background (opcional); o padrão é rodar `python indexing.py` como job separado
+    if INDEX_ON_STARTUP == "background":
+        start_background_indexing()
+
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
     # Rodar em debug mode para desenvolvimento setup
@@ -0,0 +1,117 @@
+"""
+Modo de serviço assíncrono (ASGI), com Starlette.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+As rotas de chat (/api/chat, /api/chat/stream, /api/chat/history) são
+corrotinas (blueprints/chat_async.py): uma conversa esperando a OpenAI não
+ocupa nenhuma thread, então um processo sustenta centenas de conversas em
+andamento. As demais rotas (health, métricas, página inicial e preflight de
+CORS) continuam no app Flask, montado pelo adaptador WSGI do a2wsgi, que tem
+ASGI_WSGI_THREADS threads próprias e repassa as respostas em streaming.
+
+O executor padrão do event loop recebe as operações curtas de banco
+(asyncio.to_thread). Ele tem ASGI_THREADS threads, por padrão o tamanho
+máximo do pool de conexões, para que nenhuma thread fique parada esperando
+conexão livre.
+"""
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import ClientDisconnect
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Mount, Route
+
+import telemetry
+from app import app as flask_app, CORS_ORIGINS, CORS_METHODS, CORS_HEADERS
+from blueprints.chat_async import ROUTES
+from database import DB_POOL_SIZE, DB_MAX_OVERFLOW, get_async_engine
+
+logger = logging.getLogger(__name__)
+
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+# Threads do adaptador WSGI: só health, métricas, página inicial e preflight passam por ele
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "4"))
+ASGI_MAX_BODY_BYTES = int(os.getenv("ASGI_MAX_BODY_BYTES", str(1 << 20)))
+
+
+async def _fim_da_resposta(root, start, endpoint):
+    telemetry.HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+    root.end()
+
+
+def _instrumentar(handler, endpoint):
+    """Mesmo span raiz e métricas HTTP que telemetry.init_app dá às rotas Flask."""
+
+    async def instrumentado(request):
+        start = time.perf_counter()
+        root = telemetry.start_span(f"{request.method} {request.url.path}",
+                                    traceparent=request.headers.get("traceparent"),
+                                    attributes={"http.method": request.method, "http.route": request.url.path})
+        token = telemetry.current_span.set(root) if root is not telemetry.NOOP_SPAN else None
+        try:
+            response = await handler(request)
+        except ClientDisconnect:
+            # Corpo incompleto: o handler não roda e ninguém vai ler a resposta
+            logger.info(f"{endpoint}: cliente desconectou antes de enviar o corpo.")
+            response = Response(status_code=400)
+        except HTTPException as e:
+            # Ex.: 413 do limite de corpo (ASGI_MAX_BODY_BYTES)
+            response = PlainTextResponse(e.detail, status_code=e.status_code, headers=e.headers)
+        except Exception as e:
+            logger.critical(f"Erro não tratado em {endpoint}: {e}", exc_info=True)
+            telemetry.record_error(root, e)
+            response = JSONResponse({"error": "Erro interno", "details": str(e)}, status_code=500)
+        finally:
+            if token is not None:
+                telemetry.current_span.reset(token)
+
+        telemetry.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        if response.status_code >= 500:
+            telemetry.ERRORS.inc(component="http")
+        if root is not telemetry.NOOP_SPAN:
+            root.set_attribute("http.status_code", response.status_code)
+            response.headers["traceparent"] = telemetry.traceparent(root)
+        # Roda depois do último byte enviado: no SSE, a latência é a do stream inteiro
+        response.background = BackgroundTask(_fim_da_resposta, root, start, endpoint)
+        return response
+
+    return instrumentado
+
+
+@asynccontextmanager
+async def lifespan(app):
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi"))
+    async_engine = get_async_engine()
+    if async_engine is not None:
+        telemetry.instrument_engine(async_engine.sync_engine)
+    logger.info(f"Modo ASGI: {len(ROUTES)} rotas assíncronas, {ASGI_THREADS} threads.")
+    yield
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+# A mesma política do flask-cors; o preflight (OPTIONS) cai no Flask, como as demais rotas
+_cors = Middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_methods=CORS_METHODS,
+                   allow_headers=CORS_HEADERS, allow_credentials=True)
+
+app = Starlette(
+    routes=[
+        *(Route(path, _instrumentar(handler, endpoint), methods=[method], name=endpoint, middleware=[_cors])
+          for (method, path), (handler, endpoint) in ROUTES.items()),
+        Mount("/", app=WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+    max_body_size=ASGI_MAX_BODY_BYTES,
+)
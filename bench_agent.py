@@ -0,0 +1,97 @@
+"""
+Micro-benchmark do custo por requisição para montar o agente LangGraph.
+
+Compara o caminho antigo (bind_tools + StateGraph + ToolNode + compile a cada
+requisição) com o agente compilado uma vez e reutilizado, onde o único custo
+por requisição é injetar data/dia da semana no prompt.
+
+Não faz chamadas de rede: o LLM nunca é invocado.
+
+Uso:
+    python bench_agent.py [iteracoes]
+"""
+import os
+import sys
+import time
+import statistics
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from langchain_openai import ChatOpenAI
+from langchain_core.tools import tool
+
+from agent import AgentHolder, build_agent, prompt_variables
+
+
+@tool
+def consultar_curriculo(query: str):
+    """Stand-in da ferramenta de currículo."""
+    return query
+
+@tool
+def consultar_tcc(query: str):
+    """Stand-in da ferramenta do TCC."""
+    return query
+
+@tool
+def consultar_iniciacao_cientifica(query: str):
+    """Stand-in da ferramenta da IC."""
+    return query
+
+@tool
+def calcular_orcamento_software(query: str):
+    """Stand-in da ferramenta de orçamento."""
+    return query
+
+@tool
+def obter_tempo_experiencia(data_inicio: str) -> str:
+    """Stand-in da ferramenta de tempo de experiência."""
+    return data_inicio
+
+TOOLS = [consultar_curriculo, consultar_tcc, consultar_iniciacao_cientifica, calcular_orcamento_software, obter_tempo_experiencia]
+
+
+def medir(fn, iteracoes):
+    tempos = []
+    for _ in range(iteracoes):
+        inicio = time.perf_counter()
+        fn()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    tempos.sort()
+    return {
+        "media_ms": statistics.mean(tempos),
+        "p50_ms": tempos[len(tempos) // 2],
+        "p95_ms": tempos[int(len(tempos) * 0.95) - 1],
+    }
+
+
+def main():
+    iteracoes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+    holder = AgentHolder(lambda: build_agent(llm, TOOLS))
+    holder.get()
+
+    def antes():
+        # Caminho antigo: grafo construído e compilado em toda requisição
+        build_agent(llm, TOOLS)
+
+    def depois():
+        # Caminho novo: agente reutilizado, apenas as variáveis do prompt mudam
+        holder.get()
+        prompt_variables()
+
+    resultados = {
+        "compilar_por_requisicao": medir(antes, iteracoes),
+        "agente_reutilizado": medir(depois, iteracoes),
+    }
+
+    print(f"Iterações: {iteracoes}")
+    for nome, r in resultados.items():
+        print(f"{nome:>26}: média {r['media_ms']:.3f} ms | p50 {r['p50_ms']:.3f} ms | p95 {r['p95_ms']:.3f} ms")
+
+    ganho = resultados["compilar_por_requisicao"]["media_ms"] - resultados["agente_reutilizado"]["media_ms"]
+    print(f"Overhead economizado por requisição: {ganho:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
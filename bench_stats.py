@@ -0,0 +1,26 @@
+"""
+Estatísticas comuns aos benchmarks (bench_suite.py e quantization.py).
+
+Módulo sem dependências para que importar só o resumo de latência não
+carregue o stub da OpenAI nem o resto da suíte.
+"""
+import statistics
+
+
+def percentis(valores_ms):
+    """Resumo de latência (ms): média, p50, p95, p99 e máximo por posto mais próximo."""
+    if not valores_ms:
+        return {"n": 0}
+    ordenados = sorted(valores_ms)
+
+    def p(q):
+        return ordenados[min(len(ordenados) - 1, max(0, int(round(q * len(ordenados))) - 1))]
+
+    return {
+        "n": len(ordenados),
+        "mean_ms": round(statistics.mean(ordenados), 3),
+        "p50_ms": round(p(0.50), 3),
+        "p95_ms": round(p(0.95), 3),
+        "p99_ms": round(p(0.99), 3),
+        "max_ms": round(ordenados[-1], 3),
+    }
@@ -0,0 +1,385 @@
+"""
+Suíte de benchmarks offline: nenhuma chamada à OpenAI, nenhum custo.
+
+O LLM e os embeddings são servidos pelo stub local (stub_openai.py), com
+latência e roteiro de ferramentas configuráveis. O banco padrão é um SQLite
+descartável com o backend de busca NumPy (o stand-in do pgvector); passe
+--database-url postgresql://... para medir contra um Postgres/pgvector
+descartável (o índice é refeito e as tabelas de embeddings são truncadas).
+Um banco que já tem documentos indexados é recusado, a não ser com
+--i-know-this-is-disposable.
+
+Cenários:
+    indexing    throughput da indexação (chunks/s) de um corpus sintético
+    retrieval   latência da busca em função do tamanho do corpus
+    latency     percentis de latência de /api/chat, requisições sequenciais
+    throughput  sessões concorrentes (várias mensagens cada): req/s e percentis
+
+Os resultados vão para um JSON (--output) que pode ser comparado com o de
+outra versão via --compare.
+
+Uso:
+    python bench_suite.py [--scenarios indexing,retrieval,latency,throughput]
+                          [--llm-latency-ms 300] [--requests 50] [--concurrency 8]
+                          [--output resultados.json] [--compare baseline.json]
+                          [--database-url postgresql://... [--i-know-this-is-disposable]]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import threading
+import urllib.request
+from datetime import datetime
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_stats import percentis
+from stub_openai import StubConfig, start_stub_server
+
+SCENARIOS = ("indexing", "retrieval", "latency", "throughput")
+QUESTIONS = [
+    "Quais tecnologias você domina?",
+    "Fale sobre sua experiência com Python.",
+    "Qual foi o tema do seu TCC?",
+    "Você já trabalhou com LangChain?",
+    "What databases have you used?",
+    "Como foi sua iniciação científica?",
+]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _corpus_sintetico(diretorio, arquivos, paragrafos, rng):
+    """Arquivos .md com nomes que caem nas coleções reais (currículo e orçamento)."""
+    palavras = ("python flask langchain postgres pgvector docker api rest dados projeto equipe "
+                "cliente sistema backend frontend nuvem teste desempenho pesquisa modelo").split()
+    for i in range(arquivos):
+        nome = f"curriculo_bench_{i}.md" if i % 4 else f"calcular_orcamento_de_software_{i}.md"
+        with open(os.path.join(diretorio, nome), "w", encoding="utf-8") as f:
+            for _ in range(paragrafos):
+                f.write(" ".join(rng.choice(palavras) for _ in range(120)) + "\n\n")
+
+
+# ===================== Cenários =====================
+
+def bench_indexing(args, data_dir, embeddings):
+    from indexing import run_indexing
+    inicio = time.perf_counter()
+    resumo = run_indexing(embeddings, data_dir=data_dir)
+    segundos = time.perf_counter() - inicio
+    chunks = resumo.get("added", 0)
+    return {
+        "files": args.corpus_files,
+        "chunks": chunks,
+        "seconds": round(segundos, 3),
+        "chunks_per_second": round(chunks / segundos, 1) if segundos else None,
+    }
+
+
+def bench_retrieval(args, work_dir):
+    import numpy as np
+    from database import EMBEDDING_DIM
+    from retrieval import COLLECTIONS
+
+    rng = np.random.default_rng(42)
+    consultas = rng.standard_normal((args.queries, EMBEDDING_DIM)).astype(np.float32)
+    k_by_name = {name: c.k for name, c in COLLECTIONS.items()}
+    nomes = list(COLLECTIONS)
+    resultados = {}
+
+    for tamanho in args.corpus_sizes:
+        vetores = rng.standard_normal((tamanho, EMBEDDING_DIM)).astype(np.float32)
+        # Linhas agrupadas por coleção, como no export do banco
+        colecoes = sorted(nomes[i % len(nomes)] for i in range(tamanho))
+        linhas = [
+            SimpleNamespace(id=i + 1, content=f"chunk {i}", source="bench.md", collection=colecoes[i],
+                            chunk_hash=f"{i:064x}", embedding=vetores[i])
+            for i in range(tamanho)
+        ]
+        backend, limpar = _backend_de_retrieval(args, work_dir, tamanho, linhas)
+        try:
+            backend.search(consultas[0].tolist(), k_by_name)  # aquecimento (carrega o snapshot / cache)
+            tempos = []
+            for consulta in consultas:
+                inicio = time.perf_counter()
+                backend.search(consulta.tolist(), k_by_name)
+                tempos.append((time.perf_counter() - inicio) * 1000)
+        finally:
+            limpar()
+        resultados[str(tamanho)] = percentis(tempos)
+        print(f"  retrieval {tamanho:>7} vetores: p50 {resultados[str(tamanho)]['p50_ms']} ms | "
+              f"p99 {resultados[str(tamanho)]['p99_ms']} ms")
+    return {"backend": args.retrieval_backend, "collections": len(nomes), "by_corpus_size": resultados}
+
+
+def _backend_de_retrieval(args, work_dir, tamanho, linhas):
+    if args.retrieval_backend == "numpy":
+        from vector_snapshot import NumpyBackend, write_snapshot_from_rows
+        diretorio = os.path.join(work_dir, f"snapshot-{tamanho}")
+        write_snapshot_from_rows(linhas, diretorio)
+        return NumpyBackend(diretorio), lambda: shutil.rmtree(diretorio, ignore_errors=True)
+
+    from sqlalchemy import text
+    from database import session_scope, ensure_vector_indexes
+    from indexing import bulk_insert_embeddings
+    from retrieval import PgVectorBackend
+
+    with session_scope() as db:
+        # Banco conferido em _conferir_banco_descartavel
+        db.execute(text("TRUNCATE document_embeddings, document_manifests"))
+        bulk_insert_embeddings(db, [
+            {"content": l.content, "source": l.source, "collection": l.collection, "chunk_hash": l.chunk_hash,
+             "embedding": l.embedding.tolist()}
+            for l in linhas
+        ])
+        db.commit()
+    ensure_vector_indexes(reindex=True)
+    return PgVectorBackend(), lambda: None
+
+
+def _post_chat(base_url, session_id, mensagem):
+    corpo = json.dumps({"message": mensagem, "session_id": session_id}).encode("utf-8")
+    requisicao = urllib.request.Request(f"{base_url}/api/chat", data=corpo,
+                                        headers={"Content-Type": "application/json"})
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(requisicao, timeout=120) as resposta:
+            resposta.read()
+            ok = resposta.status == 200
+    except Exception:
+        ok = False
+    return (time.perf_counter() - inicio) * 1000, ok
+
+
+def bench_latency(args, base_url):
+    tempos, erros = [], 0
+    for i in range(args.requests):
+        # Sessão nova a cada requisição: mede o caminho de primeiro turno
+        ms, ok = _post_chat(base_url, str(uuid.uuid4()), QUESTIONS[i % len(QUESTIONS)])
+        tempos.append(ms)
+        erros += not ok
+    return {**percentis(tempos), "errors": erros}
+
+
+def bench_throughput(args, base_url):
+    tempos, erros = [], 0
+    lock = threading.Lock()
+
+    def sessao(indice):
+        nonlocal erros
+        session_id = str(uuid.uuid4())
+        for turno in range(args.turns):
+            ms, ok = _post_chat(base_url, session_id, QUESTIONS[(indice + turno) % len(QUESTIONS)])
+            with lock:
+                tempos.append(ms)
+                erros += not ok
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(sessao, range(args.sessions)))
+    segundos = time.perf_counter() - inicio
+    return {
+        "concurrency": args.concurrency,
+        "sessions": args.sessions,
+        "turns_per_session": args.turns,
+        "seconds": round(segundos, 3),
+        "requests_per_second": round(len(tempos) / segundos, 2) if segundos else None,
+        **percentis(tempos),
+        "errors": erros,
+    }
+
+
+# ===================== Execução =====================
+
+def _configurar_ambiente(args, work_dir, stub_url):
+    """Variáveis lidas na importação dos módulos do app: precisam vir antes dos imports."""
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["OPENAI_BASE_URL"] = stub_url
+    os.environ["OPENAI_API_BASE"] = stub_url
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ["RETRIEVAL_BACKEND"] = args.retrieval_backend
+    os.environ["VECTOR_QUANTIZATION"] = args.vector_quantization
+    os.environ["VECTOR_SNAPSHOT_DIR"] = os.path.join(work_dir, "snapshot")
+    os.environ["EMBEDDING_CHECK_CTX_LENGTH"] = "false"  # sem download do BPE do tiktoken
+    os.environ["ANSWER_CACHE_ENABLED"] = "false"  # cada requisição deve passar pelo agente
+    os.environ["INDEX_ON_STARTUP"] = "off"
+
+
+def _conferir_banco_descartavel(args):
+    """Recusa um --database-url com documentos indexados: a suíte refaz o índice e trunca as tabelas."""
+    if not args.database_url or args.i_know_this_is_disposable:
+        return
+    from sqlalchemy import inspect, text
+    from database import engine
+
+    if not inspect(engine).has_table("document_manifests"):
+        return
+    with engine.connect() as conn:
+        documentos = conn.execute(text("SELECT count(*) FROM document_manifests")).scalar()
+    if documentos:
+        raise SystemExit(f"O banco de --database-url já tem {documentos} documentos indexados e a suíte apaga o "
+                         "índice. Use um banco descartável ou passe --i-know-this-is-disposable.")
+
+
+def _subir_app():
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    servidor = make_server("127.0.0.1", 0, create_app(), threaded=True)
+    threading.Thread(target=servidor.serve_forever, name="bench-app", daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_port}"
+
+
+def comparar(atual, anterior):
+    """Imprime a variação percentual das métricas numéricas entre duas execuções."""
+    def achatar(d, prefixo=""):
+        for chave, valor in d.items():
+            nome = f"{prefixo}{chave}"
+            if isinstance(valor, dict):
+                yield from achatar(valor, nome + ".")
+            elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                yield nome, valor
+
+    antes = dict(achatar(anterior["results"]))
+    print(f"\nComparação com {anterior['meta'].get('commit')} ({anterior['meta'].get('timestamp')}):")
+    for nome, valor in achatar(atual["results"]):
+        if nome in antes and antes[nome]:
+            variacao = (valor - antes[nome]) / antes[nome] * 100
+            print(f"  {nome:<55} {antes[nome]:>12} -> {valor:>12} ({variacao:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks offline do backend do portfólio.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20)
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--script", help="Roteiro de ferramentas do stub (JSON)")
+    parser.add_argument("--requests", type=int, default=50, help="Requisições do cenário latency")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--corpus-files", type=int, default=8)
+    parser.add_argument("--corpus-paragraphs", type=int, default=20)
+    parser.add_argument("--corpus-sizes", default="1000,5000,20000",
+                        type=lambda v: [int(x) for x in v.split(",") if x])
+    parser.add_argument("--queries", type=int, default=200, help="Consultas por tamanho no cenário retrieval")
+    parser.add_argument("--database-url", help="Banco descartável; padrão: SQLite temporário")
+    parser.add_argument("--i-know-this-is-disposable", action="store_true",
+                        help="Aceita um --database-url que já tem documentos indexados (serão apagados)")
+    parser.add_argument("--retrieval-backend", choices=("numpy", "pgvector"))
+    parser.add_argument("--vector-quantization", choices=("none", "halfvec", "binary"), default="none",
+                        help="Índices quantizados + re-ranking exato (só pgvector)")
+    parser.add_argument("--output")
+    parser.add_argument("--compare", help="JSON de uma execução anterior")
+    parser.add_argument("--verbose", action="store_true", help="Mantém os logs INFO do app")
+    args = parser.parse_args()
+
+    cenarios = [c for c in args.scenarios.split(",") if c]
+    desconhecidos = set(cenarios) - set(SCENARIOS)
+    if desconhecidos:
+        parser.error(f"cenários desconhecidos: {', '.join(sorted(desconhecidos))}")
+    if args.retrieval_backend is None:
+        args.retrieval_backend = "pgvector" if (args.database_url or "").startswith("postgresql") else "numpy"
+
+    script = None
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+    stub_config = StubConfig(args.llm_latency_ms, args.llm_jitter_ms, args.embedding_latency_ms,
+                             args.tokens_per_second, script=script, seed=42)
+    stub, stub_url = start_stub_server(stub_config)
+
+    work_dir = tempfile.mkdtemp(prefix="bench-")
+    _configurar_ambiente(args, work_dir, stub_url)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    resultados = {}
+    try:
+        _conferir_banco_descartavel(args)
+        from langchain_openai import OpenAIEmbeddings
+        from database import EMBEDDING_MODEL
+
+        embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, check_embedding_ctx_length=False)
+        data_dir = os.path.join(work_dir, "data")
+        os.makedirs(data_dir)
+        _corpus_sintetico(data_dir, args.corpus_files, args.corpus_paragraphs, random.Random(42))
+
+        # A indexação sempre roda: os cenários de chat precisam de chunks para as ferramentas
+        print("Indexando corpus sintético...")
+        indexacao = bench_indexing(args, data_dir, embeddings)
+        if "indexing" in cenarios:
+            resultados["indexing"] = indexacao
+            print(f"  {indexacao['chunks']} chunks em {indexacao['seconds']} s "
+                  f"({indexacao['chunks_per_second']} chunks/s)")
+
+        if "latency" in cenarios or "throughput" in cenarios:
+            servidor, base_url = _subir_app()
+            try:
+                _post_chat(base_url, str(uuid.uuid4()), QUESTIONS[0])  # aquecimento
+                if "latency" in cenarios:
+                    print("Latência sequencial de /api/chat...")
+                    resultados["latency"] = bench_latency(args, base_url)
+                    print(f"  p50 {resultados['latency']['p50_ms']} ms | p95 {resultados['latency']['p95_ms']} ms | "
+                          f"p99 {resultados['latency']['p99_ms']} ms")
+                if "throughput" in cenarios:
+                    print("Sessões concorrentes...")
+                    resultados["throughput"] = bench_throughput(args, base_url)
+                    print(f"  {resultados['throughput']['requests_per_second']} req/s | "
+                          f"p99 {resultados['throughput']['p99_ms']} ms")
+            finally:
+                servidor.shutdown()
+
+        # Por último: com pgvector o cenário trunca as tabelas de embeddings
+        if "retrieval" in cenarios:
+            print("Latência de busca por tamanho de corpus...")
+            resultados["retrieval"] = bench_retrieval(args, work_dir)
+    finally:
+        stub.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    saida = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": "postgresql" if (args.database_url or "").startswith("postgresql") else "sqlite",
+            "retrieval_backend": args.retrieval_backend,
+            "vector_quantization": args.vector_quantization,
+            "stub": {"llm_latency_ms": args.llm_latency_ms, "llm_jitter_ms": args.llm_jitter_ms,
+                     "embedding_latency_ms": args.embedding_latency_ms,
+                     "tokens_per_second": args.tokens_per_second, "requests": stub_config.requests},
+        },
+        "results": resultados,
+    }
+    caminho = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "bench",
+                                          f"results-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump(saida, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados gravados em {caminho}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            comparar(saida, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,36 +1,130 @@
 import os
 import json
 import uuid
+import hashlib
+import functools
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 import logging # Adicionar Import
-from sqlalchemy import or_
 
 # Configuração de Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolNode, tools_condition
-from typing import Annotated, TypedDict
-from langgraph.graph.message import add_messages
-
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk
 from langchain_core.tools import tool
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from pypdf import PdfReader
-from database import init_db, get_db, ChatSession, ChatMessage, DocumentEmbedding
-import pdfplumber
+from database import search_params, EMBEDDING_MODEL, EMBEDDING_CHECK_CTX_LENGTH
+from request_db import get_request_db
+from agent import AgentHolder, build_agent, prompt_variables, SYSTEM_PROMPT
+from embedding_cache import CachedEmbeddings
+from retrieval import COLLECTIONS, RetrievalEngine
+from near_duplicates import strip_overlaps
+from answer_cache import AnswerCache
+from admission import Overloaded, current_session, embedding_limiter, llm_limiter
+from prefetch import Prefetch, current_prefetch
+from chat_store import ChatStore
+from telemetry import TracingCallbackHandler, TOOL_ERRORS, current_span, register_collector
+from context_budget import (ContextBuilder, ToolBudget, current_tool_budget, pack_chunks, usage_report,
+                            CONTEXT_HISTORY_MESSAGES)
 
 chat_bp = Blueprint('chat', __name__)
 
+# Paginação do histórico (/chat/history?limit=&before=)
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = 200
+
+# Retentativas do SDK da OpenAI: por padrão nenhuma. O controle de admissão precisa ver
+# cada 429 (AIMD + Retry-After), e uma retentativa escondida seguraria a vaga da fila
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "0"))
+
 # Configuração do modelo e embeddings
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# stream_usage: o uso de tokens também vem no modo streaming
+# include_response_headers: cabeçalhos x-ratelimit-* alimentam o controle de admissão
+llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, stream_usage=True, include_response_headers=True,
+                 max_retries=OPENAI_MAX_RETRIES)
+base_embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, check_embedding_ctx_length=EMBEDDING_CHECK_CTX_LENGTH,
+                                   max_retries=OPENAI_MAX_RETRIES)
+# Consultas das ferramentas passam pelo cache; a indexação usa o modelo direto
+embeddings = CachedEmbeddings(base_embeddings, model_name=EMBEDDING_MODEL, limiter=embedding_limiter)
+retrieval_engine = RetrievalEngine(embeddings)
+answer_cache = AnswerCache(embeddings)
+chat_store = ChatStore()  # CHAT_WRITE_BEHIND=true grava as mensagens em lote
+context_builder = ContextBuilder(llm, limiter=llm_limiter, store=chat_store)
+
+def _metricas_caches():
+    """Acertos/erros dos caches e fila de escrita, lidos na coleta de /api/metrics."""
+    embedding = embeddings.stats()
+    sessions = chat_store.stats()["session_cache"] or {"hits": 0, "misses": 0, "size": 0}
+    return [
+        ("cache_hits_total", "counter", "Acertos por cache.", {"cache": "embedding_memory"}, embedding["memory_hits"]),
+        ("cache_hits_total", "counter", "Acertos por cache.", {"cache": "embedding_persistent"}, embedding["persistent_hits"]),
+        ("cache_hits_total", "counter", "Acertos por cache.", {"cache": "answer"}, answer_cache.counters["hits"]),
+        ("cache_hits_total", "counter", "Acertos por cache.", {"cache": "session"}, sessions["hits"]),
+        ("cache_misses_total", "counter", "Falhas por cache.", {"cache": "embedding"}, embedding["misses"]),
+        ("cache_misses_total", "counter", "Falhas por cache.", {"cache": "answer"}, answer_cache.counters["misses"]),
+        ("cache_misses_total", "counter", "Falhas por cache.", {"cache": "session"}, sessions["misses"]),
+        ("cache_hit_ratio", "gauge", "Taxa de acerto por cache.", {"cache": "embedding"}, embedding["hit_rate"]),
+        ("cache_hit_ratio", "gauge", "Taxa de acerto por cache.", {"cache": "answer"}, _taxa(answer_cache.counters)),
+        ("cache_hit_ratio", "gauge", "Taxa de acerto por cache.", {"cache": "session"}, _taxa(sessions)),
+        ("session_cache_entries", "gauge", "Sessões no cache de sessões.", {}, sessions["size"]),
+        ("chat_write_queue", "gauge", "Itens na fila de escrita do chat.", {}, chat_store.stats()["queued"]),
+    ]
+
+def _taxa(counters):
+    total = counters["hits"] + counters["misses"]
+    return counters["hits"] / total if total else 0.0
+
+register_collector(_metricas_caches)
+
+# Banco e índice NÃO são inicializados no import (cold start rápido):
+# rode `python indexing.py` (ou INDEX_ON_STARTUP=background) para criar as tabelas e indexar data/.
+
+def _formatar_resultados(colecao, query, results):
+    if not results:
+        logger.warning(f"{colecao.label}: Nenhuma informação encontrada para query: {query}")
+        return colecao.empty_message
+
+    logger.info(f"{colecao.label}: {len(results)} chunks encontrados para query: {query}")
+    # Limite de tokens por saída de ferramenta e da reserva da execução (os chunks já vêm em ordem de relevância)
+    budget = current_tool_budget.get()
+    # Sem o trecho que vizinhos do mesmo arquivo repetem (overlap do splitter)
+    contents = strip_overlaps([doc.content for doc in results])
+    return budget.pack(contents) if budget else pack_chunks(contents)
+
+def _erro_consulta(colecao, ferramenta, e):
+    logger.error(f"Erro ao consultar {colecao.label}: {e}", exc_info=True)
+    TOOL_ERRORS.inc(tool=ferramenta)
+    return f"Erro ao consultar {colecao.label}: {str(e)}"
+
+def _consultar_colecao(nome, query, ferramenta):
+    """Busca uma coleção no motor de recuperação e formata os chunks para o LLM."""
+    colecao = COLLECTIONS[nome]
+    try:
+        # Resultado da busca especulativa, se ela acertou a coleção e a consulta
+        prefetch = current_prefetch.get()
+        results = prefetch.take(nome, query) if prefetch else None
+        if results is None:
+            results = retrieval_engine.search(query, [nome])[nome]
+        return _formatar_resultados(colecao, query, results)
+    except Overloaded:
+        raise  # Sem capacidade: a requisição inteira vira 429, não um texto de erro para o LLM
+    except Exception as e:
+        return _erro_consulta(colecao, ferramenta, e)
 
-# Inicializar Banco de Dados
-init_db()
+async def _aconsultar_colecao(nome, query, ferramenta):
+    """Versão assíncrona (modo ASGI): embedding e busca sem prender uma thread."""
+    colecao = COLLECTIONS[nome]
+    try:
+        prefetch = current_prefetch.get()
+        results = await prefetch.atake(nome, query) if prefetch else None
+        if results is None:
+            results = (await retrieval_engine.asearch(query, [nome]))[nome]
+        return _formatar_resultados(colecao, query, results)
+    except Overloaded:
+        raise
+    except Exception as e:
+        return _erro_consulta(colecao, ferramenta, e)
 
 @tool
 def consultar_tcc(query: str):
@@ -38,28 +132,7 @@ def consultar_tcc(query: str):
     Ferramenta OBRIGATÓRIA para buscar informações sobre o Trabalho de Conclusão de Curso (TCC), artigo final ou monografia.
     A busca é restrita EXCLUSIVAMENTE ao arquivo: artigo_base--abtn.pdf.
     """
-    try:
-        db = next(get_db())
-        query_vector = embeddings.embed_query(query)
-        
-        # Filtra pelo arquivo do TCC e ordena por similaridade
-        results = db.query(DocumentEmbedding).filter(
-            DocumentEmbedding.source == 'artigo_base--abtn.pdf'
-        ).order_by(
-            DocumentEmbedding.embedding.l2_distance(query_vector)
-        ).limit(5).all()
-        
-        if not results:
-            logger.warning(f"TCC: Nenhuma informação encontrada para query: {query}")
-            return "Nenhuma informação encontrada no TCC sobre esse tema."
-            
-        logger.info(f"TCC: {len(results)} chunks encontrados para query: {query}")
-        return "\n\n".join([doc.content for doc in results])
-    except Exception as e:
-        logger.error(f"Erro ao consultar TCC: {e}", exc_info=True)
-        return f"Erro ao consultar TCC: {str(e)}"
-    finally:
-        db.close()
+    return _consultar_colecao("tcc", query, "consultar_tcc")
 
 @tool
 def consultar_iniciacao_cientifica(query: str):
@@ -67,28 +140,7 @@ def consultar_iniciacao_cientifica(query: str):
     Ferramenta OBRIGATÓRIA para buscar informações sobre a Iniciação Científica (IC) ou Potencial Hidrodinâmico.
     A busca é restrita EXCLUSIVAMENTE ao arquivo: potencial_hidrodinamica_completo.pdf.
     """
-    try:
-        db = next(get_db())
-        query_vector = embeddings.embed_query(query)
-        
-        # Filtra pelo arquivo da IC
-        results = db.query(DocumentEmbedding).filter(
-            DocumentEmbedding.source == 'potencial_hidrodinamica_completo.pdf'
-        ).order_by(
-            DocumentEmbedding.embedding.l2_distance(query_vector)
-        ).limit(5).all()
-        
-        if not results:
-            logger.warning(f"IC: Nenhuma informação encontrada para query: {query}")
-            return "Nenhuma informação encontrada na Iniciação Científica sobre esse tema."
-            
-        logger.info(f"IC: {len(results)} chunks encontrados para query: {query}")
-        return "\n\n".join([doc.content for doc in results])
-    except Exception as e:
-        logger.error(f"Erro ao consultar IC: {e}", exc_info=True)
-        return f"Erro ao consultar IC: {str(e)}"
-    finally:
-        db.close()
+    return _consultar_colecao("ic", query, "consultar_iniciacao_cientifica")
 
 @tool
 def consultar_curriculo(query: str):
@@ -96,32 +148,7 @@ def consultar_curriculo(query: str):
     Ferramenta OBRIGATÓRIA para buscar informações sobre Experiência Profissional, Habilidades, Contato, Resumo e Histórico do candidato.
     A busca abrange todos os arquivos de currículo disponíveis (ex: backend e fullstack).
     """
-    try:
-        db = next(get_db())
-        query_vector = embeddings.embed_query(query)
-        
-        # Filtra por arquivos que contenham "curriculo" no nome (case-insensitive)
-        # Usando ilike com curingas para capturar variações como 'Currículo' ou 'curriculo'
-        results = db.query(DocumentEmbedding).filter(
-            or_(
-                DocumentEmbedding.source.ilike('%curriculo%'),
-                DocumentEmbedding.source.ilike('%currículo%')
-            )
-        ).order_by(
-            DocumentEmbedding.embedding.l2_distance(query_vector)
-        ).limit(10).all()
-        
-        if not results:
-            logger.warning(f"Curriculo: Nenhuma informação encontrada para query: {query}")
-            return "Nenhuma informação encontrada nos currículos sobre esse tema."
-            
-        logger.info(f"Curriculo: {len(results)} chunks encontrados para query: {query}")
-        return "\n\n".join([doc.content for doc in results])
-    except Exception as e:
-        logger.error(f"Erro ao consultar Curriculo: {e}", exc_info=True)
-        return f"Erro ao consultar Currículos: {str(e)}"
-    finally:
-        db.close()
+    return _consultar_colecao("curriculo", query, "consultar_curriculo")
 
 @tool
 def calcular_orcamento_software(query: str):
@@ -136,15 +163,7 @@ def calcular_orcamento_software(query: str):
     - Premium (equipe sênior)
     """
     try:
-        db = next(get_db())
-        query_vector = embeddings.embed_query(query)
-        
-        # Filtra pelo arquivo de orçamento
-        results = db.query(DocumentEmbedding).filter(
-            DocumentEmbedding.source == 'calcular_orcamento_de_software.md'
-        ).order_by(
-            DocumentEmbedding.embedding.l2_distance(query_vector)
-        ).limit(5).all()
+        results = retrieval_engine.search(query, ["orcamento"])["orcamento"]
         
         if not results:
             return """Não encontrei informações específicas sobre cálculo de orçamento no momento. 
@@ -235,14 +254,15 @@ Vou te ajudar a escolher a melhor opção e planejar seu projeto de software!"""
         
         return resposta + cta
         
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Erro ao calcular orçamento: {e}", exc_info=True)
+        TOOL_ERRORS.inc(tool="calcular_orcamento_software")
         return f"""Erro ao calcular orçamento: {str(e)}
 
 Entre em contato comigo diretamente para um orçamento personalizado:
 📱 **WhatsApp:** [+55 (73) 99806-1168](https://wa.me/5573998061168)"""
-    finally:
-        db.close()
 
 @tool
 def obter_tempo_experiencia(data_inicio: str) -> str:
@@ -280,75 +300,76 @@ def obter_tempo_experiencia(data_inicio: str) -> str:
         return " e ".join(resultado)
     except Exception as e:
         logger.error(f"Erro ao calcular tempo de experiência: {e}")
+        TOOL_ERRORS.inc(tool="obter_tempo_experiencia")
         return "Erro ao calcular o tempo de experiência. Verifique o formato da data."
 
-def init_vector_store():
-
-    """Escaneia a pasta de dados e indexa arquivos novos no banco."""
-    db = next(get_db())
-    data_dir = os.path.join(os.path.dirname(__file__), '../data')
-    
-    if not os.path.exists(data_dir):
-        print(f"Diretório de dados não encontrado: {data_dir}")
-        return
-
-    # Extensões suportadas
-    supported_extensions = ('.pdf', '.txt', '.md')
-    
-    # Listar arquivos
-    files = [f for f in os.listdir(data_dir) if f.lower().endswith(supported_extensions)]
-    
-    for filename in files:
-        # Verificar se já processado
-        if db.query(DocumentEmbedding).filter_by(source=filename).first():
-            print(f"Skipping {filename}: já indexado.")
-            continue
-            
-        file_path = os.path.join(data_dir, filename)
-        print(f"Processando novo arquivo: {filename}...")
-        
-        try:
-            text = ""
-            if filename.lower().endswith('.pdf'):
-                with pdfplumber.open(file_path) as pdf:
-                    for page in pdf.pages:
-                        extracted = page.extract_text()
-                        if extracted:
-                            text += extracted + "\n"
-            else:
-                # Ler arquivos de texto (txt, md)
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    text = f.read()
-            
-            if not text.strip():
-                logger.warning(f"Aviso: {filename} está vazio ou ilegível.")
-                continue
-
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-            chunks = text_splitter.split_text(text)
-            
-            logger.info(f"  -> Gerando {len(chunks)} embeddings para {filename}...")
-            
-            embeddings_to_add = []
-            for chunk in chunks:
-                vector = embeddings.embed_query(chunk)
-                embeddings_to_add.append(DocumentEmbedding(
-                    content=chunk,
-                    source=filename,
-                    embedding=vector
-                ))
-            
-            # Batch insert
-            db.add_all(embeddings_to_add)
-            db.commit()
-            logger.info(f"  -> Sucesso: {filename} salvo.")
-
-        except Exception as e:
-            logger.error(f"  -> Erro ao processar {filename}: {e}", exc_info=True)
-            db.rollback()
+# Versões assíncronas das buscas: com ainvoke/astream o ToolNode executa as chamadas da mesma
+# rodada concorrentemente no event loop. As demais ferramentas rodam no executor de threads.
+for _ferramenta, _colecao in ((consultar_tcc, "tcc"), (consultar_iniciacao_cientifica, "ic"),
+                              (consultar_curriculo, "curriculo")):
+    _ferramenta.coroutine = functools.partial(_aconsultar_colecao, _colecao, ferramenta=_ferramenta.name)
+
+TOOLS = [consultar_curriculo, consultar_tcc, consultar_iniciacao_cientifica, calcular_orcamento_software, obter_tempo_experiencia]
+
+# Agente compilado uma única vez por processo e reutilizado entre requisições
+_agent_holder = AgentHolder(lambda: build_agent(llm, TOOLS, limiter=llm_limiter))
+
+def get_agent():
+    return _agent_holder.get()
+
+def warmup_agent():
+    """Compila o agente antecipadamente para que a primeira requisição não pague esse custo."""
+    get_agent()
+    logger.info("Agente LangGraph pré-compilado.")
+
+def _cursor(message):
+    """next_cursor: '<timestamp ISO>_<id>' da mensagem mais antiga da página (id vazio se ainda na fila)."""
+    return f"{message.timestamp.isoformat()}_{message.id if message.id is not None else ''}"
+
+def _parametros_historico(args):
+    """limit (1..HISTORY_MAX_PAGE_SIZE) e cursor `before` (ver _cursor) como (timestamp, id)."""
+    limit = args.get('limit', type=int) or HISTORY_PAGE_SIZE
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    before = args.get('before')
+    if not before:
+        return limit, None
+    timestamp, separator, message_id = before.partition('_')
+    if not separator:
+        # Cursor antigo, só com o timestamp: estritamente anterior a ele
+        return limit, (datetime.fromisoformat(timestamp), 0)
+    return limit, (datetime.fromisoformat(timestamp), int(message_id) if message_id else None)
+
+def _pagina_historico(db, session_id, limit, before, if_none_match):
+    """
+    Página do histórico e ETag fraco. Retorna (etag, corpo); corpo é None quando
+    `if_none_match(etag)` indica que o cliente já tem a versão atual (304).
+    """
+    # ETag a partir de uma consulta agregada barata: polling sem mudanças recebe 304 sem carregar a página
+    version = chat_store.version(db, session_id)
+    etag = hashlib.sha1(f"{session_id}|{before}|{limit}|{version}".encode("utf-8")).hexdigest()
+    if if_none_match(etag):
+        return etag, None
+
+    # Uma mensagem a mais indica se existe página anterior
+    messages = chat_store.recent_messages(db, session_id, limit=limit + 1, before=before)
+    has_more = len(messages) > limit
+    messages = messages[-limit:]
+
+    history = []
+    for msg in messages:
+        # Mapear 'assistant' para 'ai' para compatibilidade com frontend
+        role = 'ai' if msg.role == 'assistant' else msg.role
+        history.append({
+            "role": role,
+            "content": msg.content,
+            "timestamp": msg.timestamp.isoformat()
+        })
 
-# Carregar dados ao iniciar
-init_vector_store()
+    return etag, {
+        "history": history,
+        "has_more": has_more,
+        "next_cursor": _cursor(messages[0]) if has_more else None
+    }
 
 @chat_bp.route('/chat/history', methods=['GET'])
 def get_history():
@@ -356,25 +377,126 @@ def get_history():
     if not session_id:
         return jsonify({"history": []})
 
-    db = next(get_db())
     try:
-        messages = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)\
-                     .order_by(ChatMessage.timestamp.asc()).all()
-        
-        history = []
-        for msg in messages:
-            # Mapear 'assistant' para 'ai' para compatibilidade com frontend
-            role = 'ai' if msg.role == 'assistant' else msg.role
-            history.append({
-                "role": role,
-                "content": msg.content
-            })
-            
-        return jsonify({"history": history})
+        limit, before = _parametros_historico(request.args)
+    except ValueError:
+        return jsonify({"error": "Cursor 'before' inválido"}), 400
+
+    db = get_request_db()
+    try:
+        etag, body = _pagina_historico(db, session_id, limit, before, request.if_none_match.contains_weak)
+        if body is None:
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+
+        response = jsonify(body)
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        db.close()
+
+def _sse(evento, dados):
+    """Formata um evento Server-Sent Events."""
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+def _parametros_busca(data):
+    """ef_search / probes opcionais enviados no corpo da requisição."""
+    params = {}
+    for key in ("ef_search", "probes"):
+        value = data.get(key)
+        if isinstance(value, int) and 0 < value <= 1000:
+            params[key] = value
+    return params or None
+
+def _preparar_conversa(db, session_id, user_message):
+    """
+    Garante a sessão, salva a mensagem do usuário e monta o estado inicial do agente
+    dentro do orçamento de tokens. Retorna (estado_inicial, primeiro_turno, relatório_de_tokens).
+    """
+    # Verificar/Criar Sessão e salvar mensagem do usuário (síncrono ou write-behind)
+    chat_store.ensure_session(db, session_id)
+    chat_store.add_message(db, session_id, "user", user_message)
+
+    # Recuperar Histórico Recente (inclui o que ainda está na fila de escrita e termina na mensagem atual)
+    previous_messages_objs = chat_store.recent_messages(db, session_id, limit=CONTEXT_HISTORY_MESSAGES)
+
+    variables = prompt_variables()
+    context_messages, context_report = context_builder.build(
+        db, session_id, previous_messages_objs, SYSTEM_PROMPT.format(**variables)
+    )
+
+    initial_state = {
+        "messages": context_messages,
+        **variables,
+    }
+    # Primeiro turno: a única mensagem da sessão é a que acabou de ser salva
+    return initial_state, len(previous_messages_objs) == 1, context_report
+
+def _config_execucao():
+    """Callbacks de tracing/métricas (LLM, ferramentas e passos do grafo) para esta execução."""
+    return {"callbacks": [TracingCallbackHandler(current_span.get())]}
+
+def _relatorio_tokens(session_id, context_report, messages):
+    """Tokens estimados do contexto montado + uso real informado pela API, para log e resposta."""
+    usage = {"context": context_report, **usage_report(messages)}
+    logger.info(f"Tokens da sessão {session_id}: contexto {context_report['context']} "
+                f"(histórico {context_report['history_messages']} msgs, {context_report['dropped_messages']} fora), "
+                f"entrada {usage['input_tokens']}, saída {usage['output_tokens']} em {usage['llm_calls']} chamadas")
+    return usage
+
+def _admitir(session_id):
+    """Sessão da requisição (justiça na fila de admissão) e falha rápida se o LLM não tem como atender."""
+    current_session.set(session_id)
+    llm_limiter.check()
+
+def _sobrecarga(e):
+    """Corpo e cabeçalhos da resposta 429 quando o controle de admissão recusa a requisição."""
+    logger.warning(f"Requisição recusada pelo controle de admissão: {e}")
+    return ({"error": "Servidor ocupado, tente novamente em instantes", "retry_after": e.retry_after},
+            {"Retry-After": str(e.retry_after)})
+
+def _busca_especulativa(user_message, assincrona=False):
+    """Dispara a busca adiantada, a menos que os embeddings já estejam no limite (especulação é a primeira a ceder)."""
+    if embedding_limiter.saturated():
+        return None
+    return (Prefetch.astart if assincrona else Prefetch.start)(retrieval_engine, user_message)
+
+def _salvar_resposta(db, session_id, response_content):
+    chat_store.add_message(db, session_id, "assistant", response_content)
+
+class _EventosStream:
+    """Traduz o stream do grafo (modos messages + updates) em eventos SSE; usado pelo Flask e pelo ASGI."""
+
+    def __init__(self):
+        self.tokens = []
+        self.final_content = None
+        self.graph_messages = []
+
+    def traduzir(self, modo, payload):
+        if modo == "messages":
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") == "chatbot" and isinstance(chunk, AIMessageChunk) and chunk.content:
+                self.tokens.append(chunk.content)
+                yield _sse("token", {"content": chunk.content})
+            return
+
+        # modo == "updates": mensagens completas produzidas por cada nó
+        for node, update in payload.items():
+            for msg in (update or {}).get("messages", []):
+                self.graph_messages.append(msg)
+                if node == "chatbot":
+                    if msg.tool_calls:
+                        for call in msg.tool_calls:
+                            yield _sse("tool_start", {"id": call["id"], "name": call["name"], "args": call["args"]})
+                    else:
+                        self.final_content = msg.content
+                elif node == "tools":
+                    yield _sse("tool_end", {"id": msg.tool_call_id, "name": msg.name, "status": msg.status})
+
+    def resposta(self):
+        return self.final_content if self.final_content is not None else "".join(self.tokens)
 
 @chat_bp.route('/chat', methods=['POST'])
 def chat():
@@ -391,124 +513,145 @@ def chat():
     if not session_id:
         session_id = str(uuid.uuid4())
 
-    db = next(get_db())
+    # Ajuste fino da busca vetorial só para esta requisição
+    search_params.set(_parametros_busca(data))
+
+    db = get_request_db()
 
     try:
-        # Verificar/Criar Sessão
-        session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-        if not session:
-            session = ChatSession(id=session_id)
-            db.add(session)
-            db.commit()
-
-        # Salvar mensagem do usuário
-        user_msg_db = ChatMessage(session_id=session_id, role="user", content=user_message)
-        db.add(user_msg_db)
-        db.commit()
-
-        # Recuperar Histórico Recente
-        recent_msgs = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)\
-                        .order_by(ChatMessage.timestamp.desc()).limit(10).all()
-        previous_messages_objs = recent_msgs[::-1]
-        
-        context_messages = []
-        for msg in previous_messages_objs:
-            if msg.role == "user":
-                context_messages.append(HumanMessage(content=msg.content))
-            elif msg.role == "assistant":
-                context_messages.append(AIMessage(content=msg.content))
-
-        # Prompt base
-        now = datetime.now()
-        data_extenso = now.strftime("%d/%m/%Y")
-        dia_semana = now.strftime("%A")
-        
-        system_instruction = f"""Você é Gustavo Mota Macedo.
-### CONTEXTO TEMPORAL CRÍTICO ###
-- Data de Hoje: {data_extenso} ({dia_semana})
-- Sua Localização Atual: São Paulo, Brasil (Fuso Horário BRT)
-
-### DIRETRIZES DE RACIOCÍNIO (ReAct) ###
-Ao receber uma pergunta, você deve pensar passo a passo:
-1. **Thought (Raciocínio):** O que eu preciso saber para responder isso? Qual ferramenta devo usar?
-2. **Action (Ação):** Acionar a ferramenta necessária. Você pode acionar várias em sequência se a primeira não retornar tudo que precisa.
-3. **Observation (Observação):** O resultado me permite responder completamente? Se o usuário fala MÚLTIPLOS TÓPICOS, busque todos.
-4. **Considerar o Tempo**: Se o usuário perguntar "há quanto tempo", chame OBRIGATORIAMENTE a ferramenta `obter_tempo_experiencia` passando a data que encontrou para que o cálculo seja exato, baseado na Data de Hoje.
-5. **Priorizar o Recente**: Dê mais peso a informações recentes (próximas a {now.year}) ou atuações descritas como 'Atual'.
-
-=== REGRAS DE IDIOMA (ESTRITAS E INVIOLÁVEIS) ===
-VOCÊ ESTÁ PROIBIDO DE FALAR QUALQUER IDIOMA QUE NÃO SEJA PORTUGUÊS OU INGLÊS.
-SE O USUÁRIO FALAR ESPANHOL, FRANCÊS, ITALIANO, ETC:
--> IGNORE O IDIOMA DELE E RESPONDA DIRETO EM INGLÊS.
-        
-=== REGRAS DE CONTEÚDO (NUNCA VIOLE) ===
-1. VOCÊ NÃO PODE INVENTAR INFORMAÇÕES
-2. VOCÊ SÓ PODE RESPONDER COM BASE NOS RESULTADOS DAS FERRAMENTAS
-3. SE A FERRAMENTA NÃO RETORNAR INFORMAÇÃO, VOCÊ DEVE DIZER QUE NÃO SABE
-
-=== DIRETRIZES DE VENDAS E RECRUTAMENTO (PRIORIDADE MÁXIMA) ===
-Se você identificar que o usuário é um **Recrutador** ou **Cliente Potencial**:
-1. **Adote uma postura proativa e entusiasta.**
-2. **REDIRECIONE PARA O WHATSAPP IMEDIATAMENTE.**
-Exemplo: "Isso soa ótimo! Como hoje é {dia_semana} e estou em São Paulo, se você me chamar no WhatsApp agora, é provável que eu te responda rapidamente! Vamos conversar?"
-Link direto: `https://wa.me/5573998061168`
-
-=== GESTÃO DE CONHECIMENTO ===
-- **Curriculo, habilidades, experiência profissional e contato**: `consultar_curriculo`
-- **TCC, Monografia, trabalho de conclusão**: `consultar_tcc`
-- **IC (Iniciação Científica), Hidrodinâmica, pesquisa**: `consultar_iniciacao_cientifica`
-- **Orçamento de software, estimativas, preço**: `calcular_orcamento_software`
-- **Cálculo de tempo de experiência**: `obter_tempo_experiencia`
-
-LEMBRE-SE: É MELHOR DIZER "NÃO SEI" DO QUE INVENTAR INFORMAÇÕES!
-"""
-        
-        # Construir estado inicial do LangGraph
-        messages = [SystemMessage(content=system_instruction)] + context_messages + [HumanMessage(content=user_message)]
-        
-        # Configurar Agent
-        tools = [consultar_curriculo, consultar_tcc, consultar_iniciacao_cientifica, calcular_orcamento_software, obter_tempo_experiencia]
-        llm_with_tools = llm.bind_tools(tools)
-        
-        # Criar nós do Grafo
-        class GraphState(TypedDict):
-            messages: Annotated[list, add_messages]
+        _admitir(session_id)
+        initial_state, is_first_turn, context_report = _preparar_conversa(db, session_id, user_message)
+        graph_messages = []
+        
+        # Perguntas de primeiro turno podem ser respondidas pelo cache semântico (sem LLM)
+        cacheable = answer_cache.is_eligible(user_message, is_first_turn)
+        response_content = answer_cache.lookup(user_message) if cacheable else None
+        
+        if response_content is None:
+            # Busca das coleções prováveis em paralelo com o primeiro turno do LLM
+            prefetch = _busca_especulativa(user_message)
+            prefetch_token = current_prefetch.set(prefetch)
+            # Reserva de tokens das ferramentas para toda a execução (não só por chamada)
+            budget_token = current_tool_budget.set(ToolBudget(context_builder.tool_reserve))
+            try:
+                # Executar a rede (O loop ReAct) com o agente pré-compilado
+                final_state = get_agent().invoke(initial_state, config=_config_execucao())
+            finally:
+                current_tool_budget.reset(budget_token)
+                current_prefetch.reset(prefetch_token)
+                if prefetch:
+                    prefetch.finish()
+            graph_messages = final_state["messages"]
             
-        def chatbot(state: GraphState):
-            return {"messages": [llm_with_tools.invoke(state["messages"])]}
+            # O último message será do assistente
+            response_content = graph_messages[-1].content
             
-        # Compilar o LangGraph
-        graph_builder = StateGraph(GraphState)
-        graph_builder.add_node("chatbot", chatbot)
-        
-        tool_node = ToolNode(tools=tools)
-        graph_builder.add_node("tools", tool_node)
-        
-        graph_builder.add_conditional_edges("chatbot", tools_condition)
-        graph_builder.add_edge("tools", "chatbot")
-        graph_builder.set_entry_point("chatbot")
-        
-        app = graph_builder.compile()
-        
-        # Executar a rede (O loop ReAct)
-        final_state = app.invoke({"messages": messages})
-        
-        # O último message será do assistente
-        response_content = final_state["messages"][-1].content
+            if cacheable:
+                answer_cache.store(user_message, response_content, graph_messages)
         
         # Salvar resposta do assistente no banco
-        ai_msg_db = ChatMessage(session_id=session_id, role="assistant", content=response_content)
-        db.add(ai_msg_db)
-        db.commit()
+        _salvar_resposta(db, session_id, response_content)
         
         return jsonify({
             "response": response_content,
-            "session_id": session_id
+            "session_id": session_id,
+            "usage": _relatorio_tokens(session_id, context_report, graph_messages)
         })
+    except Overloaded as e:
+        db.rollback()
+        body, headers = _sobrecarga(e)
+        return jsonify(body), 429, headers
     except Exception as e:
         logger.critical(f"Erro crítico ao processar mensagem: {e}", exc_info=True)
+        db.rollback()
         return jsonify({"error": "Erro interno", "details": str(e)}), 500
-    finally:
-        db.close()
 
+@chat_bp.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Versão em streaming (SSE) do /chat.
+    Eventos: session, token, tool_start, tool_end, done e error.
+    """
+    data = request.get_json()
+    user_message = data.get('message')
+    session_id = data.get('session_id')
+    logger.info(f"Nova requisição de chat (stream) recebida. Session ID: {session_id}")
+
+    if not user_message:
+        logger.warning("Tentativa de chat sem mensagem.")
+        return jsonify({"error": "Mensagem não fornecida"}), 400
+
+    if not session_id:
+        session_id = str(uuid.uuid4())
+
+    search_params.set(_parametros_busca(data))
+
+    # A sessão da requisição continua viva durante o stream (stream_with_context)
+    db = get_request_db()
+    try:
+        _admitir(session_id)
+        initial_state, is_first_turn, context_report = _preparar_conversa(db, session_id, user_message)
+        cacheable = answer_cache.is_eligible(user_message, is_first_turn)
+        cached_response = answer_cache.lookup(user_message) if cacheable else None
+    except Overloaded as e:
+        db.rollback()
+        body, headers = _sobrecarga(e)
+        return jsonify(body), 429, headers
+    except Exception as e:
+        logger.critical(f"Erro crítico ao processar mensagem: {e}", exc_info=True)
+        db.rollback()
+        return jsonify({"error": "Erro interno", "details": str(e)}), 500
+
+    # Capturado aqui: o span raiz da requisição é o pai dos spans do grafo
+    config = _config_execucao()
+
+    def gerar_eventos():
+        eventos = _EventosStream()
+        try:
+            yield _sse("session", {"session_id": session_id})
+
+            if cached_response is not None:
+                # Resposta do cache semântico: o grafo não é executado
+                _salvar_resposta(db, session_id, cached_response)
+                yield _sse("token", {"content": cached_response})
+                yield _sse("done", {"response": cached_response, "session_id": session_id,
+                                    "usage": _relatorio_tokens(session_id, context_report, [])})
+                return
+
+            prefetch = _busca_especulativa(user_message)
+            prefetch_token = current_prefetch.set(prefetch)
+            # Reserva de tokens das ferramentas para toda a execução (não só por chamada)
+            budget_token = current_tool_budget.set(ToolBudget(context_builder.tool_reserve))
+            try:
+                for modo, payload in get_agent().stream(initial_state, config=config,
+                                                        stream_mode=["messages", "updates"]):
+                    yield from eventos.traduzir(modo, payload)
+            finally:
+                current_tool_budget.reset(budget_token)
+                current_prefetch.reset(prefetch_token)
+                if prefetch:
+                    prefetch.finish()
+
+            response_content = eventos.resposta()
+
+            # Salvar resposta completa do assistente ao fim do stream
+            _salvar_resposta(db, session_id, response_content)
+            if cacheable:
+                answer_cache.store(user_message, response_content, eventos.graph_messages)
+
+            yield _sse("done", {"response": response_content, "session_id": session_id,
+                                "usage": _relatorio_tokens(session_id, context_report, eventos.graph_messages)})
+        except Overloaded as e:
+            # Status 200 já enviado: a recusa vai como evento, com o mesmo retry_after do 429
+            db.rollback()
+            yield _sse("error", _sobrecarga(e)[0])
+        except Exception as e:
+            logger.critical(f"Erro crítico durante o stream: {e}", exc_info=True)
+            db.rollback()
+            yield _sse("error", {"error": "Erro interno", "details": str(e)})
 
+    return Response(
+        stream_with_context(gerar_eventos()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
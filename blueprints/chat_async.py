@@ -0,0 +1,220 @@
+"""
+Versão assíncrona dos endpoints de chat.py, servida pelo modo ASGI (asgi.py).
+
+Mesmo fluxo, mesmas ferramentas e o mesmo agente compilado, mas:
+- o grafo roda com `ainvoke`/`astream`: LLM e embeddings pelos clientes
+  assíncronos da OpenAI, e as ferramentas de busca chamadas na mesma rodada
+  executam concorrentemente;
+- a busca vetorial usa o driver asyncpg (database.get_async_engine);
+- o resto do acesso ao banco (sessão, histórico, resumo, cache de respostas)
+  são operações de milissegundos e rodam no pool de threads, então nenhuma
+  thread fica presa enquanto a conversa espera a OpenAI.
+
+Cada handler é um endpoint Starlette (requisição -> resposta), montado em
+asgi.py com o span raiz, as métricas HTTP e o CORS.
+"""
+import uuid
+import asyncio
+import logging
+
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_etags
+
+from database import session_scope, search_params
+from prefetch import current_prefetch
+from admission import Overloaded
+from context_budget import ToolBudget, current_tool_budget
+from blueprints.chat import (
+    answer_cache, context_builder, get_agent,
+    _EventosStream, _admitir, _busca_especulativa, _sobrecarga, _config_execucao, _pagina_historico, _parametros_busca, _parametros_historico,
+    _preparar_conversa, _relatorio_tokens, _salvar_resposta, _sse,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _em_sessao(funcao, *args):
+    """Executa `funcao(db, *args)` numa sessão curta (chamado dentro de asyncio.to_thread)."""
+    with session_scope() as db:
+        return funcao(db, *args)
+
+
+async def _mensagem(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    data = data if isinstance(data, dict) else {}
+    return data, data.get('message'), data.get('session_id') or str(uuid.uuid4())
+
+
+def _sobrecarregado(e):
+    body, headers = _sobrecarga(e)
+    return JSONResponse(body, status_code=429, headers=headers)
+
+
+def _erro_interno(e):
+    logger.critical(f"Erro crítico ao processar mensagem: {e}", exc_info=True)
+    return JSONResponse({"error": "Erro interno", "details": str(e)}, status_code=500)
+
+
+async def chat(request):
+    data, user_message, session_id = await _mensagem(request)
+    logger.info(f"Nova requisição de chat (async) recebida. Session ID: {data.get('session_id')}")
+
+    if not user_message:
+        logger.warning("Tentativa de chat sem mensagem.")
+        return JSONResponse({"error": "Mensagem não fornecida"}, status_code=400)
+
+    # Ajuste fino da busca vetorial só para esta requisição (ContextVar: vale para a task e suas threads)
+    search_params.set(_parametros_busca(data))
+
+    try:
+        _admitir(session_id)
+        initial_state, is_first_turn, context_report = await asyncio.to_thread(
+            _em_sessao, _preparar_conversa, session_id, user_message)
+        graph_messages = []
+
+        # Perguntas de primeiro turno podem ser respondidas pelo cache semântico (sem LLM)
+        cacheable = answer_cache.is_eligible(user_message, is_first_turn)
+        response_content = await answer_cache.alookup(user_message) if cacheable else None
+
+        if response_content is None:
+            # Busca das coleções prováveis em paralelo com o primeiro turno do LLM
+            prefetch = _busca_especulativa(user_message, assincrona=True)
+            prefetch_token = current_prefetch.set(prefetch)
+            # Reserva de tokens das ferramentas para toda a execução (não só por chamada)
+            budget_token = current_tool_budget.set(ToolBudget(context_builder.tool_reserve))
+            try:
+                final_state = await get_agent().ainvoke(initial_state, config=_config_execucao())
+            finally:
+                current_tool_budget.reset(budget_token)
+                current_prefetch.reset(prefetch_token)
+                if prefetch:
+                    prefetch.finish()
+            graph_messages = final_state["messages"]
+            response_content = graph_messages[-1].content
+
+            if cacheable:
+                await asyncio.to_thread(answer_cache.store, user_message, response_content, graph_messages)
+
+        await asyncio.to_thread(_em_sessao, _salvar_resposta, session_id, response_content)
+
+        return JSONResponse({
+            "response": response_content,
+            "session_id": session_id,
+            "usage": _relatorio_tokens(session_id, context_report, graph_messages)
+        })
+    except Overloaded as e:
+        return _sobrecarregado(e)
+    except Exception as e:
+        return _erro_interno(e)
+
+
+async def chat_stream(request):
+    """
+    Versão em streaming (SSE) do /chat; mesmos eventos do endpoint Flask.
+    Se o cliente desconectar, o Starlette cancela o gerador (e o grafo deixa de gastar tokens).
+    """
+    data, user_message, session_id = await _mensagem(request)
+    logger.info(f"Nova requisição de chat (stream async) recebida. Session ID: {data.get('session_id')}")
+
+    if not user_message:
+        logger.warning("Tentativa de chat sem mensagem.")
+        return JSONResponse({"error": "Mensagem não fornecida"}, status_code=400)
+
+    search_params.set(_parametros_busca(data))
+
+    try:
+        _admitir(session_id)
+        initial_state, is_first_turn, context_report = await asyncio.to_thread(
+            _em_sessao, _preparar_conversa, session_id, user_message)
+        cacheable = answer_cache.is_eligible(user_message, is_first_turn)
+        cached_response = await answer_cache.alookup(user_message) if cacheable else None
+    except Overloaded as e:
+        return _sobrecarregado(e)
+    except Exception as e:
+        return _erro_interno(e)
+
+    # Capturado aqui: o span raiz da requisição é o pai dos spans do grafo
+    config = _config_execucao()
+
+    async def gerar_eventos():
+        eventos = _EventosStream()
+        try:
+            yield _sse("session", {"session_id": session_id})
+
+            if cached_response is not None:
+                # Resposta do cache semântico: o grafo não é executado
+                await asyncio.to_thread(_em_sessao, _salvar_resposta, session_id, cached_response)
+                yield _sse("token", {"content": cached_response})
+                yield _sse("done", {"response": cached_response, "session_id": session_id,
+                                    "usage": _relatorio_tokens(session_id, context_report, [])})
+                return
+
+            prefetch = _busca_especulativa(user_message, assincrona=True)
+            prefetch_token = current_prefetch.set(prefetch)
+            # Reserva de tokens das ferramentas para toda a execução (não só por chamada)
+            budget_token = current_tool_budget.set(ToolBudget(context_builder.tool_reserve))
+            try:
+                async for modo, payload in get_agent().astream(initial_state, config=config,
+                                                               stream_mode=["messages", "updates"]):
+                    for evento in eventos.traduzir(modo, payload):
+                        yield evento
+            finally:
+                current_tool_budget.reset(budget_token)
+                current_prefetch.reset(prefetch_token)
+                if prefetch:
+                    prefetch.finish()
+
+            response_content = eventos.resposta()
+
+            # Salvar resposta completa do assistente ao fim do stream
+            await asyncio.to_thread(_em_sessao, _salvar_resposta, session_id, response_content)
+            if cacheable:
+                await asyncio.to_thread(answer_cache.store, user_message, response_content, eventos.graph_messages)
+
+            yield _sse("done", {"response": response_content, "session_id": session_id,
+                                "usage": _relatorio_tokens(session_id, context_report, eventos.graph_messages)})
+        except Overloaded as e:
+            yield _sse("error", _sobrecarga(e)[0])
+        except Exception as e:
+            logger.critical(f"Erro crítico durante o stream: {e}", exc_info=True)
+            yield _sse("error", {"error": "Erro interno", "details": str(e)})
+
+    return StreamingResponse(gerar_eventos(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def get_history(request):
+    # Mesmos helpers do endpoint Flask, que esperam os tipos do werkzeug
+    args = MultiDict(request.query_params.multi_items())
+    session_id = args.get('session_id')
+    if not session_id:
+        return JSONResponse({"history": []})
+
+    try:
+        limit, before = _parametros_historico(args)
+    except ValueError:
+        return JSONResponse({"error": "Cursor 'before' inválido"}, status_code=400)
+
+    if_none_match = parse_etags(request.headers.get("If-None-Match"))
+    try:
+        etag, body = await asyncio.to_thread(
+            _em_sessao, _pagina_historico, session_id, limit, before, if_none_match.contains_weak)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    headers = {"ETag": f'W/"{etag}"'}
+    if body is None:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers={**headers, "Cache-Control": "no-cache"})
+
+
+# (método, caminho) -> (handler, nome do endpoint nas métricas, igual ao do Flask)
+ROUTES = {
+    ("POST", "/api/chat"): (chat, "chat.chat"),
+    ("POST", "/api/chat/stream"): (chat_stream, "chat.chat_stream"),
+    ("GET", "/api/chat/history"): (get_history, "chat.get_history"),
+}
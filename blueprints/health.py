@@ -0,0 +1,57 @@
+from flask import Blueprint, Response, jsonify
+import logging
+from sqlalchemy import text
+
+from database import pool_status
+from request_db import get_request_db
+from indexing import index_status
+from telemetry import registry, register_collector
+
+logger = logging.getLogger(__name__)
+
+health_bp = Blueprint('health', __name__)
+
+def _metricas_pool():
+    status = pool_status()
+    samples = [
+        ("db_pool_checkouts_total", "counter", "Conexões retiradas do pool.", {}, status["checkouts"]),
+        ("db_pool_connects_total", "counter", "Conexões abertas com o banco.", {}, status["connects"]),
+    ]
+    if "checkedout" in status:
+        samples.append(("db_pool_checked_out", "gauge", "Conexões em uso.", {}, status["checkedout"]))
+        samples.append(("db_pool_utilization", "gauge", "Fração do pool em uso.", {}, status["utilization"]))
+    return samples
+
+register_collector(_metricas_pool)
+
+@health_bp.route('/health', methods=['GET'])
+def health():
+    """Liveness: o processo está de pé (sem I/O)."""
+    return jsonify({"status": "ok"})
+
+@health_bp.route('/ready', methods=['GET'])
+def ready():
+    """Readiness: banco acessível e índice de documentos populado."""
+    db = get_request_db()
+    try:
+        db.execute(text("SELECT 1"))
+        status = index_status(db)
+    except Exception as e:
+        logger.warning(f"Readiness: banco indisponível: {e}")
+        return jsonify({"ready": False, "database": "unavailable", "error": str(e)}), 503
+
+    is_ready = status["total_chunks"] > 0
+    return jsonify({"ready": is_ready, "database": "ok", "index": status}), 200 if is_ready else 503
+
+@health_bp.route('/metrics/pool', methods=['GET'])
+def pool_metrics():
+    """Ocupação do pool de conexões do SQLAlchemy."""
+    return jsonify(pool_status())
+
+@health_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas no formato texto do Prometheus (precisa do prometheus_client)."""
+    body = registry.expose()
+    if body is None:
+        return jsonify({"error": "Métricas indisponíveis: prometheus_client não instalado"}), 501
+    return Response(body, mimetype="text/plain; version=0.0.4; charset=utf-8")
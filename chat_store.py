@@ -0,0 +1,679 @@
+"""
+Persistência de sessões e mensagens do chat.
+
+Modo padrão (síncrono): cada inserção é commitada na hora, como antes.
+
+Com CHAT_WRITE_BEHIND=true as inserções de ChatSession/ChatMessage vão para
+uma fila em memória e uma thread de escrita as grava em lote (INSERT com
+várias linhas, um commit por lote) a cada CHAT_FLUSH_INTERVAL segundos. A
+resposta ao usuário não espera mais o fsync do Postgres.
+
+- Leitura após escrita: o histórico de uma sessão junta o que já está no
+  banco com o que ainda está na fila deste processo.
+- Fila cheia (CHAT_QUEUE_MAX): a mensagem é gravada de forma síncrona.
+- Lote recusado pelo banco: com o banco fora do ar o lote é retentado até
+  voltar; qualquer outro erro, CHAT_FLUSH_ATTEMPTS vezes. Depois o lote é
+  gravado em metades até isolar os itens recusados (ex.: texto com byte
+  NUL no Postgres), que são registrados no log e descartados; o resto da
+  fila continua sendo gravado.
+- Encerramento: a fila é drenada (até CHAT_DRAIN_TIMEOUT segundos) no atexit.
+
+Cache de sessões (SESSION_CACHE_SIZE > 0): um LRU das sessões ativas com a
+janela das SESSION_CACHE_WINDOW mensagens mais recentes, atualizado na
+escrita (write-through). Para uma conversa ativa, garantir a sessão, montar
+o contexto e responder ao polling do histórico não leem o banco.
+
+- Cada sessão é carregada do banco uma vez; uma escrita durante a carga
+  descarta o resultado (a próxima leitura carrega de novo).
+- Vários processos: com Postgres, cada escrita faz NOTIFY no canal
+  SESSION_CACHE_CHANNEL (entregue no commit) e uma thread por processo faz
+  LISTEN numa conexão própria e descarta as sessões alteradas pelos outros.
+  Enquanto essa conexão não está de pé o cache não é usado, e a cada
+  reconexão ele é esvaziado (notificações podem ter sido perdidas).
+- PgBouncer em modo transaction (DB_EXTERNAL_POOLER=pgbouncer) não entrega
+  notificações a quem faz LISTEN por ele: o LISTEN usa
+  SESSION_CACHE_LISTEN_URL (conexão direta com o Postgres) e, sem ela, o
+  padrão vira SESSION_CACHE_INVALIDATION=none.
+- Sem invalidação e com mais de um processo (WEB_CONCURRENCY > 1) o cache
+  fica desligado; com um processo, SESSION_CACHE_TTL limita quanto tempo
+  uma sessão fica sem ser relida.
+- Outros caches por sessão (o de resumos do context_budget) se registram
+  com register_cache e seguem a mesma invalidação.
+"""
+import os
+import time
+import queue
+import atexit
+import select
+import socket
+import logging
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert, func, text, tuple_
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
+
+from database import session_scope, ChatSession, ChatMessage, DB_EXTERNAL_POOLER
+
+logger = logging.getLogger(__name__)
+
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "false").lower() == "true"
+CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", "0.5"))  # segundos
+CHAT_QUEUE_MAX = int(os.getenv("CHAT_QUEUE_MAX", "1000"))
+CHAT_FLUSH_BATCH = int(os.getenv("CHAT_FLUSH_BATCH", "200"))  # linhas por commit
+CHAT_DRAIN_TIMEOUT = float(os.getenv("CHAT_DRAIN_TIMEOUT", "5"))  # segundos
+# Tentativas de um lote antes de isolar e descartar os itens que o banco recusa
+CHAT_FLUSH_ATTEMPTS = int(os.getenv("CHAT_FLUSH_ATTEMPTS", "3"))
+# Sessões já garantidas neste processo (evita reenfileirar a criação)
+KNOWN_SESSIONS_MAX = 10000
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "500"))  # sessões; 0 desliga
+# Mensagens mais recentes guardadas por sessão (cobre o contexto e uma página do histórico)
+SESSION_CACHE_WINDOW = int(os.getenv("SESSION_CACHE_WINDOW", "64"))
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "600"))  # segundos
+# Conexão direta com o Postgres para o LISTEN (necessária atrás do PgBouncer); vazio = a do engine
+SESSION_CACHE_LISTEN_URL = os.getenv("SESSION_CACHE_LISTEN_URL", "")
+_LISTEN_DEFAULT = "notify" if DB_EXTERNAL_POOLER != "pgbouncer" or SESSION_CACHE_LISTEN_URL else "none"
+SESSION_CACHE_INVALIDATION = os.getenv("SESSION_CACHE_INVALIDATION", _LISTEN_DEFAULT).lower()  # notify | none
+# Processos servindo a aplicação (mesma variável do gunicorn e do uvicorn)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+SESSION_CACHE_CHANNEL = "chat_session_cache"
+# Espera entre tentativas de reconectar o LISTEN (s)
+SESSION_CACHE_RECONNECT = 5.0
+
+
+@dataclass
+class StoredMessage:
+    session_id: str
+    role: str
+    content: str
+    timestamp: datetime
+    # chat_messages.id; None enquanto a mensagem está na fila do write-behind
+    id: int = field(default=None, compare=False)
+
+
+def message_key(message):
+    """Ordem do histórico e do cursor: (timestamp, id); mensagens na fila vêm depois das gravadas."""
+    return message.timestamp, message.id if message.id is not None else float("inf")
+
+
+def _before(before):
+    """Cursor (timestamp, id) como chave comparável com message_key; id None = depois de todas."""
+    timestamp, message_id = before
+    return timestamp, message_id if message_id is not None else float("inf")
+
+
+def _insert_ignore(db, rows):
+    """INSERT de sessões ignorando as que já existem (Postgres e SQLite)."""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    db.execute(dialect_insert(ChatSession).values(rows).on_conflict_do_nothing(index_elements=["id"]))
+
+
+def _origin():
+    """Identifica este processo nas notificações (para ignorar as próprias)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _notify(db, session_ids):
+    """NOTIFY das sessões alteradas; o Postgres só entrega no commit da transação."""
+    if SESSION_CACHE_INVALIDATION != "notify" or db.get_bind().dialect.name != "postgresql":
+        return
+    origin = _origin()
+    db.execute(text("SELECT pg_notify(:channel, :payload)"),
+               [{"channel": SESSION_CACHE_CHANNEL, "payload": f"{origin}|{session_id}"}
+                for session_id in sorted(set(session_ids))])
+
+
+def _transient(error):
+    """Falha de conexão (banco fora do ar, rede): o mesmo lote pode dar certo depois."""
+    return isinstance(error, OperationalError) or getattr(error, "connection_invalidated", False)
+
+
+def _write(db, sessions, messages):
+    """
+    Grava um lote: sessões primeiro (FK), depois as mensagens num único INSERT.
+    Retorna os ids das mensagens, na ordem do lote (cursor do histórico).
+    """
+    if sessions:
+        _insert_ignore(db, sessions)
+    ids = []
+    if messages:
+        ids = db.execute(insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True),
+                         messages).scalars().all()
+        _notify(db, [m["session_id"] for m in messages])
+    db.commit()
+    return ids
+
+
+class _CachedSession:
+    __slots__ = ("messages", "complete", "count", "writes", "loaded", "dirty", "expires_at")
+
+    def __init__(self, window, expires_at):
+        self.messages = deque(maxlen=window)
+        self.complete = False  # A janela contém o histórico inteiro da sessão
+        self.count = None  # Total de mensagens da sessão, quando conhecido
+        self.writes = 0
+        self.loaded = False
+        self.dirty = False  # Escrita durante a carga: o resultado da carga é descartado
+        self.expires_at = expires_at
+
+
+class SessionCache:
+    """LRU de sessões com a janela das mensagens mais recentes (ver o docstring do módulo)."""
+
+    def __init__(self, max_sessions=SESSION_CACHE_SIZE, window=SESSION_CACHE_WINDOW, ttl=SESSION_CACHE_TTL,
+                 clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.window = window
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _put(self, session_id, entry):
+        self._entries[session_id] = entry
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+
+    def get(self, session_id):
+        """Entrada carregada e dentro do TTL, ou None."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or not entry.loaded:
+                return None
+            if entry.expires_at <= self._clock():
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return entry
+
+    def snapshot(self, entry):
+        """(mensagens em ordem cronológica, janela completa?, total ou None, geração de escrita)."""
+        with self._lock:
+            messages = sorted(entry.messages, key=message_key)
+            return messages, entry.complete, entry.count, entry.writes
+
+    def create(self, session_id):
+        """Sessão recém-criada: histórico vazio e completo."""
+        entry = _CachedSession(self.window, self._clock() + self.ttl)
+        entry.complete, entry.count, entry.loaded = True, 0, True
+        with self._lock:
+            self._put(session_id, entry)
+
+    def begin_load(self, session_id):
+        entry = _CachedSession(self.window, self._clock() + self.ttl)
+        with self._lock:
+            self._put(session_id, entry)
+        return entry
+
+    def finish_load(self, session_id, entry, messages, complete):
+        with self._lock:
+            if self._entries.get(session_id) is not entry:
+                return  # Invalidada durante a carga
+            if entry.dirty:
+                del self._entries[session_id]
+                return
+            entry.messages.extend(messages[-self.window:])
+            entry.complete = complete and len(messages) <= self.window
+            entry.count = len(messages) if complete else None
+            entry.loaded = True
+
+    def append(self, message):
+        with self._lock:
+            entry = self._entries.get(message.session_id)
+            if entry is None:
+                return
+            if not entry.loaded:
+                entry.dirty = True
+                return
+            if message in entry.messages:
+                return  # Uma carga concorrente já leu esta mensagem do banco
+            entry.writes += 1
+            if len(entry.messages) == entry.messages.maxlen:
+                entry.complete = False
+            entry.messages.append(message)
+            if entry.count is not None:
+                entry.count += 1
+
+    def set_count(self, session_id, entry, count, writes):
+        """Guarda o total lido do banco, se nada foi escrito na sessão desde a leitura."""
+        with self._lock:
+            if self._entries.get(session_id) is entry and entry.count is None and entry.writes == writes:
+                entry.count = count
+
+    def count(self, name):
+        # Acertos e falhas vêm de várias threads de requisição ao mesmo tempo
+        with self._lock:
+            self.counters[name] += 1
+
+    def invalidate(self, session_id):
+        with self._lock:
+            if self._entries.pop(session_id, None) is not None:
+                self.counters["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "size": len(self._entries)}
+
+
+class _InvalidationListener:
+    """LISTEN em SESSION_CACHE_CHANNEL numa conexão própria (fora do pool), numa thread daemon."""
+
+    def __init__(self, engine, caches):
+        self.engine = engine
+        self.caches = caches  # Lista compartilhada com o ChatStore (register_cache)
+        self.connected = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="session-cache-listener", daemon=True)
+        self._thread.start()
+
+    def handle(self, payload):
+        origin, _, session_id = payload.partition("|")
+        if origin != _origin():
+            for cache in self.caches:
+                cache.invalidate(session_id)
+
+    def _clear(self):
+        for cache in self.caches:
+            cache.clear()
+
+    def _run(self):
+        while not self._stop.is_set():
+            raw = None
+            try:
+                raw = self.engine.raw_connection()
+                raw.detach()  # Conexão dedicada: não volta para o pool
+                connection = raw.driver_connection
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {SESSION_CACHE_CHANNEL}")
+                # Notificações de antes do LISTEN podem ter sido perdidas
+                self._clear()
+                self.connected.set()
+                logger.info("Cache de sessões: invalidação entre processos ativa (LISTEN/NOTIFY).")
+                while not self._stop.is_set():
+                    if select.select([connection], [], [], SESSION_CACHE_RECONNECT) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.handle(connection.notifies.pop(0).payload)
+            except Exception as e:
+                logger.warning(f"Cache de sessões: LISTEN interrompido ({e}); cache desligado até reconectar.")
+            finally:
+                self.connected.clear()
+                self._clear()
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+            self._stop.wait(SESSION_CACHE_RECONNECT)
+
+    def stop(self):
+        self._stop.set()
+
+
+class ChatStore:
+    def __init__(self, write_behind=CHAT_WRITE_BEHIND, flush_interval=CHAT_FLUSH_INTERVAL,
+                 queue_max=CHAT_QUEUE_MAX, batch_size=CHAT_FLUSH_BATCH,
+                 drain_timeout=CHAT_DRAIN_TIMEOUT, flush_attempts=CHAT_FLUSH_ATTEMPTS, session_factory=session_scope,
+                 cache_size=SESSION_CACHE_SIZE, cache_window=SESSION_CACHE_WINDOW, cache_ttl=SESSION_CACHE_TTL,
+                 invalidation=SESSION_CACHE_INVALIDATION, listen_url=SESSION_CACHE_LISTEN_URL,
+                 workers=WEB_CONCURRENCY):
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.drain_timeout = drain_timeout
+        self.flush_attempts = flush_attempts
+        self.session_factory = session_factory
+        self._queue = queue.Queue(maxsize=queue_max)
+        self._pending = {}  # session_id -> mensagens ainda não gravadas
+        self._known_sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._writer = None
+        self.counters = {"enqueued": 0, "flushed": 0, "batches": 0, "sync_fallbacks": 0, "errors": 0,
+                         "dropped": 0}
+        if cache_size > 0 and invalidation != "notify" and workers > 1:
+            # Cada processo serviria a sua cópia das sessões, sem saber das escritas dos outros
+            logger.warning(f"Cache de sessões desligado: {workers} processos sem invalidação entre eles.")
+            cache_size = 0
+        elif invalidation == "notify" and DB_EXTERNAL_POOLER == "pgbouncer" and not listen_url:
+            logger.warning("Cache de sessões: LISTEN pelo PgBouncer não recebe notificações; "
+                           "defina SESSION_CACHE_LISTEN_URL.")
+        self.cache = SessionCache(cache_size, cache_window, cache_ttl) if cache_size > 0 else None
+        self._caches = [self.cache] if self.cache is not None else []
+        self.invalidation = invalidation
+        self.listen_url = listen_url
+        self._listener = None
+
+    # ----- Cache de sessões -----
+
+    def register_cache(self, cache):
+        """Outro cache por sessão (com invalidate(session_id) e clear()) sob a mesma invalidação."""
+        self._caches.append(cache)
+
+    def caching(self, db):
+        """Se os caches por sessão podem ser usados agora (com NOTIFY, só enquanto o LISTEN estiver ativo)."""
+        if self.cache is None:
+            return False
+        engine = db.get_bind()
+        if self.invalidation != "notify" or engine.dialect.name != "postgresql":
+            return True
+        if self._listener is None:
+            with self._lock:
+                if self._listener is None:
+                    listen_engine = create_engine(self.listen_url, poolclass=NullPool) if self.listen_url else engine
+                    self._listener = _InvalidationListener(listen_engine, self._caches)
+                    atexit.register(self._listener.stop)
+        return self._listener.connected.is_set()
+
+    def notify(self, db, session_id):
+        """Avisa os outros processos de que a sessão mudou (entregue no commit de `db`)."""
+        _notify(db, [session_id])
+
+    def _cache_for(self, db):
+        return self.cache if self.caching(db) else None
+
+    def _cached(self, cache, session_id):
+        entry = cache.get(session_id)
+        cache.count("hits" if entry is not None else "misses")
+        return entry
+
+    # ----- Escrita -----
+
+    def ensure_session(self, db, session_id):
+        cache = self._cache_for(db)
+        if cache is not None and self._cached(cache, session_id) is not None:
+            return  # Sessão ativa: já existe no banco (ou na fila de escrita)
+        if not self.write_behind:
+            if not db.query(ChatSession).filter(ChatSession.id == session_id).first():
+                db.add(ChatSession(id=session_id))
+                db.commit()
+                if cache is not None:
+                    cache.create(session_id)
+            return
+
+        with self._lock:
+            if session_id in self._known_sessions:
+                self._known_sessions.move_to_end(session_id)
+                return
+            self._known_sessions[session_id] = True
+            while len(self._known_sessions) > KNOWN_SESSIONS_MAX:
+                self._known_sessions.popitem(last=False)
+        self._enqueue(db, ("session", {"id": session_id, "created_at": datetime.now()}))
+
+    def add_message(self, db, session_id, role, content):
+        message = StoredMessage(session_id=session_id, role=role, content=content, timestamp=datetime.now())
+        if not self.write_behind:
+            row = ChatMessage(**self._row(message))
+            db.add(row)
+            db.flush()
+            message.id = row.id  # Antes do commit, que expiraria a linha (e a leitura iria ao banco)
+            _notify(db, [session_id])
+            db.commit()
+        else:
+            with self._lock:
+                self._pending.setdefault(session_id, []).append(message)
+            self._enqueue(db, ("message", message))
+        if self.cache is not None:
+            self.cache.append(message)
+
+    def _enqueue(self, db, item):
+        self._start_writer()
+        try:
+            self._queue.put_nowait(item)
+            self._count("enqueued")
+        except queue.Full:
+            # Fila cheia: grava agora, garantindo a sessão junto (ela pode ainda estar na fila)
+            self._count("sync_fallbacks")
+            kind, payload = item
+            if kind == "session":
+                _write(db, [payload], [])
+            else:
+                payload.id, = _write(db, [{"id": payload.session_id, "created_at": payload.timestamp}],
+                                     [self._row(payload)])
+                self._forget([payload])
+
+    # ----- Leitura -----
+
+    def recent_messages(self, db, session_id, limit=None, before=None):
+        """
+        Mensagens da sessão em ordem cronológica (banco + fila), as `limit` mais recentes.
+        `before` (timestamp, id) pagina para trás (keyset): só mensagens anteriores a essa,
+        inclusive as que têm o mesmo timestamp e id menor.
+        Servidas pelo cache de sessões quando a janela em memória cobre o pedido.
+        """
+        cache = self._cache_for(db)
+        if cache is None:
+            return self._query(db, session_id, limit, before)
+        entry = self._cached(cache, session_id)
+        if entry is None:
+            # Carrega a janela da sessão (uma linha a mais indica se o histórico é maior que ela)
+            entry = cache.begin_load(session_id)
+            loaded = self._query(db, session_id, cache.window + 1)
+            cache.finish_load(session_id, entry, loaded, complete=len(loaded) <= cache.window)
+            entry = cache.get(session_id)
+            if entry is None:
+                # Escrita durante a carga: a janela foi descartada
+                return self._query(db, session_id, limit, before)
+
+        window, complete, _, _ = cache.snapshot(entry)
+        if before is not None:
+            # Janela = mensagens mais recentes: as anteriores a `before` nela são as mais recentes dessa página
+            window = [m for m in window if message_key(m) < _before(before)]
+        if complete or (limit and limit <= len(window)):
+            return window[-limit:] if limit else window
+        return self._query(db, session_id, limit, before)
+
+    def _query(self, db, session_id, limit=None, before=None):
+        # Cópia da fila antes da consulta: um lote gravado no meio do caminho aparece no banco
+        pending = [m for m in self._pending_for(session_id) if before is None or message_key(m) < _before(before)]
+        query = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+        if before is not None:
+            timestamp, message_id = before
+            if message_id is None:
+                # Cursor de uma mensagem que estava na fila: vem depois de todas as gravadas com esse timestamp
+                query = query.filter(ChatMessage.timestamp <= timestamp)
+            else:
+                # Comparação de tuplas: usa o índice (session_id, timestamp, id)
+                query = query.filter(tuple_(ChatMessage.timestamp, ChatMessage.id) < tuple_(timestamp, message_id))
+        if limit:
+            rows = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit).all()[::-1]
+        else:
+            rows = query.order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc()).all()
+        messages = [StoredMessage(r.session_id, r.role, r.content, r.timestamp, r.id) for r in rows]
+
+        if pending:
+            persisted = {(m.timestamp, m.role, m.content) for m in messages}
+            messages += [m for m in pending if (m.timestamp, m.role, m.content) not in persisted]
+            messages.sort(key=message_key)
+            if limit:
+                messages = messages[-limit:]
+        return messages
+
+    def version(self, db, session_id):
+        """
+        Marca barata do estado do histórico (quantidade + última mensagem), para ETag.
+        Mensagens só são acrescentadas, então isso muda sempre que o histórico muda.
+        """
+        cache = self._cache_for(db)
+        entry = self._cached(cache, session_id) if cache is not None else None
+        if entry is not None:
+            window, _, count, writes = cache.snapshot(entry)
+            if count is not None:
+                return self._version(count, window[-1].timestamp if window else None)
+
+        pending = self._pending_for(session_id)
+        count, latest = db.query(func.count(ChatMessage.id), func.max(ChatMessage.timestamp))\
+                          .filter(ChatMessage.session_id == session_id).one()
+        latest = max(filter(None, [latest, *(m.timestamp for m in pending)]), default=None)
+        if entry is not None and not self.write_behind:
+            # Com write-behind um lote gravado entre a cópia da fila e a consulta contaria em dobro
+            cache.set_count(session_id, entry, count, writes)
+        return self._version(count + len(pending), latest)
+
+    @staticmethod
+    def _version(count, latest):
+        return f"{count}:{latest.isoformat() if latest else '-'}"
+
+    def _pending_for(self, session_id):
+        if not self.write_behind:
+            return []
+        with self._lock:
+            return list(self._pending.get(session_id, ()))
+
+    # ----- Thread de escrita -----
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        retry = []
+        attempts = 0
+        while not self._stop.is_set() or not self._queue.empty() or retry:
+            batch = retry or self._take_batch()
+            if not batch:
+                continue
+            try:
+                self._flush(batch)
+                retry, attempts = [], 0
+                continue
+            except Exception as e:
+                self._count("errors")
+                transient = _transient(e)
+                attempts = attempts if transient else attempts + 1
+                logger.warning(f"Gravação em lote do chat falhou ({len(batch)} itens, "
+                               f"tentativa {attempts}/{self.flush_attempts}): {e}")
+            retry = batch
+            if not transient and (attempts >= self.flush_attempts or self._stop.is_set()):
+                # O problema está nos dados: isola os itens recusados e segue com o resto da fila
+                retry, attempts = self._flush_split(batch), 0
+            if retry and self._stop.is_set():
+                logger.error(f"Encerrando com {len(retry)} itens do chat não gravados.")
+                return
+            if retry:
+                time.sleep(self.flush_interval)
+
+    def _flush_split(self, batch):
+        """
+        Grava o lote em metades até isolar os itens recusados, que são descartados.
+        Retorna os itens ainda não gravados se o banco ficar fora do ar no meio.
+        """
+        middle = len(batch) // 2
+        halves = [batch[:middle], batch[middle:]]
+        for i, half in enumerate(halves):
+            if not half:
+                continue
+            try:
+                self._flush(half, with_sessions=True)
+                continue
+            except Exception as e:
+                if _transient(e):
+                    return [item for rest in halves[i:] for item in rest]
+                if len(half) == 1:
+                    self._drop(half[0], e)
+                    continue
+            left = self._flush_split(half)
+            if left:
+                return left + [item for rest in halves[i + 1:] for item in rest]
+        return []
+
+    def _drop(self, item, error):
+        kind, payload = item
+        self._count("dropped")
+        logger.error(f"Item do chat recusado pelo banco e descartado ({kind}): {payload!r} ({error})")
+        if kind == "message":
+            self._forget([payload])
+            if self.cache is not None:
+                # A janela em memória não pode servir uma mensagem que não existe no banco
+                self.cache.invalidate(payload.session_id)
+
+    def _take_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        # Espera o intervalo acumular mais itens, a menos que esteja encerrando
+        deadline = time.monotonic() + (0 if self._stop.is_set() else self.flush_interval)
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch, with_sessions=False):
+        sessions = [payload for kind, payload in batch if kind == "session"]
+        messages = [payload for kind, payload in batch if kind == "message"]
+        if with_sessions:
+            # Lote dividido: a sessão de uma mensagem pode ter ficado na outra metade
+            sessions += [{"id": m.session_id, "created_at": m.timestamp} for m in messages]
+        with self.session_factory() as db:
+            try:
+                ids = _write(db, sessions, [self._row(m) for m in messages])
+            except Exception:
+                db.rollback()
+                raise
+        # O mesmo objeto está na janela do cache: passa a ter o id do banco
+        for message, message_id in zip(messages, ids):
+            message.id = message_id
+        self._forget(messages)
+        self._count("flushed", len(batch))
+        self._count("batches")
+
+    def _forget(self, messages):
+        with self._lock:
+            for message in messages:
+                pending = self._pending.get(message.session_id)
+                if pending and message in pending:
+                    pending.remove(message)
+                    if not pending:
+                        del self._pending[message.session_id]
+
+    @staticmethod
+    def _row(message):
+        return {
+            "session_id": message.session_id,
+            "role": message.role,
+            "content": message.content,
+            "timestamp": message.timestamp,
+        }
+
+    def stop(self, timeout=None):
+        """Drena a fila e encerra a thread de escrita."""
+        if self._writer is None:
+            return
+        self._stop.set()
+        self._writer.join(self.drain_timeout if timeout is None else timeout)
+        if self._writer.is_alive():
+            logger.error(f"Fila do chat não drenada a tempo ({self._queue.qsize()} itens pendentes).")
+
+    def _count(self, name, amount=1):
+        # Threads das requisições e a thread de escrita atualizam os mesmos contadores
+        with self._lock:
+            self.counters[name] += amount
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, "queued": self._queue.qsize(), "write_behind": self.write_behind,
+                "session_cache": self.cache.stats() if self.cache is not None else None}
@@ -0,0 +1,354 @@
+"""
+Montagem do contexto do agente dentro de um orçamento de tokens (tiktoken).
+
+CONTEXT_MAX_TOKENS é dividido entre:
+- prompt do sistema (fixo, medido a cada requisição);
+- resumo da conversa (session_summaries), se houver;
+- histórico: as mensagens mais recentes que couberem;
+- CONTEXT_TOOL_RESERVE: espaço reservado para as saídas das ferramentas,
+  que por sua vez são limitadas a TOOL_OUTPUT_MAX_TOKENS por chamada. O
+  total da execução do agente é controlado por ToolBudget (current_tool_budget):
+  as chamadas seguintes recebem o que sobrou da reserva e, esgotada, um aviso
+  para o LLM responder com o que já tem.
+
+Os turnos antigos que saem do orçamento são resumidos pelo LLM de forma
+incremental (resumo anterior + turnos novos) numa thread em background; o
+resumo é usado a partir da requisição seguinte. Isso inclui os turnos que já
+saíram da janela de CONTEXT_HISTORY_MESSAGES mensagens sem passar pelo corte
+por tokens (turnos curtos): são lidos do banco, até SUMMARY_MAX_MESSAGES por
+rodada, para que nenhum turno saia do contexto sem entrar no resumo.
+
+O resumo de cada sessão fica num LRU em memória (mesmo tamanho e TTL do
+cache de sessões do chat_store), atualizado quando este processo resume.
+Com o ChatStore passado em `store`, o LRU segue a invalidação do cache de
+sessões: um resumo gravado faz NOTIFY e os outros processos o descartam;
+sem invalidação possível, o LRU fica desligado junto com o cache de sessões.
+Um resumo velho só faz agendar de novo turnos já resumidos, e o worker
+confere no banco.
+"""
+import os
+import logging
+import time
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+from chat_store import SESSION_CACHE_SIZE, SESSION_CACHE_TTL, StoredMessage
+from database import session_scope, ChatMessage, SessionSummary
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))
+CONTEXT_TOOL_RESERVE = int(os.getenv("CONTEXT_TOOL_RESERVE", "3000"))
+TOOL_OUTPUT_MAX_TOKENS = int(os.getenv("TOOL_OUTPUT_MAX_TOKENS", "1500"))
+# Quantas mensagens do histórico são carregadas antes do corte por tokens
+CONTEXT_HISTORY_MESSAGES = int(os.getenv("CONTEXT_HISTORY_MESSAGES", "30"))
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+# Turnos incorporados ao resumo por rodada do LLM; o restante fica para a próxima requisição
+SUMMARY_MAX_MESSAGES = int(os.getenv("SUMMARY_MAX_MESSAGES", "60"))
+# Encoding do gpt-4o-mini
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+
+# Custo fixo aproximado de cada mensagem no formato de chat da OpenAI
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Saída das ferramentas quando a reserva da execução acabou
+TOOL_BUDGET_EXHAUSTED = ("Limite de contexto das consultas atingido nesta resposta. "
+                         "Não consulte mais ferramentas; responda com as informações já obtidas.")
+
+# Orçamento das ferramentas da execução atual do agente (ToolBudget)
+current_tool_budget = contextvars.ContextVar("current_tool_budget", default=None)
+
+SUMMARY_PROMPT = """Atualize o resumo de uma conversa entre um visitante do portfólio e Gustavo.
+Mantenha fatos, perguntas feitas, preferências e pendências; descarte cumprimentos.
+Responda apenas com o novo resumo, em no máximo {max_tokens} tokens, no idioma da conversa.
+
+Resumo anterior:
+{resumo}
+
+Novos turnos:
+{turnos}"""
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_failed = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        with _encoding_lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    # Sem o arquivo BPE (ex.: sem rede): estimativa por caracteres
+                    _encoding_failed = True
+                    logger.warning(f"tiktoken indisponível ({e}); usando estimativa de ~4 caracteres por token.")
+    return _encoding
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def message_tokens(content):
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def pack_chunks(contents, max_tokens=TOOL_OUTPUT_MAX_TOKENS, separator="\n\n"):
+    """
+    Junta os chunks (já em ordem de relevância) até o limite de tokens da saída da ferramenta.
+    Um chunk que não cabe é pulado e os seguintes, menores, ainda podem ocupar o espaço que sobrou.
+    """
+    packed = []
+    used = 0
+    separator_tokens = count_tokens(separator)
+    for content in contents:
+        tokens = count_tokens(content) + (separator_tokens if packed else 0)
+        if used + tokens > max_tokens:
+            if not packed:
+                # Nem o primeiro chunk cabe: corta em vez de não devolver nada
+                packed.append(truncate_tokens(content, max_tokens))
+                break
+            continue
+        packed.append(content)
+        used += tokens
+    return separator.join(packed)
+
+
+class ToolBudget:
+    """
+    Tokens das saídas de ferramentas numa execução do agente, até a reserva do contexto.
+    Compartilhado pelas ferramentas da mesma rodada, que rodam em paralelo.
+    """
+
+    def __init__(self, total=CONTEXT_TOOL_RESERVE, per_call=TOOL_OUTPUT_MAX_TOKENS):
+        self.total = total
+        self.per_call = per_call
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def pack(self, contents):
+        """pack_chunks dentro do que sobrou da reserva; TOOL_BUDGET_EXHAUSTED quando não sobrou nada."""
+        with self._lock:
+            remaining = self.total - self.used
+            if remaining <= 0:
+                return TOOL_BUDGET_EXHAUSTED
+            packed = pack_chunks(contents, min(self.per_call, remaining))
+            self.used += count_tokens(packed)
+            return packed
+
+
+class _SummaryCache:
+    """LRU com TTL: session_id -> (resumo, covered_until) ou None."""
+
+    def __init__(self, max_sessions, ttl):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._entries = OrderedDict()  # session_id -> (expira_em, valor)
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """(True, valor) se houver entrada válida; (False, None) caso contrário."""
+        with self._lock:
+            cached = self._entries.get(session_id)
+            if cached is None or cached[0] <= time.monotonic():
+                return False, None
+            self._entries.move_to_end(session_id)
+            return True, cached[1]
+
+    def put(self, session_id, summary):
+        if self.max_sessions <= 0:
+            return
+        with self._lock:
+            self._entries[session_id] = (time.monotonic() + self.ttl, summary)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ContextBuilder:
+    def __init__(self, llm, max_tokens=CONTEXT_MAX_TOKENS, tool_reserve=CONTEXT_TOOL_RESERVE,
+                 summaries=SUMMARY_ENABLED, limiter=None, cache_size=SESSION_CACHE_SIZE, cache_ttl=SESSION_CACHE_TTL,
+                 store=None, history_limit=CONTEXT_HISTORY_MESSAGES):
+        self.llm = llm
+        self.limiter = limiter
+        self.max_tokens = max_tokens
+        self.tool_reserve = tool_reserve
+        self.summaries = summaries
+        # Tamanho da janela de histórico que o chamador carrega (para saber se ela cortou turnos)
+        self.history_limit = history_limit
+        # Um único worker: resumos da mesma sessão nunca rodam em paralelo neste processo
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-summary")
+        self._scheduled = set()
+        self._lock = threading.Lock()
+        self._summaries = _SummaryCache(cache_size, cache_ttl)
+        # ChatStore: o LRU de resumos usa a mesma invalidação entre processos do cache de sessões
+        self.store = store
+        if store is not None:
+            store.register_cache(self._summaries)
+
+    def build(self, db, session_id, history, system_prompt):
+        """
+        Converte o histórico (ordem cronológica, terminando na mensagem atual) nas mensagens
+        do agente dentro do orçamento. Retorna (mensagens, relatório de tokens).
+        Agenda o resumo dos turnos que ficaram de fora e ainda não estão resumidos.
+        """
+        summary = self._summary(db, session_id) if self.summaries else None
+        summary_text = f"Resumo da conversa até aqui:\n{summary[0]}" if summary else None
+
+        system_tokens = count_tokens(system_prompt)
+        summary_tokens = message_tokens(summary_text) if summary_text else 0
+        budget = self.max_tokens - self.tool_reserve - system_tokens - summary_tokens
+
+        kept = []
+        used = 0
+        for msg in reversed(history):
+            tokens = message_tokens(msg.content)
+            # A mensagem atual sempre entra
+            if kept and used + tokens > budget:
+                break
+            kept.append(msg)
+            used += tokens
+        kept.reverse()
+        dropped = history[:len(history) - len(kept)]
+
+        messages = [SystemMessage(content=summary_text)] if summary_text else []
+        for msg in kept:
+            if msg.role == "user":
+                messages.append(HumanMessage(content=msg.content))
+            elif msg.role == "assistant":
+                messages.append(AIMessage(content=msg.content))
+
+        covered_until = summary[1] if summary else None
+        to_summarize = [m for m in dropped if covered_until is None or m.timestamp > covered_until]
+        if self.summaries and history and len(history) >= self.history_limit and \
+                (covered_until is None or covered_until < history[0].timestamp):
+            # A janela cortou o começo da conversa: turnos fora dela que o resumo ainda não cobre
+            to_summarize = self._older_turns(db, session_id, covered_until, history[0]) + to_summarize
+        to_summarize = to_summarize[:SUMMARY_MAX_MESSAGES]
+        if self.summaries and to_summarize:
+            self._schedule_summary(session_id, to_summarize)
+
+        report = {
+            "system": system_tokens,
+            "summary": summary_tokens,
+            "history": used,
+            "history_messages": len(kept),
+            "dropped_messages": len(dropped),
+            "context": system_tokens + summary_tokens + used,
+        }
+        return messages, report
+
+    # ----- Cache de resumos -----
+
+    def _summary(self, db, session_id):
+        """(resumo, covered_until) da sessão, ou None; lê o banco só fora do cache."""
+        caching = self.store is None or self.store.caching(db)
+        if caching:
+            found, summary = self._summaries.get(session_id)
+            if found:
+                return summary
+        row = db.get(SessionSummary, session_id)
+        summary = (row.summary, row.covered_until) if row else None
+        if caching:
+            self._summaries.put(session_id, summary)
+        return summary
+
+    # ----- Resumo incremental -----
+
+    @staticmethod
+    def _older_turns(db, session_id, covered_until, first):
+        """Mensagens gravadas depois de `covered_until` e antes de `first`, as mais antigas primeiro."""
+        query = db.query(ChatMessage).filter(ChatMessage.session_id == session_id,
+                                             ChatMessage.timestamp < first.timestamp)
+        if covered_until is not None:
+            query = query.filter(ChatMessage.timestamp > covered_until)
+        rows = query.order_by(ChatMessage.timestamp, ChatMessage.id).limit(SUMMARY_MAX_MESSAGES).all()
+        # Cópias: o resumo roda em outra thread, depois que a sessão desta requisição fechou
+        return [StoredMessage(r.session_id, r.role, r.content, r.timestamp, r.id) for r in rows]
+
+    def _schedule_summary(self, session_id, messages):
+        with self._lock:
+            if session_id in self._scheduled:
+                return
+            self._scheduled.add(session_id)
+        self._executor.submit(self._summarize, session_id, messages)
+
+    def _summarize(self, session_id, messages):
+        try:
+            with session_scope() as db:
+                summary = db.get(SessionSummary, session_id)
+                if summary and summary.covered_until and summary.covered_until >= messages[-1].timestamp:
+                    # Outro worker já resumiu esses turnos (o cache daqui estava velho)
+                    self._summaries.put(session_id, (summary.summary, summary.covered_until))
+                    return
+                turns = "\n".join(
+                    f"{'Visitante' if m.role == 'user' else 'Gustavo'}: {m.content}"
+                    for m in messages if summary is None or m.timestamp > summary.covered_until
+                )
+                # Resumo é trabalho de fundo: com o LLM sobrecarregado falha e tenta de novo no próximo turno
+                with self.limiter.slot() if self.limiter else nullcontext():
+                    new_summary = self.llm.invoke(SUMMARY_PROMPT.format(
+                        max_tokens=SUMMARY_MAX_TOKENS,
+                        resumo=summary.summary if summary else "(nenhum)",
+                        turnos=turns,
+                    )).content
+                new_summary = truncate_tokens(new_summary, SUMMARY_MAX_TOKENS)
+                db.merge(SessionSummary(
+                    session_id=session_id,
+                    summary=new_summary,
+                    covered_until=messages[-1].timestamp,
+                    updated_at=datetime.now(),
+                ))
+                if self.store is not None:
+                    self.store.notify(db, session_id)
+                db.commit()
+                self._summaries.put(session_id, (new_summary, messages[-1].timestamp))
+                logger.info(f"Resumo da sessão {session_id} atualizado ({len(messages)} mensagens incorporadas).")
+        except Exception as e:
+            logger.warning(f"Falha ao resumir a sessão {session_id}: {e}")
+        finally:
+            with self._lock:
+                self._scheduled.discard(session_id)
+
+
+def usage_report(messages):
+    """Soma o uso real de tokens (usage_metadata) das respostas do LLM nesta execução."""
+    usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "llm_calls": 0}
+    for msg in messages:
+        metadata = getattr(msg, "usage_metadata", None)
+        if isinstance(msg, AIMessage) and metadata:
+            usage["llm_calls"] += 1
+            for key in ("input_tokens", "output_tokens", "total_tokens"):
+                usage[key] += metadata.get(key, 0)
+    return usage
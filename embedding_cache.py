@@ -0,0 +1,216 @@
+"""
+Cache de embeddings de consultas em dois níveis.
+
+1. LRU em memória (por processo), com limite de tamanho e TTL.
+2. Tabela `query_embedding_cache` no Postgres, compartilhada entre workers
+   e preservada entre reinícios.
+
+A chave é o hash do modelo + texto normalizado da consulta, então variações
+de caixa e espaços da mesma pergunta reaproveitam o mesmo vetor.
+
+`aembed_query` (modo ASGI) usa o cliente assíncrono do modelo base; o nível
+persistente continua no engine síncrono, numa thread.
+"""
+import os
+import asyncio
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+from langchain_core.embeddings import Embeddings
+
+import telemetry
+from database import session_scope, QueryEmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))  # segundos
+EMBEDDING_CACHE_PERSISTENT = os.getenv("EMBEDDING_CACHE_PERSISTENT", "true").lower() == "true"
+
+
+def normalize_query(text):
+    """Normaliza a consulta: unicode NFC, sem espaços extras e em caixa baixa."""
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(text, model):
+    return hashlib.sha256(f"{model}\x00{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envolve um modelo de embeddings e faz cache de `embed_query`.
+    `embed_documents` (indexação) passa direto para o modelo base.
+    """
+
+    def __init__(self, base, model_name, max_size=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL,
+                 persistent=EMBEDDING_CACHE_PERSISTENT, clock=time.time, limiter=None):
+        self.base = base
+        # Controle de admissão das chamadas ao modelo (só os cache misses chegam ao provedor)
+        self.limiter = limiter
+        self.model_name = model_name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persistent = persistent
+        self._clock = clock
+        self._entries = OrderedDict()  # chave -> (expira_em, vetor)
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self.counters = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+    def _count(self, name):
+        # Usado pelas threads das ferramentas e da busca adiantada ao mesmo tempo
+        with self._lock:
+            self.counters[name] += 1
+
+    # ----- Nível 1: memória -----
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, vector = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.counters["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            return vector
+
+    def _memory_put(self, key, vector, expires_at=None):
+        with self._lock:
+            self._entries[key] = (expires_at or self._clock() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    # ----- Nível 2: Postgres -----
+
+    def _persistent_get(self, key):
+        with session_scope() as db:
+            try:
+                row = db.query(QueryEmbeddingCache).filter(QueryEmbeddingCache.key == key).first()
+                if row is None:
+                    return None, None
+                age = (datetime.now() - row.created_at).total_seconds()
+                if age >= self.ttl:
+                    return None, None
+                return list(row.embedding), self._clock() + (self.ttl - age)
+            except Exception as e:
+                logger.warning(f"Cache de embeddings: falha ao ler do banco: {e}")
+                db.rollback()
+                return None, None
+
+    def _persistent_put(self, key, text, vector):
+        with session_scope() as db:
+            try:
+                db.merge(QueryEmbeddingCache(
+                    key=key,
+                    model=self.model_name,
+                    query=normalize_query(text),
+                    embedding=vector,
+                    created_at=datetime.now(),
+                ))
+                self._purge_expired(db)
+                db.commit()
+            except Exception as e:
+                logger.warning(f"Cache de embeddings: falha ao gravar no banco: {e}")
+                db.rollback()
+
+    def _purge_expired(self, db):
+        # Remove entradas vencidas no máximo uma vez por hora por processo
+        now = self._clock()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        limite = datetime.now() - timedelta(seconds=self.ttl)
+        db.query(QueryEmbeddingCache).filter(QueryEmbeddingCache.created_at < limite).delete(synchronize_session=False)
+
+    # ----- Interface Embeddings -----
+
+    def embed_query(self, text):
+        with telemetry.span("embedding.embed_query", model=self.model_name) as query_span:
+            key = cache_key(text, self.model_name)
+
+            vector = self._memory_get(key)
+            if vector is not None:
+                self._count("memory_hits")
+                query_span.set_attribute("cache", "memory")
+                return vector
+
+            if self.persistent:
+                vector, expires_at = self._persistent_get(key)
+                if vector is not None:
+                    self._count("persistent_hits")
+                    query_span.set_attribute("cache", "persistent")
+                    self._memory_put(key, vector, expires_at)
+                    return vector
+
+            self._count("misses")
+            query_span.set_attribute("cache", "miss")
+            with self.limiter.slot() if self.limiter else nullcontext(), telemetry.EMBEDDING_LATENCY.time():
+                vector = self.base.embed_query(normalize_query(text))
+            self._memory_put(key, vector)
+            if self.persistent:
+                self._persistent_put(key, text, vector)
+            return vector
+
+    async def aembed_query(self, text):
+        with telemetry.span("embedding.embed_query", model=self.model_name) as query_span:
+            key = cache_key(text, self.model_name)
+
+            vector = self._memory_get(key)
+            if vector is not None:
+                self._count("memory_hits")
+                query_span.set_attribute("cache", "memory")
+                return vector
+
+            if self.persistent:
+                vector, expires_at = await asyncio.to_thread(self._persistent_get, key)
+                if vector is not None:
+                    self._count("persistent_hits")
+                    query_span.set_attribute("cache", "persistent")
+                    self._memory_put(key, vector, expires_at)
+                    return vector
+
+            self._count("misses")
+            query_span.set_attribute("cache", "miss")
+            async with self.limiter.aslot() if self.limiter else nullcontext():
+                with telemetry.EMBEDDING_LATENCY.time():
+                    vector = await self.base.aembed_query(normalize_query(text))
+            self._memory_put(key, vector)
+            if self.persistent:
+                await asyncio.to_thread(self._persistent_put, key, text, vector)
+            return vector
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
+
+    def stats(self):
+        """Contadores de acerto/erro e ocupação do cache em memória."""
+        with self._lock:
+            size = len(self._entries)
+            counters = dict(self.counters)
+        hits = counters["memory_hits"] + counters["persistent_hits"]
+        total = hits + counters["misses"]
+        return {
+            **counters,
+            "size": size,
+            "max_size": self.max_size,
+            "hit_rate": hits / total if total else 0.0,
+        }
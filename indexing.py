@@ -0,0 +1,426 @@
+"""
+Indexação dos documentos da pasta data/ no pgvector.
+
+Roda fora do caminho de import do app, como job separado:
+    python indexing.py
+ou numa thread em background ao subir o app (INDEX_ON_STARTUP=background).
+
+Cada arquivo tem uma linha em `document_manifests` (hash, tamanho, mtime) e
+cada chunk guarda o próprio hash, então uma edição só re-gera os embeddings
+dos chunks que de fato mudaram.
+
+Os chunks são enviados ao modelo de embeddings em lotes (`embed_documents`),
+com um número limitado de lotes em paralelo e retry com backoff exponencial.
+As linhas são gravadas com INSERT multi-row em vez de objetos do ORM.
+
+Ao final, os chunks quase duplicados de cada coleção são agrupados
+(`cluster_id`, ver near_duplicates.py) para a busca devolver só um por grupo.
+"""
+import os
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import insert, or_
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from retrieval import COLLECTIONS, RETRIEVAL_BACKEND
+from pdf_extraction import extract_pdf_text, prune_text_cache
+from near_duplicates import minhash, cluster_ids, NEAR_DUP_ENABLED
+from database import session_scope, init_db, ensure_vector_indexes, DocumentEmbedding, DocumentManifest, EMBEDDING_MODEL, EMBEDDING_CHECK_CTX_LENGTH, VECTOR_INDEX_TYPE
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt', '.md')
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+EMBEDDING_RETRY_BASE_DELAY = float(os.getenv("EMBEDDING_RETRY_BASE_DELAY", "1.0"))
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "500"))
+# "background" dispara a indexação numa thread ao criar o app; qualquer outro valor não faz nada
+INDEX_ON_STARTUP = os.getenv("INDEX_ON_STARTUP", "false").lower()
+
+# Estado da indexação neste processo (exposto no endpoint de readiness)
+index_state = {
+    "status": "idle",  # idle | running | ready | failed
+    "started_at": None,
+    "finished_at": None,
+    "error": None,
+    "summary": None,
+}
+_index_lock = threading.Lock()
+
+
+def collection_for_source(source):
+    """Coleção de um arquivo de data/ (ver retrieval.COLLECTIONS), ou None se não pertencer a nenhuma."""
+    name = unicodedata.normalize("NFC", source).casefold()
+    for collection in COLLECTIONS.values():
+        if source in collection.sources:
+            return collection.name
+        if any(keyword in name for keyword in collection.source_keywords):
+            return collection.name
+    return None
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _embed_batch(model, batch, max_retries=EMBEDDING_MAX_RETRIES, base_delay=EMBEDDING_RETRY_BASE_DELAY):
+    """Gera embeddings de um lote, com retry e backoff exponencial (com jitter)."""
+    for attempt in range(max_retries + 1):
+        try:
+            return model.embed_documents(batch)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * (2 ** attempt) * (1 + random.random())
+            logger.warning(f"  -> Falha ao gerar embeddings do lote ({e}). Nova tentativa em {delay:.1f}s...")
+            time.sleep(delay)
+
+
+def embed_chunks(model, chunks, batch_size=EMBEDDING_BATCH_SIZE, max_concurrency=EMBEDDING_MAX_CONCURRENCY):
+    """Gera os embeddings de todos os chunks, preservando a ordem de entrada."""
+    batches = list(_batches(chunks, batch_size))
+    if not batches:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(batches)))) as pool:
+        results = pool.map(lambda batch: _embed_batch(model, batch), batches)
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+
+def bulk_insert_embeddings(db, rows, batch_size=INSERT_BATCH_SIZE):
+    """Grava as linhas de DocumentEmbedding com INSERT ... VALUES (...), (...), ..."""
+    for batch in _batches(rows, batch_size):
+        db.execute(insert(DocumentEmbedding).values(batch))
+
+
+def extract_text(file_path, file_hash=None):
+    """Extrai o texto de um PDF ou arquivo de texto (txt, md)."""
+    if file_path.lower().endswith('.pdf'):
+        # pypdf com fallback para pdfplumber, em paralelo e com cache por hash do arquivo
+        return extract_pdf_text(file_path, file_hash)
+
+    # Ler arquivos de texto (txt, md)
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        return f.read()
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_sha256(chunk):
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+def split_chunks(text):
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    return text_splitter.split_text(text)
+
+
+def _sync_file(db, embeddings_model, filename, file_path, file_hash, stat):
+    """
+    Re-indexa um arquivo alterado trocando apenas os chunks que mudaram.
+    Retorna (chunks_novos, chunks_removidos, chunks_reaproveitados).
+    Texto vazio (PDF escaneado ou corrompido) é erro: as linhas atuais e o manifesto
+    ficam como estão, e o arquivo é tentado de novo na próxima indexação.
+    """
+    chunks = split_chunks(extract_text(file_path, file_hash))
+    if not chunks:
+        raise ValueError(f"nenhum texto extraído de {filename}")
+    wanted = Counter(chunk_sha256(chunk) for chunk in chunks)
+
+    # Linhas atuais do arquivo (preenche chunk_hash de linhas antigas a partir do conteúdo)
+    existing = defaultdict(list)
+    for row_id, row_hash, content in db.query(
+        DocumentEmbedding.id, DocumentEmbedding.chunk_hash, DocumentEmbedding.content
+    ).filter(DocumentEmbedding.source == filename):
+        if row_hash is None:
+            row_hash = chunk_sha256(content or "")
+            db.query(DocumentEmbedding).filter(DocumentEmbedding.id == row_id)\
+              .update({"chunk_hash": row_hash}, synchronize_session=False)
+        existing[row_hash].append(row_id)
+
+    # Mantém até `wanted[h]` linhas por hash; o resto é removido
+    stale_ids = []
+    kept = Counter()
+    for row_hash, ids in existing.items():
+        keep = min(len(ids), wanted.get(row_hash, 0))
+        kept[row_hash] = keep
+        stale_ids.extend(ids[keep:])
+
+    to_embed = []
+    for chunk in chunks:
+        chunk_hash = chunk_sha256(chunk)
+        if kept[chunk_hash] > 0:
+            kept[chunk_hash] -= 1
+        else:
+            to_embed.append((chunk_hash, chunk))
+
+    if to_embed:
+        logger.info(f"  -> Gerando {len(to_embed)} embeddings para {filename} "
+                    f"({len(chunks) - len(to_embed)} chunks reaproveitados)...")
+    vectors = embed_chunks(embeddings_model, [chunk for _, chunk in to_embed])
+
+    # Troca dentro da mesma transação: remove os chunks antigos e insere os novos
+    if stale_ids:
+        db.query(DocumentEmbedding).filter(DocumentEmbedding.id.in_(stale_ids))\
+          .delete(synchronize_session=False)
+    bulk_insert_embeddings(db, [
+        {"content": chunk, "source": filename, "collection": collection_for_source(filename),
+         "chunk_hash": chunk_hash, "minhash": minhash(chunk), "embedding": vector}
+        for (chunk_hash, chunk), vector in zip(to_embed, vectors)
+    ])
+    db.merge(DocumentManifest(
+        source=filename,
+        file_hash=file_hash,
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+        chunk_count=len(chunks),
+        indexed_at=datetime.now(),
+    ))
+    return len(to_embed), len(stale_ids), len(chunks) - len(to_embed)
+
+
+def _backfill_collections(db):
+    """Preenche a coluna `collection` de linhas indexadas antes de ela existir."""
+    sources = [source for (source,) in db.query(DocumentEmbedding.source)
+               .filter(DocumentEmbedding.collection.is_(None)).distinct()]
+    for source in sources:
+        collection = collection_for_source(source)
+        if collection:
+            db.query(DocumentEmbedding).filter(
+                DocumentEmbedding.source == source,
+                DocumentEmbedding.collection.is_(None),
+            ).update({"collection": collection}, synchronize_session=False)
+    db.commit()
+
+
+def assign_clusters(db):
+    """
+    Recalcula os grupos de quase duplicados de cada coleção e grava `cluster_id`
+    só nas linhas que mudaram. Linhas antigas sem assinatura são preenchidas.
+    Retorna quantos chunks estão em grupos com mais de um membro.
+    """
+    rows = db.query(DocumentEmbedding.id, DocumentEmbedding.collection,
+                    DocumentEmbedding.minhash, DocumentEmbedding.cluster_id)\
+             .filter(DocumentEmbedding.collection.isnot(None)).all()
+
+    missing = [row.id for row in rows if row.minhash is None]
+    signatures = {row.id: row.minhash for row in rows}
+    if missing:
+        for row_id, content in db.query(DocumentEmbedding.id, DocumentEmbedding.content)\
+                                  .filter(DocumentEmbedding.id.in_(missing)):
+            signatures[row_id] = minhash(content)
+            db.query(DocumentEmbedding).filter(DocumentEmbedding.id == row_id)\
+              .update({"minhash": signatures[row_id]}, synchronize_session=False)
+
+    by_collection = defaultdict(list)
+    for row in rows:
+        by_collection[row.collection].append((row.id, signatures[row.id]))
+    clusters = {}
+    for items in by_collection.values():
+        clusters.update(cluster_ids(items))
+
+    current = {row.id: row.cluster_id for row in rows}
+    changed = defaultdict(list)
+    for row_id, cluster in clusters.items():
+        if current[row_id] != cluster:
+            changed[cluster].append(row_id)
+    for cluster, ids in changed.items():
+        db.query(DocumentEmbedding).filter(DocumentEmbedding.id.in_(ids))\
+          .update({"cluster_id": cluster}, synchronize_session=False)
+    db.commit()
+
+    sizes = Counter(clusters.values())
+    duplicates = sum(size for size in sizes.values() if size > 1)
+    if changed or missing:
+        logger.info(f"Quase duplicados: {duplicates} chunks em {sum(s > 1 for s in sizes.values())} grupos "
+                    f"({sum(len(ids) for ids in changed.values())} linhas atualizadas).")
+    return duplicates
+
+
+def _unclustered(db):
+    """Existe linha de alguma coleção sem assinatura ou sem grupo (índice antigo, coleção recém-preenchida)?"""
+    return db.query(DocumentEmbedding.id).filter(
+        DocumentEmbedding.collection.isnot(None),
+        or_(DocumentEmbedding.minhash.is_(None), DocumentEmbedding.cluster_id.is_(None)),
+    ).first() is not None
+
+
+def _remove_missing_sources(db, present):
+    """Remove linhas e manifesto de arquivos que não existem mais em data/."""
+    indexed = {source for (source,) in db.query(DocumentEmbedding.source).distinct()}
+    indexed |= {source for (source,) in db.query(DocumentManifest.source)}
+    removed = sorted(indexed - set(present))
+    for source in removed:
+        deleted = db.query(DocumentEmbedding).filter(DocumentEmbedding.source == source)\
+                    .delete(synchronize_session=False)
+        db.query(DocumentManifest).filter(DocumentManifest.source == source)\
+          .delete(synchronize_session=False)
+        logger.info(f"Removido do índice: {source} ({deleted} chunks).")
+    db.commit()
+    return removed
+
+
+def init_vector_store(embeddings_model, data_dir=DATA_DIR):
+    """
+    Sincroniza a pasta de dados com o banco de forma incremental.
+
+    Arquivos com tamanho/mtime iguais ao manifesto são ignorados sem ler o conteúdo;
+    se o hash do arquivo mudou, só os chunks diferentes são re-gerados.
+    Arquivos removidos têm suas linhas apagadas.
+    """
+    if not os.path.exists(data_dir):
+        print(f"Diretório de dados não encontrado: {data_dir}")
+        return
+
+    # Listar arquivos
+    files = [f for f in os.listdir(data_dir) if f.lower().endswith(SUPPORTED_EXTENSIONS)]
+
+    totals = Counter()
+    total_seconds = 0.0
+
+    with session_scope() as db:
+        removed_sources = _remove_missing_sources(db, files)
+        _backfill_collections(db)
+        manifests = {m.source: m for m in db.query(DocumentManifest)}
+
+        for filename in files:
+            file_path = os.path.join(data_dir, filename)
+            stat = os.stat(file_path)
+            manifest = manifests.get(filename)
+
+            # Caminho rápido: metadados iguais ao manifesto
+            if manifest and manifest.size == stat.st_size and manifest.mtime == stat.st_mtime:
+                print(f"Skipping {filename}: já indexado.")
+                continue
+
+            file_hash = file_sha256(file_path)
+            if manifest and manifest.file_hash == file_hash:
+                # Conteúdo igual (ex.: arquivo apenas tocado), só atualiza os metadados
+                manifest.size = stat.st_size
+                manifest.mtime = stat.st_mtime
+                db.commit()
+                print(f"Skipping {filename}: conteúdo inalterado.")
+                continue
+
+            print(f"Processando {'arquivo alterado' if manifest else 'novo arquivo'}: {filename}...")
+
+            try:
+                inicio = time.perf_counter()
+                added, removed, reused = _sync_file(db, embeddings_model, filename, file_path, file_hash, stat)
+                db.commit()
+                elapsed = max(time.perf_counter() - inicio, 1e-9)
+
+                totals.update(added=added, removed=removed, reused=reused)
+                total_seconds += elapsed
+                logger.info(f"  -> Sucesso: {filename} salvo (+{added} / -{removed} chunks, "
+                            f"{reused} reaproveitados, {added / elapsed:.1f} chunks/s).")
+
+            except Exception as e:
+                logger.error(f"  -> Erro ao processar {filename}: {e}", exc_info=True)
+                db.rollback()
+
+        # Sem chunks novos ou removidos os grupos não mudam; só linhas ainda sem grupo pedem o recálculo
+        if NEAR_DUP_ENABLED and (totals["added"] or totals["removed"] or removed_sources or _unclustered(db)):
+            totals["near_duplicates"] = assign_clusters(db)
+
+        # Texto extraído de versões que não estão mais no índice
+        pruned = prune_text_cache({file_hash for (file_hash,) in db.query(DocumentManifest.file_hash)})
+        if pruned:
+            logger.info(f"Cache de texto de PDFs: {pruned} arquivos antigos removidos.")
+
+    summary = {**totals, "seconds": round(total_seconds, 3)}
+    if totals["added"] or totals["removed"]:
+        # IVFFlat precisa ser re-treinado quando os dados mudam
+        if VECTOR_INDEX_TYPE == "ivfflat":
+            ensure_vector_indexes(reindex=True)
+        logger.info(f"Indexação concluída: +{totals['added']} / -{totals['removed']} chunks "
+                    f"({totals['reused']} reaproveitados) em {total_seconds:.1f}s "
+                    f"({totals['added'] / max(total_seconds, 1e-9):.1f} chunks/s).")
+    return summary
+
+
+def run_indexing(embeddings_model=None, data_dir=DATA_DIR, write_vector_snapshot=False):
+    """Cria/atualiza o schema e sincroniza data/ com o banco, registrando o estado."""
+    if not _index_lock.acquire(blocking=False):
+        logger.info("Indexação já em andamento neste processo.")
+        return None
+    try:
+        index_state.update(status="running", started_at=datetime.now().isoformat(), finished_at=None, error=None)
+        if embeddings_model is None:
+            from langchain_openai import OpenAIEmbeddings
+            embeddings_model = OpenAIEmbeddings(model=EMBEDDING_MODEL, check_embedding_ctx_length=EMBEDDING_CHECK_CTX_LENGTH)
+        init_db()
+        summary = init_vector_store(embeddings_model, data_dir=data_dir)
+        if write_vector_snapshot or RETRIEVAL_BACKEND == "numpy":
+            # Publica o snapshot lido pelo backend NumPy (só reescreve se o índice mudou)
+            from vector_snapshot import write_snapshot
+            write_snapshot()
+        index_state.update(status="ready", summary=summary)
+        return summary
+    except Exception as e:
+        logger.error(f"Falha na indexação: {e}", exc_info=True)
+        index_state.update(status="failed", error=str(e))
+        raise
+    finally:
+        index_state["finished_at"] = datetime.now().isoformat()
+        _index_lock.release()
+
+
+def start_background_indexing(embeddings_model=None):
+    """Dispara run_indexing numa thread daemon (não bloqueia a subida do app)."""
+    def _run():
+        try:
+            run_indexing(embeddings_model)
+        except Exception:
+            pass  # já registrado em index_state
+
+    thread = threading.Thread(target=_run, name="indexing", daemon=True)
+    thread.start()
+    return thread
+
+
+def index_status(db):
+    """Estado do índice: manifesto por arquivo + estado da indexação neste processo."""
+    sources = [
+        {
+            "source": m.source,
+            "chunks": m.chunk_count,
+            "indexed_at": m.indexed_at.isoformat() if m.indexed_at else None,
+        }
+        for m in db.query(DocumentManifest).order_by(DocumentManifest.source)
+    ]
+    return {
+        "job": dict(index_state),
+        "sources": sources,
+        "total_chunks": sum(s["chunks"] or 0 for s in sources),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cria o schema e indexa os arquivos de data/ no pgvector.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Pasta com os documentos (padrão: data/)")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="Grava o snapshot de vetores do backend NumPy mesmo com RETRIEVAL_BACKEND=pgvector")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(run_indexing(data_dir=args.data_dir, write_vector_snapshot=args.snapshot))
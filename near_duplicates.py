@@ -0,0 +1,179 @@
+"""
+Detecção de chunks quase duplicados (MinHash + LSH) para a indexação e a busca.
+
+Os currículos (backend/fullstack) têm seções quase idênticas, e o overlap de
+200 caracteres do splitter repete trechos entre chunks vizinhos: sem
+deduplicação, a ferramenta devolve ao LLM vários chunks dizendo a mesma coisa.
+São dois problemas diferentes:
+
+- Indexação: cada chunk ganha uma assinatura MinHash (NEAR_DUP_PERMUTATIONS
+  valores de 32 bits sobre shingles de palavras normalizadas). Os chunks da
+  mesma coleção com similaridade de Jaccard estimada >= NEAR_DUP_THRESHOLD são
+  agrupados num cluster (cluster_id = menor id do grupo).
+- Busca: de cada cluster só o chunk mais relevante chega ao LLM
+  (ver RetrievalEngine).
+- Overlap do splitter: dois vizinhos de ~1000 caracteres que repetem 200 têm
+  Jaccard ~0.1, longe do limiar, e não são duplicados (o resto é diferente).
+  Na montagem da saída da ferramenta, strip_overlaps corta de cada chunk o
+  trecho que repete o início ou o fim de um chunk já incluído.
+
+MinHash em vez de SimHash: como as fronteiras dos chunks mudam de um currículo
+para o outro, os pares repetidos só se sobrepõem em parte (Jaccard ~0.4-0.7),
+e essa faixa o SimHash de 64 bits não separa de textos diferentes.
+
+A comparação é lexical: traduções (arquivos *.pt.en.pdf, *.en.md) não são
+detectadas — elas também não pertencem a nenhuma coleção consultada.
+"""
+import os
+import re
+import random
+import hashlib
+import unicodedata
+from array import array
+from collections import defaultdict
+
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "true").lower() == "true"
+# Jaccard estimado mínimo entre dois chunks para considerá-los quase duplicados
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.5"))
+NEAR_DUP_SHINGLE_SIZE = int(os.getenv("NEAR_DUP_SHINGLE_SIZE", "3"))
+# Assinatura = PERMUTATIONS valores; LSH com BANDS bandas (PERMUTATIONS / BANDS linhas cada).
+# 64 / 16 -> limiar do LSH em ~(1/16)^(1/4) = 0.5
+NEAR_DUP_PERMUTATIONS = 64
+NEAR_DUP_BANDS = 16
+# Menor trecho repetido entre dois chunks tratado como overlap do splitter (evita cortar frases comuns)
+NEAR_DUP_OVERLAP_MIN_CHARS = int(os.getenv("NEAR_DUP_OVERLAP_MIN_CHARS", "40"))
+# Folga sobre o chunk_overlap de 200 caracteres do splitter (indexing.py)
+OVERLAP_MAX_CHARS = 400
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WORD_RE = re.compile(r"\w+")
+
+# Permutações fixas (a*x + b mod p): a mesma semente em todos os processos e versões
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(NEAR_DUP_PERMUTATIONS)]
+del _rng
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFKD", text or "").casefold()
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def shingles(text, size=NEAR_DUP_SHINGLE_SIZE):
+    """Conjunto de sequências de `size` palavras (sem acentos, em minúsculas)."""
+    words = _WORD_RE.findall(_normalize(text))
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(text, size=NEAR_DUP_SHINGLE_SIZE):
+    """Assinatura MinHash do texto, serializada em bytes (para a coluna `minhash`)."""
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+              for s in shingles(text, size)]
+    if not hashes:
+        signature = array("I", [_MAX_HASH] * NEAR_DUP_PERMUTATIONS)
+    else:
+        signature = array("I", (
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in _PERMUTATIONS
+        ))
+    return signature.tobytes()
+
+
+def _values(signature):
+    values = array("I")
+    values.frombytes(signature)
+    return values
+
+
+def similarity(a, b):
+    """Jaccard estimado entre duas assinaturas."""
+    a, b = _values(a), _values(b)
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def cluster_ids(items, threshold=NEAR_DUP_THRESHOLD):
+    """
+    Agrupa [(id, assinatura), ...] por Jaccard estimado >= threshold (fecho transitivo).
+    Retorna {id: cluster_id}, com cluster_id = menor id do grupo.
+
+    Só pares que coincidem em alguma banda do LSH são comparados.
+    """
+    parent = {item_id: item_id for item_id, _ in items}
+
+    def find(item_id):
+        while parent[item_id] != item_id:
+            parent[item_id] = parent[parent[item_id]]
+            item_id = parent[item_id]
+        return item_id
+
+    rows = NEAR_DUP_PERMUTATIONS // NEAR_DUP_BANDS
+    buckets = defaultdict(list)
+    signatures = {}
+    for item_id, signature in items:
+        if signature is None:
+            continue
+        values = _values(signature)
+        if values[0] == _MAX_HASH and len(set(values)) == 1:
+            continue  # Chunk sem palavras: não agrupa com nada
+        signatures[item_id] = signature
+        for band in range(NEAR_DUP_BANDS):
+            buckets[(band, tuple(values[band * rows:(band + 1) * rows]))].append(item_id)
+
+    compared = set()
+    for bucket in buckets.values():
+        for i, a in enumerate(bucket):
+            for b in bucket[i + 1:]:
+                if (a, b) in compared:
+                    continue
+                compared.add((a, b))
+                if similarity(signatures[a], signatures[b]) >= threshold:
+                    root_a, root_b = find(a), find(b)
+                    if root_a != root_b:
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    return {item_id: find(item_id) for item_id, _ in items}
+
+
+def _overlap(before, after, min_chars):
+    """Tamanho do maior fim de `before` que é também o começo de `after` (0 se menor que min_chars)."""
+    for size in range(min(len(before), len(after), OVERLAP_MAX_CHARS), min_chars - 1, -1):
+        if before.endswith(after[:size]):
+            return size
+    return 0
+
+
+def strip_overlaps(contents, min_chars=NEAR_DUP_OVERLAP_MIN_CHARS):
+    """
+    Corta de cada chunk (em ordem de relevância) o trecho repetido com um chunk anterior da lista:
+    começo igual ao fim dele, ou fim igual ao começo dele. Chunks que sobram vazios saem.
+    """
+    kept, originals = [], []
+    for content in contents:
+        text = content
+        for previous in originals:
+            text = text[_overlap(previous, text, min_chars):]
+            text = text[:len(text) - _overlap(text, previous, min_chars)]
+        if text.strip():
+            kept.append(text.strip())
+            originals.append(content)
+    return kept
+
+
+def collapse(chunks, k=None):
+    """Mantém o primeiro chunk (o mais relevante) de cada cluster, preservando a ordem."""
+    seen = set()
+    kept = []
+    for chunk in chunks:
+        cluster = getattr(chunk, "cluster_id", None)
+        if cluster is not None:
+            if cluster in seen:
+                continue
+            seen.add(cluster)
+        kept.append(chunk)
+        if k is not None and len(kept) >= k:
+            break
+    return kept
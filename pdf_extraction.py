@@ -0,0 +1,177 @@
+"""
+Extração de texto de PDFs para a indexação.
+
+- Caminho rápido com pypdf; pdfplumber (bem mais lento, mas respeita o
+  layout) só nas páginas em que o texto do pypdf parece ruim: vazio, com
+  caracteres de substituição, palavras grudadas ou linhas picotadas.
+- PDFs grandes são divididos em faixas de páginas processadas num pool de
+  processos (PDF_EXTRACTION_WORKERS).
+- O texto de cada página fica em cache no disco, por hash do arquivo: uma
+  nova indexação do mesmo PDF não extrai nada. Ao fim de cada indexação
+  saem do cache os hashes que não estão mais no manifesto (prune_text_cache).
+"""
+import os
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PDF_EXTRACTION_MODE = os.getenv("PDF_EXTRACTION_MODE", "auto")  # auto | pypdf | pdfplumber
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Abaixo disso o custo de subir os processos (spawn + imports, ~1-2 s) não compensa
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+PDF_TEXT_CACHE_DIR = os.getenv(
+    "PDF_TEXT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "pdf_text"),
+)
+# Incrementar quando a heurística ou os extratores mudarem (invalida o cache)
+EXTRACTOR_VERSION = 1
+
+
+def needs_layout(text):
+    """Heurística: o texto do pypdf desta página precisa do pdfplumber?"""
+    stripped = (text or "").strip()
+    if len(stripped) < 20:
+        return True
+    if stripped.count("�") / len(stripped) > 0.01:
+        return True
+    words = stripped.split()
+    if sum(len(w) for w in words) / len(words) > 20:
+        # Espaços perdidos: palavras grudadas
+        return True
+    lines = [line for line in stripped.splitlines() if line.strip()]
+    if len(lines) >= 10 and sum(len(line.strip()) <= 2 for line in lines) / len(lines) > 0.3:
+        # Colunas ou tabelas quebradas em linhas de um caractere
+        return True
+    return False
+
+
+def extract_pages(file_path, start, end, mode=PDF_EXTRACTION_MODE):
+    """Extrai as páginas [start, end). Retorna [(texto, extrator), ...] (executa no processo filho)."""
+    from pypdf import PdfReader
+    import pdfplumber
+
+    results = []
+    reader = None
+    if mode != "pdfplumber":
+        try:
+            reader = PdfReader(file_path)
+        except Exception:
+            # Estrutura que o pypdf não entende: o arquivo inteiro vai pelo pdfplumber
+            reader = None
+    plumber = None
+    try:
+        for index in range(start, end):
+            text = None
+            if reader is not None:
+                try:
+                    text = reader.pages[index].extract_text() or ""
+                except Exception:
+                    text = None
+            if mode == "pypdf" and text is not None:
+                results.append((text, "pypdf"))
+                continue
+            if text is not None and mode == "auto" and not needs_layout(text):
+                results.append((text, "pypdf"))
+                continue
+            if plumber is None:
+                plumber = pdfplumber.open(file_path)
+            results.append((plumber.pages[index].extract_text() or "", "pdfplumber"))
+    finally:
+        if plumber is not None:
+            plumber.close()
+    return results
+
+
+def _page_count(file_path):
+    from pypdf import PdfReader
+    try:
+        return len(PdfReader(file_path).pages)
+    except Exception:
+        import pdfplumber
+        with pdfplumber.open(file_path) as pdf:
+            return len(pdf.pages)
+
+
+def _cache_path(cache_dir, file_hash):
+    return os.path.join(cache_dir, f"{file_hash}.json")
+
+
+def _read_cache(cache_dir, file_hash):
+    try:
+        with open(_cache_path(cache_dir, file_hash), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == EXTRACTOR_VERSION:
+            return data["pages"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def _write_cache(cache_dir, file_hash, pages):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = _cache_path(cache_dir, file_hash) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": EXTRACTOR_VERSION, "pages": pages}, f, ensure_ascii=False)
+        os.replace(tmp, _cache_path(cache_dir, file_hash))
+    except OSError as e:
+        logger.warning(f"Não foi possível gravar o cache de texto do PDF: {e}")
+
+
+def prune_text_cache(keep_hashes, cache_dir=PDF_TEXT_CACHE_DIR):
+    """Apaga do cache os textos de arquivos cujo hash não está em `keep_hashes`. Retorna quantos saíram."""
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return 0
+    removed = 0
+    for name in names:
+        # .tmp de uma gravação em andamento fica para a próxima vez
+        file_hash, ext = os.path.splitext(name)
+        if ext != ".json" or file_hash in keep_hashes:
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Não foi possível remover {name} do cache de texto do PDF: {e}")
+    return removed
+
+
+def extract_pdf_pages(file_path, file_hash, workers=PDF_EXTRACTION_WORKERS, cache_dir=PDF_TEXT_CACHE_DIR,
+                      min_parallel_pages=PDF_PARALLEL_MIN_PAGES):
+    """Texto por página (lista de dicts com text/engine), do cache ou extraído agora."""
+    if file_hash and cache_dir:
+        cached = _read_cache(cache_dir, file_hash)
+        if cached is not None:
+            logger.info(f"{os.path.basename(file_path)}: texto do cache ({len(cached)} páginas).")
+            return cached
+
+    total = _page_count(file_path)
+    if workers > 1 and total >= min_parallel_pages:
+        # Faixas contíguas: cada processo abre o PDF uma vez só
+        step = -(-total // (workers * 2))
+        ranges = [(start, min(start + step, total)) for start in range(0, total, step)]
+        # spawn: a indexação pode rodar numa thread do app, e fork com threads ativas não é seguro
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            extracted = [page for part in pool.map(extract_pages, [file_path] * len(ranges),
+                                                   [s for s, _ in ranges], [e for _, e in ranges])
+                         for page in part]
+    else:
+        extracted = extract_pages(file_path, 0, total)
+
+    pages = [{"text": text, "engine": engine} for text, engine in extracted]
+    fallback = sum(page["engine"] == "pdfplumber" for page in pages)
+    logger.info(f"{os.path.basename(file_path)}: {total} páginas extraídas ({total - fallback} pypdf, "
+                f"{fallback} pdfplumber).")
+    if file_hash and cache_dir:
+        _write_cache(cache_dir, file_hash, pages)
+    return pages
+
+
+def extract_pdf_text(file_path, file_hash=None, **kwargs):
+    """Texto do PDF inteiro, páginas separadas por quebra de linha (páginas vazias são ignoradas)."""
+    return "".join(page["text"] + "\n" for page in extract_pdf_pages(file_path, file_hash, **kwargs) if page["text"])
@@ -0,0 +1,232 @@
+"""
+Busca especulativa: adianta a recuperação das coleções prováveis enquanto o
+primeiro turno do LLM ainda está em andamento.
+
+Quase toda conversa segue o mesmo padrão: o chatbot decide chamar
+consultar_curriculo, consultar_tcc ou consultar_iniciacao_cientifica e só
+então começam o embedding e a query no banco, depois de uma ida completa ao
+LLM. Aqui um classificador de intenção por palavras-chave (local, sem custo)
+escolhe até PREFETCH_MAX_COLLECTIONS coleções a partir da mensagem do usuário
+e a busca delas, com a própria mensagem como consulta, roda em paralelo com
+a chamada ao LLM.
+
+Quando a ferramenta é chamada para uma coleção adiantada, o resultado é
+reaproveitado se a consulta escolhida pelo LLM for compatível com a mensagem:
+pelo menos PREFETCH_MIN_OVERLAP dos termos da consulta aparecem na mensagem
+(o LLM costuma só extrair as palavras-chave da pergunta). Senão a ferramenta
+faz a busca normal. Só a primeira chamada de cada coleção é considerada.
+
+Resultado por coleção em prefetch_total{outcome}:
+- hit: resultado adiantado usado (o tempo economizado vai para prefetch_saved_seconds);
+- mismatch: a consulta do LLM era diferente demais da mensagem;
+- unpredicted: ferramenta chamada para uma coleção que não foi adiantada;
+- unused: adiantada e nunca pedida;
+- late / error: a busca ainda esperava na fila do executor, ou falhou.
+"""
+import os
+import re
+import time
+import asyncio
+import unicodedata
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import PREFETCH_OUTCOMES, PREFETCH_SAVED, register_collector
+from reranking import tokenize
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_MAX_COLLECTIONS = int(os.getenv("PREFETCH_MAX_COLLECTIONS", "2"))
+# Fração mínima dos termos da consulta do LLM presentes na mensagem do usuário
+PREFETCH_MIN_OVERLAP = float(os.getenv("PREFETCH_MIN_OVERLAP", "0.5"))
+# Threads para as buscas adiantadas no modo Flask (limita a carga extra no banco)
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "4"))
+
+# Palavras e expressões (sem acentos, minúsculas) que indicam cada coleção
+INTENT_KEYWORDS = {
+    "tcc": ("tcc", "trabalho de conclusao", "conclusao de curso", "monografia", "artigo", "graduacao"),
+    "ic": ("iniciacao cientifica", "ic", "pesquisa", "hidrodinamica", "hidrodinamico", "potencial",
+           "bolsa", "cientifica"),
+    "curriculo": ("experiencia", "experiencias", "habilidade", "habilidades", "tecnologia", "tecnologias",
+                  "stack", "curriculo", "cv", "trabalha", "trabalhou", "empresa", "empresas", "cargo",
+                  "emprego", "projeto", "projetos", "contato", "email", "linkedin", "github", "formacao",
+                  "backend", "frontend", "fullstack", "python", "java", "javascript", "react", "node",
+                  "quem e voce", "sobre voce", "experience", "skills", "resume"),
+}
+OUTCOMES = ("hit", "mismatch", "unpredicted", "unused", "late", "error")
+
+_PATTERNS = {
+    name: re.compile(r"\b(?:" + "|".join(re.escape(keyword) for keyword in keywords) + r")\b")
+    for name, keywords in INTENT_KEYWORDS.items()
+}
+
+current_prefetch = contextvars.ContextVar("current_prefetch", default=None)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+    return _executor
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFKD", text or "").casefold()
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def predict(message, max_collections=PREFETCH_MAX_COLLECTIONS):
+    """Coleções prováveis para a mensagem, da mais para a menos indicada (nenhuma se não houver pista)."""
+    text = _normalize(message)
+    scores = {name: len(pattern.findall(text)) for name, pattern in _PATTERNS.items()}
+    ranked = sorted((name for name, score in scores.items() if score), key=lambda name: -scores[name])
+    return ranked[:max_collections]
+
+
+def compatible(query, message, min_overlap=PREFETCH_MIN_OVERLAP):
+    """A consulta do LLM é basicamente a mensagem do usuário (termos da consulta contidos nela)?"""
+    terms = set(tokenize(query))
+    if not terms:
+        return False
+    return len(terms & set(tokenize(message))) / len(terms) >= min_overlap
+
+
+class Prefetch:
+    """Busca adiantada de uma requisição. Criada por `start` (Flask) ou `astart` (ASGI)."""
+
+    def __init__(self, message, collections):
+        self.message = message
+        self.collections = collections
+        self.started = time.perf_counter()
+        self.done_at = None
+        self.outcomes = {}
+        self.saved = {}  # coleção -> segundos de busca escondidos atrás do LLM
+        self._future = None
+        self._task = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, engine, message):
+        """Dispara a busca num executor de threads. Retorna None se não houver coleção provável."""
+        collections = predict(message) if PREFETCH_ENABLED else []
+        if not collections:
+            return None
+        prefetch = cls(message, collections)
+        # Copia o contexto: parâmetros de busca e span da requisição valem na thread da busca
+        prefetch._future = _get_executor().submit(contextvars.copy_context().run, prefetch._run, engine)
+        return prefetch
+
+    @classmethod
+    def astart(cls, engine, message):
+        """Versão assíncrona: a busca vira uma task no event loop atual."""
+        collections = predict(message) if PREFETCH_ENABLED else []
+        if not collections:
+            return None
+        prefetch = cls(message, collections)
+        prefetch._task = asyncio.create_task(prefetch._arun(engine))
+        return prefetch
+
+    def _run(self, engine):
+        try:
+            return engine.search(self.message, self.collections)
+        finally:
+            self.done_at = time.perf_counter()
+
+    async def _arun(self, engine):
+        try:
+            return await engine.asearch(self.message, self.collections)
+        finally:
+            self.done_at = time.perf_counter()
+
+    def _claim(self, name, query):
+        """Decide o resultado da primeira chamada da coleção; None nas chamadas seguintes."""
+        with self._lock:
+            if name in self.outcomes:
+                return None
+            if name not in self.collections:
+                outcome = "unpredicted"
+            elif not compatible(query, self.message):
+                outcome = "mismatch"
+            else:
+                outcome = "hit"
+            self.outcomes[name] = outcome
+        if outcome != "hit":
+            PREFETCH_OUTCOMES.inc(collection=name, outcome=outcome)
+        return outcome
+
+    def _record(self, name, asked_at, outcome):
+        with self._lock:
+            self.outcomes[name] = outcome
+        PREFETCH_OUTCOMES.inc(collection=name, outcome=outcome)
+        if outcome == "hit":
+            # Parte da busca que ficou escondida atrás do LLM
+            self.saved[name] = min(asked_at, self.done_at or asked_at) - self.started
+            PREFETCH_SAVED.observe(self.saved[name], collection=name)
+
+    def take(self, name, query):
+        """Chunks adiantados da coleção para esta consulta, ou None (a ferramenta busca normalmente)."""
+        asked_at = time.perf_counter()
+        if self._claim(name, query) != "hit":
+            return None
+        if self._future.cancel():
+            # Ainda na fila: buscar agora direto é mais rápido que esperar a vez
+            self._record(name, asked_at, "late")
+            return None
+        try:
+            results = self._future.result()
+        except Exception as e:
+            logger.warning(f"Busca especulativa falhou: {e}")
+            self._record(name, asked_at, "error")
+            return None
+        self._record(name, asked_at, "hit")
+        return results[name]
+
+    async def atake(self, name, query):
+        """Versão assíncrona de `take`."""
+        asked_at = time.perf_counter()
+        if self._claim(name, query) != "hit":
+            return None
+        try:
+            results = await self._task
+        except Exception as e:
+            logger.warning(f"Busca especulativa falhou: {e}")
+            self._record(name, asked_at, "error")
+            return None
+        self._record(name, asked_at, "hit")
+        return results[name]
+
+    def finish(self):
+        """Fim da execução do grafo: contabiliza as coleções não pedidas e descarta a busca pendente."""
+        for name in self.collections:
+            if name not in self.outcomes:
+                self.outcomes[name] = "unused"
+                PREFETCH_OUTCOMES.inc(collection=name, outcome="unused")
+        if self._future is not None:
+            self._future.cancel()
+        if self._task is not None:
+            if not self._task.done():
+                self._task.cancel()
+            elif not self._task.cancelled():
+                self._task.exception()  # Falha não pedida por nenhuma ferramenta: só marca como vista
+        logger.info("Busca especulativa: " + ", ".join(
+            f"{name} {outcome}" + (f" ({self.saved[name] * 1000:.0f} ms economizados)" if name in self.saved else "")
+            for name, outcome in self.outcomes.items()))
+
+
+def hit_ratio():
+    """Acertos / coleções previstas ou pedidas (para /api/metrics)."""
+    counts = {outcome: sum(PREFETCH_OUTCOMES.value(collection=name, outcome=outcome) for name in INTENT_KEYWORDS)
+              for outcome in OUTCOMES}
+    total = sum(counts.values())
+    return counts["hit"] / total if total else 0.0
+
+
+register_collector(lambda: [("prefetch_hit_ratio", "gauge", "Taxa de acerto da busca especulativa.", {}, hit_ratio())])
@@ -0,0 +1,231 @@
+"""
+Migração para índices vetoriais quantizados (halfvec / binário) e relatório
+de recall/latência.
+
+Um índice HNSW de vetores float32 de 1536 dimensões ocupa ~6 KB por chunk e
+precisa caber em memória. Os índices quantizados são índices de expressão
+sobre a mesma coluna `embedding` (ver database.QUANTIZED_INDEX_EXPRESSIONS):
+halfvec guarda 2 bytes por dimensão (~metade) e o binário 1 bit (~1/32). A
+tabela não muda; a busca percorre o índice quantizado pedindo mais
+candidatos e os reordena pela distância exata (retrieval.PgVectorBackend).
+
+Migração (Postgres com pgvector >= 0.7, sem parar o serviço):
+    1. python quantization.py build --quantization halfvec
+       cria os índices quantizados com CREATE INDEX CONCURRENTLY, ao lado dos atuais;
+    2. python quantization.py report
+       compara cada quantização com a busca exata: recall@k, latência e tamanho dos índices;
+    3. VECTOR_QUANTIZATION=halfvec no ambiente e reinício dos workers;
+    4. python quantization.py drop --quantization none
+       remove os índices de precisão completa (só depois que nenhum worker os usa).
+Voltar atrás é o mesmo caminho com VECTOR_QUANTIZATION=none.
+
+As consultas do relatório são as mais recentes de query_embedding_cache
+(perguntas reais); se houver poucas, o restante vem de chunks do corpus com
+ruído (o próprio chunk como consulta daria recall artificialmente alto).
+
+Uso:
+    python quantization.py build --quantization halfvec|binary [--index-type hnsw]
+    python quantization.py report [--quantizations none,halfvec,binary] [--queries 100] [--output relatorio.json]
+    python quantization.py drop --quantization none|halfvec|binary
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+from sqlalchemy import select, text
+
+from bench_stats import percentis
+from database import (engine, session_scope, vector_index_statements, vector_index_name, DocumentEmbedding,
+                      QueryEmbeddingCache, EMBEDDING_MODEL, VECTOR_COLLECTIONS, VECTOR_INDEX_TYPE,
+                      VECTOR_QUANTIZATION, QUANTIZED_INDEX_EXPRESSIONS)
+from retrieval import COLLECTIONS, PgVectorBackend
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATIONS = ("none", *QUANTIZED_INDEX_EXPRESSIONS)
+# Desvio do ruído somado aos chunks usados como consulta (vetores normalizados)
+QUERY_NOISE = 0.5
+
+
+def _require_postgres():
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("Índices quantizados exigem Postgres com pgvector >= 0.7.")
+
+
+def _autocommit():
+    """CREATE/DROP INDEX CONCURRENTLY não rodam dentro de transação."""
+    return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+
+def build_indexes(quantization, index_type=VECTOR_INDEX_TYPE):
+    """Cria os índices da quantização sem bloquear escritas nem remover os atuais."""
+    _require_postgres()
+    with _autocommit() as conn:
+        # Um CONCURRENTLY interrompido deixa um índice inválido que o IF NOT EXISTS pularia
+        invalid = conn.execute(text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = 'document_embeddings'::regclass AND NOT i.indisvalid"
+        )).scalars().all()
+        for name in invalid:
+            logger.warning(f"Removendo índice inválido {name} (construção anterior interrompida).")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        for statement in vector_index_statements(index_type, quantization, concurrently=True):
+            started = time.perf_counter()
+            conn.execute(text(statement))
+            logger.info(f"{statement.split(' ON ')[0]} ({time.perf_counter() - started:.1f}s)")
+
+
+def drop_indexes(quantization, index_type=VECTOR_INDEX_TYPE):
+    """Remove os índices de uma quantização que não está mais em uso."""
+    _require_postgres()
+    if quantization == VECTOR_QUANTIZATION:
+        raise SystemExit(f"'{quantization}' é a quantização ativa (VECTOR_QUANTIZATION); troque-a antes.")
+    with _autocommit() as conn:
+        for collection in VECTOR_COLLECTIONS:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS "
+                              f"{vector_index_name(index_type, collection, quantization)}"))
+
+
+def index_sizes(index_type=VECTOR_INDEX_TYPE):
+    """Bytes dos índices ANN de cada quantização (None quando algum índice da quantização não existe)."""
+    with engine.connect() as conn:
+        sizes = dict(conn.execute(text(
+            "SELECT c.relname, pg_relation_size(c.oid) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = 'document_embeddings'::regclass AND i.indisvalid"
+        )).all())
+    result = {}
+    for quantization in QUANTIZATIONS:
+        names = [vector_index_name(index_type, collection, quantization) for collection in VECTOR_COLLECTIONS]
+        result[quantization] = sum(sizes[n] for n in names) if all(n in sizes for n in names) else None
+    return result
+
+
+def sample_queries(db, n, rng, corpus):
+    """Consultas reais do cache de embeddings, completadas com chunks do corpus com ruído."""
+    queries = [np.asarray(v, dtype=np.float32) for v in db.execute(
+        select(QueryEmbeddingCache.embedding)
+        .where(QueryEmbeddingCache.model == EMBEDDING_MODEL)
+        .order_by(QueryEmbeddingCache.created_at.desc())
+        .limit(n)
+    ).scalars()]
+    vectors = np.concatenate([matrix for _, matrix in corpus.values()]) if corpus else None
+    while len(queries) < n and vectors is not None and len(vectors):
+        base = vectors[rng.integers(len(vectors))]
+        noisy = base + rng.normal(scale=QUERY_NOISE / np.sqrt(base.size), size=base.size).astype(np.float32)
+        queries.append(noisy / np.linalg.norm(noisy))
+    return queries
+
+
+def load_corpus(db):
+    """{coleção: (ids, matriz float32)} para a busca exata de referência."""
+    rows = db.execute(select(DocumentEmbedding.id, DocumentEmbedding.collection, DocumentEmbedding.embedding)
+                      .where(DocumentEmbedding.collection.in_(list(COLLECTIONS)))).all()
+    corpus = {}
+    for name in COLLECTIONS:
+        selected = [(row.id, row.embedding) for row in rows if row.collection == name]
+        if selected:
+            ids, vectors = zip(*selected)
+            corpus[name] = (list(ids), np.asarray(vectors, dtype=np.float32))
+    return corpus
+
+
+def exact_top_k(corpus, query, k_by_name):
+    """Ids do top-k exato (L2) de cada coleção."""
+    result = {}
+    for name, k in k_by_name.items():
+        if name not in corpus:
+            continue
+        ids, matrix = corpus[name]
+        distances = np.linalg.norm(matrix - query, axis=1)
+        result[name] = [ids[i] for i in np.argsort(distances, kind="stable")[:k]]
+    return result
+
+
+def recall_at_k(found, expected):
+    """Fração do top-k exato encontrada, média entre as coleções."""
+    recalls = [len(set(found.get(name, ())) & set(ids)) / len(ids) for name, ids in expected.items() if ids]
+    return sum(recalls) / len(recalls) if recalls else None
+
+
+def report(quantizations=QUANTIZATIONS, queries=100, seed=42):
+    """Recall@k contra a busca exata, latência da busca e tamanho dos índices, por quantização."""
+    _require_postgres()
+    k_by_name = {name: collection.k for name, collection in COLLECTIONS.items()}
+    rng = np.random.default_rng(seed)
+    with session_scope() as db:
+        corpus = load_corpus(db)
+        sample = sample_queries(db, queries, rng, corpus)
+    expected = [exact_top_k(corpus, query, k_by_name) for query in sample]
+    sizes = index_sizes()
+
+    result = {
+        "chunks": sum(len(ids) for ids, _ in corpus.values()),
+        "queries": len(sample),
+        "index_type": VECTOR_INDEX_TYPE,
+        "by_quantization": {},
+    }
+    for quantization in quantizations:
+        backend = PgVectorBackend(mode="vector", quantization=quantization)
+        backend.search(sample[0].tolist(), k_by_name)  # aquecimento
+        recalls, latencies = [], []
+        for query, exact in zip(sample, expected):
+            started = time.perf_counter()
+            found = backend.search(query.tolist(), k_by_name)
+            latencies.append((time.perf_counter() - started) * 1000)
+            recalls.append(recall_at_k({name: [c.id for c in chunks] for name, chunks in found.items()}, exact))
+        recalls = [r for r in recalls if r is not None]
+        result["by_quantization"][quantization] = {
+            "indexed": sizes[quantization] is not None,
+            "index_bytes": sizes[quantization],
+            "recall_at_k": round(sum(recalls) / len(recalls), 4) if recalls else None,
+            "latency": percentis(latencies),
+        }
+    return result
+
+
+def _print_report(result):
+    print(f"{result['chunks']} chunks, {result['queries']} consultas, índices {result['index_type']}")
+    print(f"{'quantização':<12} {'recall@k':>9} {'p50 ms':>9} {'p95 ms':>9} {'índices':>12}")
+    for quantization, row in result["by_quantization"].items():
+        size = f"{row['index_bytes'] / 2 ** 20:.1f} MiB" if row["index_bytes"] is not None else "sem índice"
+        print(f"{quantization:<12} {row['recall_at_k'] if row['recall_at_k'] is not None else '-':>9} "
+              f"{row['latency'].get('p50_ms', '-'):>9} {row['latency'].get('p95_ms', '-'):>9} {size:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índices vetoriais quantizados: migração e relatório.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Cria os índices de uma quantização (CONCURRENTLY)")
+    build.add_argument("--quantization", choices=QUANTIZED_INDEX_EXPRESSIONS, required=True)
+    build.add_argument("--index-type", choices=("hnsw", "ivfflat"), default=VECTOR_INDEX_TYPE)
+    drop = commands.add_parser("drop", help="Remove os índices de uma quantização fora de uso")
+    drop.add_argument("--quantization", choices=QUANTIZATIONS, required=True)
+    drop.add_argument("--index-type", choices=("hnsw", "ivfflat"), default=VECTOR_INDEX_TYPE)
+    rep = commands.add_parser("report", help="Recall@k, latência e tamanho dos índices por quantização")
+    rep.add_argument("--quantizations", default=",".join(QUANTIZATIONS),
+                     type=lambda v: [q for q in v.split(",") if q])
+    rep.add_argument("--queries", type=int, default=100)
+    rep.add_argument("--output", help="Grava o relatório em JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "build":
+        build_indexes(args.quantization, args.index_type)
+    elif args.command == "drop":
+        drop_indexes(args.quantization, args.index_type)
+    else:
+        unknown = set(args.quantizations) - set(QUANTIZATIONS)
+        if unknown:
+            parser.error(f"quantizações desconhecidas: {', '.join(sorted(unknown))}")
+        result = report(args.quantizations, args.queries)
+        _print_report(result)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
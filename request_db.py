@@ -0,0 +1,30 @@
+"""
+Sessão de banco por requisição do Flask (fica fora de database.py para a
+camada de dados não depender do Flask).
+
+Os endpoints usam uma única sessão por requisição, fechada no teardown do
+app. Os helpers (caches, recuperação, resumos) usam database.session_scope,
+que sempre abre uma sessão própria.
+"""
+from flask import g
+
+from database import SessionLocal
+
+
+def get_request_db():
+    """Sessão única da requisição atual, fechada no teardown do app (ver init_app)."""
+    if "_db" not in g:
+        g._db = SessionLocal()
+    return g._db
+
+
+def close_request_db(exc=None):
+    db = g.pop("_db", None)
+    if db is not None:
+        if exc is not None:
+            db.rollback()
+        db.close()
+
+
+def init_app(app):
+    app.teardown_appcontext(close_request_db)
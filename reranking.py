@@ -0,0 +1,120 @@
+"""
+Re-ranking local dos chunks recuperados, antes de irem para o LLM.
+
+O backend devolve RERANK_OVERFETCH vezes mais candidatos (com os vetores) e
+aqui, sem nenhuma chamada externa:
+- a relevância de cada candidato combina a similaridade de cosseno com a
+  consulta e um BM25 calculado sobre os próprios candidatos (peso
+  LEXICAL_WEIGHT), o que favorece termos exatos (tecnologias, siglas, datas);
+- Maximal Marginal Relevance (MMR_LAMBDA) escolhe os k finais penalizando
+  chunks parecidos com os já escolhidos, usando os vetores já buscados.
+
+O resultado segue em ordem de escolha (mais relevante primeiro), pronto
+para `context_budget.pack_chunks`.
+"""
+import os
+import re
+import math
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() == "true"
+# Candidatos por coleção = k * RERANK_OVERFETCH
+RERANK_OVERFETCH = int(os.getenv("RERANK_OVERFETCH", "3"))
+# 1.0 = só relevância; 0.0 = só diversidade
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Peso do BM25 na relevância (o resto é a similaridade vetorial)
+LEXICAL_WEIGHT = float(os.getenv("LEXICAL_WEIGHT", "0.3"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r"\w+")
+# Palavras que não ajudam a distinguir chunks (consultas em português e inglês)
+STOPWORDS = frozenset("""
+a o as os um uma uns umas de do da dos das em no na nos nas por para com sem sobre e ou que se
+ao aos à às é foi ser são como mais qual quais quando onde seu sua seus suas ele ela isso este esta
+the an of in on at to for with and or is are was be by from as that this what which who how
+""".split())
+
+
+def tokenize(text):
+    text = unicodedata.normalize("NFKD", text or "").casefold()
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [word for word in _WORD_RE.findall(text) if word not in STOPWORDS]
+
+
+def bm25_scores(query, contents, k1=BM25_K1, b=BM25_B):
+    """BM25 da consulta contra cada conteúdo, com o IDF calculado sobre os próprios candidatos."""
+    terms = set(tokenize(query))
+    documents = [Counter(tokenize(content)) for content in contents]
+    if not terms or not documents:
+        return [0.0] * len(contents)
+    average = sum(sum(doc.values()) for doc in documents) / len(documents) or 1.0
+    frequency = {term: sum(term in doc for doc in documents) for term in terms}
+
+    scores = []
+    for doc in documents:
+        length = sum(doc.values())
+        score = 0.0
+        for term in terms:
+            tf = doc.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(documents) - frequency[term] + 0.5) / (frequency[term] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average))
+        scores.append(score)
+    return scores
+
+
+def _scale(values):
+    """Divide pelo maior valor (0..1), preservando o zero de quem não tem nenhum termo."""
+    values = np.asarray(values, dtype=np.float64)
+    top = values.max() if len(values) else 0.0
+    return values / top if top > 0 else np.zeros_like(values)
+
+
+def rerank(query, query_vector, chunks, k, mmr_lambda=MMR_LAMBDA, lexical_weight=LEXICAL_WEIGHT):
+    """
+    Escolhe até k chunks por MMR sobre a relevância híbrida (vetor + BM25).
+    Chunks sem vetor (`embedding` None) usam a distância retornada pelo backend
+    e não entram no cálculo de diversidade.
+    """
+    if len(chunks) <= 1:
+        return list(chunks)
+
+    has_vectors = all(chunk.embedding is not None for chunk in chunks)
+    if has_vectors:
+        vectors = np.asarray([chunk.embedding for chunk in chunks], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        q = np.asarray(query_vector, dtype=np.float32)
+        semantic = vectors @ (q / max(float(np.linalg.norm(q)), 1e-12))
+        similarity = vectors @ vectors.T
+    else:
+        # Sem vetores: 1 para o mais próximo, caindo com a distância
+        distances = np.asarray([chunk.distance for chunk in chunks], dtype=np.float64)
+        semantic = 1.0 / (1.0 + distances - distances.min())
+        similarity = None
+
+    # Cosseno na mesma escala da redundância do MMR; BM25 relativo ao melhor candidato
+    relevance = (1 - lexical_weight) * semantic + \
+        lexical_weight * _scale(bm25_scores(query, [chunk.content for chunk in chunks]))
+
+    selected = []
+    remaining = list(range(len(chunks)))
+    while remaining and len(selected) < k:
+        if similarity is None or not selected:
+            best = max(remaining, key=lambda i: relevance[i])
+        else:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+            scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+            best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+
+    result = []
+    for i in selected:
+        chunks[i].relevance = float(relevance[i])
+        result.append(chunks[i])
+    return result
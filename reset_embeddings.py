@@ -6,10 +6,10 @@ def reset_embeddings():
     db = next(get_db())
     
     try:
-        # Tentar truncar a tabela (mais rápido)
-        db.execute(text("TRUNCATE TABLE document_embeddings RESTART IDENTITY CASCADE;"))
+        # Tentar truncar a tabela (mais rápido). O manifesto vai junto para forçar a re-indexação.
+        db.execute(text("TRUNCATE TABLE document_embeddings, document_manifests RESTART IDENTITY CASCADE;"))
         db.commit()
-        print("✅ Tabela document_embeddings limpa com sucesso!")
+        print("✅ Tabelas document_embeddings e document_manifests limpas com sucesso!")
         
         # Opcional: Alterar a coluna se necessário, mas o SQLAlchemy deve lidar com isso no init_db se a tabela for recriada.
         # Como o pgvector define a dimensão na coluna, o ideal seria recriar a tabela se o truncate não resolver a dimensão da coluna,
@@ -0,0 +1,406 @@
+"""
+Motor de recuperação multi-coleção sobre document_embeddings.
+
+Cada coleção (TCC, IC, currículos, orçamento) é descrita no registro
+`COLLECTIONS`. Uma consulta a várias coleções gera um único embedding e
+uma única ida ao banco: um UNION ALL de subconsultas, uma por coleção,
+cada uma com seu próprio ORDER BY distância / LIMIT k (o que permite ao
+Postgres usar o índice ANN parcial de cada coleção).
+
+Com RETRIEVAL_MODE=hybrid o ranking vetorial é combinado com full-text
+(Reciprocal Rank Fusion) para acertar termos exatos (tecnologias, datas,
+nomes de cursos).
+
+Com RETRIEVAL_BACKEND=numpy a busca é exata, em memória, sobre um snapshot
+dos vetores (ver vector_snapshot.py).
+
+Chunks quase duplicados (mesmo `cluster_id`, ver near_duplicates.py) são
+colapsados: cada coleção busca NEAR_DUP_OVERFETCH vezes mais candidatos e só
+o mais relevante de cada grupo entra no top-k.
+
+Consultas em texto passam ainda pelo re-ranking local (reranking.py): BM25
+sobre os candidatos + MMR com os vetores já buscados.
+
+Com VECTOR_QUANTIZATION=halfvec|binary o pgvector percorre o índice
+quantizado (database.QUANTIZED_INDEX_EXPRESSIONS) pedindo
+QUANTIZATION_OVERFETCH vezes mais candidatos, e esses candidatos são
+reordenados pela distância exata sobre a coluna `embedding` completa.
+
+`asearch` é a versão assíncrona (modo ASGI): embedding pelo cliente async e
+consulta pelo driver asyncpg quando disponível.
+"""
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from sqlalchemy import select, union_all, text, bindparam, cast, func, literal
+from pgvector.sqlalchemy import Vector, HALFVEC, BIT
+
+import telemetry
+from near_duplicates import collapse, NEAR_DUP_ENABLED
+from reranking import rerank, RERANK_ENABLED, RERANK_OVERFETCH
+from database import (session_scope, async_session_scope, get_async_engine, apply_search_params,
+                      search_param_statements, DocumentEmbedding, EMBEDDING_DIM, VECTOR_QUANTIZATION)
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "pgvector")  # pgvector | numpy
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")  # vector | hybrid (só pgvector)
+# Modo híbrido: candidatos por ranking e constante k do Reciprocal Rank Fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Candidatos extras por coleção para repor os quase duplicados descartados
+NEAR_DUP_OVERFETCH = int(os.getenv("NEAR_DUP_OVERFETCH", "2"))
+# Candidatos do passo grosso (índice quantizado) por candidato final: o binário perde mais ordem
+QUANTIZATION_OVERFETCH = {
+    "none": 1,
+    "halfvec": int(os.getenv("HALFVEC_OVERFETCH", "2")),
+    "binary": int(os.getenv("BINARY_OVERFETCH", "8")),
+}
+
+
+@dataclass(frozen=True)
+class Collection:
+    name: str
+    label: str  # Nome usado nos logs
+    k: int  # Quantidade padrão de chunks retornados
+    empty_message: str
+    sources: tuple = ()  # Arquivos de data/ que pertencem à coleção
+    source_keywords: tuple = ()  # Ou: trechos que aparecem no nome do arquivo
+
+
+COLLECTIONS = {
+    "tcc": Collection(
+        name="tcc",
+        label="TCC",
+        k=5,
+        empty_message="Nenhuma informação encontrada no TCC sobre esse tema.",
+        sources=("artigo_base--abtn.pdf",),
+    ),
+    "ic": Collection(
+        name="ic",
+        label="IC",
+        k=5,
+        empty_message="Nenhuma informação encontrada na Iniciação Científica sobre esse tema.",
+        sources=("potencial_hidrodinamica_completo.pdf",),
+    ),
+    "curriculo": Collection(
+        name="curriculo",
+        label="Currículos",
+        k=10,
+        empty_message="Nenhuma informação encontrada nos currículos sobre esse tema.",
+        source_keywords=("curriculo", "currículo"),
+    ),
+    "orcamento": Collection(
+        name="orcamento",
+        label="Orçamento",
+        k=5,
+        empty_message="Nenhuma informação encontrada sobre orçamento de software.",
+        sources=("calcular_orcamento_de_software.md",),
+    ),
+}
+
+
+@dataclass
+class RetrievedChunk:
+    id: int
+    content: str
+    source: str
+    collection: str
+    distance: float
+    score: float = None  # Pontuação RRF (modo híbrido)
+    cluster_id: int = None  # Grupo de quase duplicados
+    embedding: list = None  # Vetor do chunk (só quando o re-ranking pede)
+    relevance: float = None  # Relevância combinada do re-ranking
+
+
+# Distância do passo grosso, igual à expressão dos índices quantizados (SQL do modo híbrido)
+_COARSE_DISTANCE_SQL = {
+    "halfvec": f"embedding::halfvec({EMBEDDING_DIM}) <-> CAST(:query_vector AS halfvec({EMBEDDING_DIM}))",
+    "binary": f"binary_quantize(embedding)::bit({EMBEDDING_DIM}) "
+              f"<~> binary_quantize(CAST(:query_vector AS vector({EMBEDDING_DIM})))",
+}
+
+_VECTOR_CANDIDATES = """
+        SELECT id, embedding <-> :query_vector AS distance
+        FROM document_embeddings
+        WHERE collection = :collection_{i}
+        ORDER BY distance
+        LIMIT :candidates"""
+
+# Passo grosso no índice quantizado, re-ranking pela distância exata
+_QUANTIZED_VECTOR_CANDIDATES = """
+        SELECT id, distance
+        FROM (
+            SELECT id, embedding <-> :query_vector AS distance
+            FROM document_embeddings
+            WHERE collection = :collection_{i}
+            ORDER BY {coarse_distance}
+            LIMIT :coarse_candidates
+        ) AS coarse_candidates
+        ORDER BY distance
+        LIMIT :candidates"""
+
+# Parte lexical do modo híbrido: tsquery com OR entre os termos, em português e inglês
+# (a coluna content_tsv indexa o conteúdo nas duas configurações)
+_HYBRID_BRANCH = """
+SELECT d.id, d.content, d.source, d.collection, d.cluster_id,{vector_column}
+       d.embedding <-> :query_vector AS distance,
+       COALESCE(1.0 / (:rrf_k + v.rank), 0.0) + COALESCE(1.0 / (:rrf_k + l.rank), 0.0) AS score
+FROM (
+    SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS rank
+    FROM ({vector_candidates}
+    ) AS vector_candidates
+) AS v
+FULL OUTER JOIN (
+    SELECT id, ROW_NUMBER() OVER (ORDER BY lexical_rank DESC) AS rank
+    FROM (
+        SELECT e.id, ts_rank_cd(e.content_tsv, tsq.query) AS lexical_rank
+        FROM document_embeddings AS e,
+             (SELECT replace(plainto_tsquery('portuguese', :query_text)::text, '&', '|')::tsquery
+                  || replace(plainto_tsquery('english', :query_text)::text, '&', '|')::tsquery AS query) AS tsq
+        WHERE e.collection = :collection_{i} AND e.content_tsv @@ tsq.query
+        ORDER BY lexical_rank DESC
+        LIMIT :candidates
+    ) AS lexical_candidates
+) AS l ON l.id = v.id
+JOIN document_embeddings AS d ON d.id = COALESCE(v.id, l.id)
+ORDER BY score DESC
+LIMIT :k_{i}
+"""
+
+
+class PgVectorBackend:
+    """
+    Busca no Postgres/pgvector (padrão).
+
+    No modo "hybrid" cada coleção combina o ranking vetorial com o ranking
+    full-text (tsvector/GIN) por Reciprocal Rank Fusion, ainda numa única
+    query SQL.
+
+    Com quantização, cada coleção busca `limit * overfetch` candidatos pelo
+    índice quantizado e os reordena pela distância exata (ainda na mesma query).
+    """
+
+    def __init__(self, mode=None, quantization=None):
+        self.mode = mode or RETRIEVAL_MODE
+        self.quantization = quantization or VECTOR_QUANTIZATION
+        self.coarse_overfetch = max(1, QUANTIZATION_OVERFETCH[self.quantization])
+
+    def _coarse_distance(self, query_vector):
+        """Mesma expressão dos índices de QUANTIZED_INDEX_EXPRESSIONS (senão o índice não é usado)."""
+        query = cast(literal(query_vector, Vector(EMBEDDING_DIM)), Vector(EMBEDDING_DIM))
+        if self.quantization == "halfvec":
+            return cast(DocumentEmbedding.embedding, HALFVEC(EMBEDDING_DIM)).l2_distance(
+                cast(query, HALFVEC(EMBEDDING_DIM)))
+        return cast(func.binary_quantize(DocumentEmbedding.embedding), BIT(EMBEDDING_DIM)).hamming_distance(
+            func.binary_quantize(query))
+
+    def _index_candidates(self, k_by_name, hybrid):
+        """Linhas pedidas ao índice ANN por coleção (para o hnsw.ef_search)."""
+        limit = HYBRID_CANDIDATES if hybrid else max(k_by_name.values())
+        return limit * self.coarse_overfetch
+
+    def _build_query(self, query_vector, k_by_name, with_vectors=False):
+        distance = DocumentEmbedding.embedding.l2_distance(query_vector).label("distance")
+        columns = [
+            DocumentEmbedding.id,
+            DocumentEmbedding.content,
+            DocumentEmbedding.source,
+            DocumentEmbedding.collection,
+            DocumentEmbedding.cluster_id,
+        ]
+        if with_vectors:
+            columns.append(DocumentEmbedding.embedding)
+        parts = []
+        for name, k in k_by_name.items():
+            candidates = select(
+                *columns,
+                distance,
+            ).where(
+                DocumentEmbedding.collection == name
+            )
+            if self.quantization == "none":
+                ranked = candidates.order_by(distance).limit(k).subquery()
+            else:
+                coarse = candidates.order_by(self._coarse_distance(query_vector)) \
+                                   .limit(k * self.coarse_overfetch).subquery()
+                ranked = select(*coarse.c).order_by(coarse.c.distance).limit(k).subquery()
+            parts.append(select(*ranked.c))
+        return parts[0] if len(parts) == 1 else union_all(*parts)
+
+    def _build_hybrid_query(self, query_vector, query_text, k_by_name, with_vectors=False):
+        branches = []
+        params = {
+            "query_vector": query_vector,
+            "query_text": query_text,
+            "candidates": HYBRID_CANDIDATES,
+            "rrf_k": RRF_K,
+        }
+        if self.quantization != "none":
+            params["coarse_candidates"] = HYBRID_CANDIDATES * self.coarse_overfetch
+        for i, (name, k) in enumerate(k_by_name.items()):
+            if self.quantization == "none":
+                vector_candidates = _VECTOR_CANDIDATES.format(i=i)
+            else:
+                vector_candidates = _QUANTIZED_VECTOR_CANDIDATES.format(
+                    i=i, coarse_distance=_COARSE_DISTANCE_SQL[self.quantization])
+            branch = _HYBRID_BRANCH.format(i=i, vector_column=" d.embedding," if with_vectors else "",
+                                           vector_candidates=vector_candidates)
+            branches.append(f"SELECT * FROM ({branch}) AS hybrid_{i}")
+            params[f"collection_{i}"] = name
+            params[f"k_{i}"] = k
+        statement = text("\nUNION ALL\n".join(branches)).bindparams(
+            bindparam("query_vector", type_=Vector(EMBEDDING_DIM))
+        )
+        if with_vectors:
+            # text() não sabe converter a coluna vector de volta para lista
+            statement = statement.columns(embedding=Vector(EMBEDDING_DIM))
+        return statement, params
+
+    def search(self, query_vector, k_by_name, query_text=None, with_vectors=False):
+        hybrid = self.mode == "hybrid" and bool(query_text and query_text.strip())
+
+        mode = "hybrid" if hybrid else "vector"
+        with telemetry.span("retrieval.sql", backend="pgvector", mode=mode, collections=",".join(k_by_name),
+                            quantization=self.quantization), \
+                telemetry.RETRIEVAL_LATENCY.time(backend="pgvector", mode=mode), session_scope() as db:
+            apply_search_params(db, candidates=self._index_candidates(k_by_name, hybrid))
+            if hybrid:
+                statement, params = self._build_hybrid_query(query_vector, query_text, k_by_name, with_vectors)
+                rows = db.execute(statement, params).all()
+            else:
+                rows = db.execute(self._build_query(query_vector, k_by_name, with_vectors)).all()
+            # Encerra a transação (e o SET LOCAL) para devolver a conexão ao pool
+            # enquanto o LLM continua trabalhando
+            db.commit()
+        return self._to_results(rows, k_by_name, hybrid, with_vectors)
+
+    async def asearch(self, query_vector, k_by_name, query_text=None, with_vectors=False):
+        """Mesma consulta pelo driver asyncpg; sem ele, a versão síncrona numa thread."""
+        if get_async_engine() is None:
+            return await asyncio.to_thread(self.search, query_vector, k_by_name, query_text, with_vectors)
+
+        hybrid = self.mode == "hybrid" and bool(query_text and query_text.strip())
+        mode = "hybrid" if hybrid else "vector"
+        with telemetry.span("retrieval.sql", backend="pgvector", mode=mode, collections=",".join(k_by_name),
+                            quantization=self.quantization, driver="asyncpg"), \
+                telemetry.RETRIEVAL_LATENCY.time(backend="pgvector", mode=mode):
+            async with async_session_scope() as db:
+                for statement in search_param_statements(candidates=self._index_candidates(k_by_name, hybrid)):
+                    await db.execute(text(statement))
+                if hybrid:
+                    statement, params = self._build_hybrid_query(query_vector, query_text, k_by_name, with_vectors)
+                    rows = (await db.execute(statement, params)).all()
+                else:
+                    rows = (await db.execute(self._build_query(query_vector, k_by_name, with_vectors))).all()
+                await db.commit()
+        return self._to_results(rows, k_by_name, hybrid, with_vectors)
+
+    @staticmethod
+    def _to_results(rows, k_by_name, hybrid, with_vectors):
+        results = {name: [] for name in k_by_name}
+        for row in rows:
+            results[row.collection].append(RetrievedChunk(
+                id=row.id,
+                content=row.content,
+                source=row.source,
+                collection=row.collection,
+                distance=float(row.distance),
+                score=float(row.score) if hybrid else None,
+                cluster_id=getattr(row, "cluster_id", None),
+                embedding=getattr(row, "embedding", None) if with_vectors else None,
+            ))
+        # UNION ALL não preserva a ordem de cada ramo
+        for chunks in results.values():
+            if hybrid:
+                chunks.sort(key=lambda chunk: -chunk.score)
+            else:
+                chunks.sort(key=lambda chunk: chunk.distance)
+        return results
+
+
+def make_backend(name=None):
+    """Backend configurado em RETRIEVAL_BACKEND: pgvector (padrão) ou numpy."""
+    name = name or RETRIEVAL_BACKEND
+    if name == "numpy":
+        # Import tardio: numpy só é necessário com este backend
+        from vector_snapshot import NumpyBackend
+        return NumpyBackend()
+    return PgVectorBackend()
+
+
+class RetrievalEngine:
+    """Busca vetorial em uma ou mais coleções com um embedding e uma ida ao backend."""
+
+    def __init__(self, embeddings, collections=COLLECTIONS, backend=None, collapse_duplicates=NEAR_DUP_ENABLED,
+                 overfetch=NEAR_DUP_OVERFETCH, rerank=RERANK_ENABLED, rerank_overfetch=RERANK_OVERFETCH):
+        self.embeddings = embeddings
+        self.collections = collections
+        self.backend = backend or make_backend()
+        self.collapse_duplicates = collapse_duplicates
+        self.overfetch = max(1, overfetch)
+        self.rerank = rerank
+        self.rerank_overfetch = max(1, rerank_overfetch)
+
+    def _k_for(self, name, k):
+        if isinstance(k, dict):
+            return k.get(name, self.collections[name].k)
+        return k or self.collections[name].k
+
+    def _plan(self, collections, k, query_text):
+        """(k final por coleção, candidatos a buscar por coleção, re-ranking ligado?)."""
+        k_by_name = {name: self._k_for(name, k) for name in collections if name in self.collections}
+        rerank_enabled = self.rerank and bool(query_text and query_text.strip())
+        overfetch = max(self.overfetch if self.collapse_duplicates else 1,
+                        self.rerank_overfetch if rerank_enabled else 1)
+        fetch = {name: k * overfetch for name, k in k_by_name.items()}
+        return k_by_name, fetch, rerank_enabled
+
+    def _finish(self, results, k_by_name, query_vector, query_text, rerank_enabled):
+        """Colapsa quase duplicados, re-ranqueia e corta no k de cada coleção."""
+        for name, chunks in results.items():
+            if self.collapse_duplicates:
+                chunks = collapse(chunks)
+            if rerank_enabled:
+                with telemetry.span("retrieval.rerank", collection=name, candidates=len(chunks)):
+                    chunks = rerank(query_text, query_vector, chunks, k_by_name[name])
+            results[name] = chunks[:k_by_name[name]]
+        return results
+
+    def search_by_vector(self, query_vector, collections, k=None, query_text=None):
+        """
+        Top-k por coleção para um vetor já calculado. `query_text` habilita o modo
+        híbrido do pgvector e o re-ranking local.
+        """
+        k_by_name, fetch, rerank_enabled = self._plan(collections, k, query_text)
+        if not k_by_name:
+            return {}
+        results = self.backend.search(query_vector, fetch, query_text=query_text, with_vectors=rerank_enabled)
+        return self._finish(results, k_by_name, query_vector, query_text, rerank_enabled)
+
+    async def asearch_by_vector(self, query_vector, collections, k=None, query_text=None):
+        """Versão assíncrona de `search_by_vector` (backends sem `asearch` rodam numa thread)."""
+        k_by_name, fetch, rerank_enabled = self._plan(collections, k, query_text)
+        if not k_by_name:
+            return {}
+        if hasattr(self.backend, "asearch"):
+            results = await self.backend.asearch(query_vector, fetch, query_text=query_text,
+                                                 with_vectors=rerank_enabled)
+        else:
+            results = await asyncio.to_thread(self.backend.search, query_vector, fetch, query_text=query_text,
+                                              with_vectors=rerank_enabled)
+        return self._finish(results, k_by_name, query_vector, query_text, rerank_enabled)
+
+    def search(self, query, collections, k=None):
+        """
+        Top-k por coleção para uma consulta em texto.
+        `k` pode ser um inteiro (todas as coleções) ou um dict por coleção.
+        """
+        return self.search_by_vector(self.embeddings.embed_query(query), collections, k, query_text=query)
+
+    async def asearch(self, query, collections, k=None):
+        """Versão assíncrona de `search` (modo ASGI)."""
+        query_vector = await self.embeddings.aembed_query(query)
+        return await self.asearch_by_vector(query_vector, collections, k, query_text=query)
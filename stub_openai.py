@@ -0,0 +1,252 @@
+"""
+Servidor local que fala o protocolo da OpenAI (chat completions e embeddings)
+para benchmarks e testes de carga sem custo e sem rede.
+
+- /v1/chat/completions: streaming (SSE) ou não, com uso de tokens. As chamadas
+  de ferramentas seguem um roteiro: a cada turno do agente, o stub chama as
+  ferramentas da próxima etapa do roteiro (se estiverem entre as oferecidas) e,
+  acabadas as etapas, devolve a resposta final.
+- /v1/embeddings: vetores determinísticos (hash do texto), normalizados,
+  em float ou base64.
+- Latência configurável: fixa + jitter por requisição e ritmo de tokens no streaming.
+
+Uso:
+    python stub_openai.py [--port 8089] [--latency-ms 300] [--jitter-ms 100]
+                          [--embedding-latency-ms 20] [--tokens-per-second 200]
+                          [--script roteiro.json]
+
+Roteiro (JSON): {"steps": [["consultar_curriculo"], ["obter_tempo_experiencia"]],
+                 "answer": "texto da resposta final"}
+"""
+import json
+import time
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+DEFAULT_SCRIPT = {
+    "steps": [["consultar_curriculo"]],
+    "answer": "Tenho experiência com Python, Flask, LangChain e PostgreSQL. "
+              "Se quiser conversar sobre um projeto, me chame no WhatsApp!",
+}
+
+
+class StubConfig:
+    def __init__(self, latency_ms=300, jitter_ms=100, embedding_latency_ms=20, tokens_per_second=200,
+                 dim=1536, script=None, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.embedding_latency_ms = embedding_latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.dim = dim
+        self.script = script or DEFAULT_SCRIPT
+        self.random = random.Random(seed)
+        self.requests = {"chat": 0, "embeddings": 0}
+        self._lock = threading.Lock()
+
+    def count(self, kind):
+        # Uma thread por requisição (ThreadingHTTPServer)
+        with self._lock:
+            self.requests[kind] += 1
+
+    def sleep_latency(self, base_ms):
+        with self._lock:
+            jitter = self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0
+        time.sleep((base_ms + jitter) / 1000)
+
+
+def fake_embedding(text, dim):
+    """Vetor unitário determinístico: o mesmo texto gera sempre o mesmo vetor."""
+    seed = int.from_bytes(hashlib.sha256(str(text).encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def _count_tokens(text):
+    return max(1, len(text or "") // 4)
+
+
+def _tool_arguments(tool, user_text):
+    """Preenche o primeiro parâmetro obrigatório da ferramenta com o texto do usuário."""
+    params = tool.get("function", {}).get("parameters", {})
+    required = params.get("required") or list(params.get("properties", {}))
+    if not required:
+        return {}
+    name = required[0]
+    if "data" in name:
+        return {name: "01/2020"}
+    return {name: user_text}
+
+
+def plan_response(body, script):
+    """Decide o próximo passo do roteiro: (tool_calls, conteúdo)."""
+    messages = body.get("messages", [])
+    last_user = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=-1)
+    user_text = messages[last_user].get("content", "") if last_user >= 0 else ""
+    if isinstance(user_text, list):
+        user_text = " ".join(part.get("text", "") for part in user_text if isinstance(part, dict))
+    # Etapa atual = quantas rodadas de ferramentas já aconteceram desde a última mensagem do usuário
+    step = sum(1 for m in messages[last_user + 1:] if m.get("role") == "assistant" and m.get("tool_calls"))
+    offered = {t.get("function", {}).get("name"): t for t in body.get("tools", [])}
+
+    if step < len(script["steps"]):
+        calls = [
+            {
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": name, "arguments": json.dumps(_tool_arguments(offered[name], user_text),
+                                                                   ensure_ascii=False)},
+            }
+            for name in script["steps"][step] if name in offered
+        ]
+        if calls:
+            return calls, None
+    return None, script["answer"]
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _send_json(self, payload, status=200):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            path = self.path.split("?")[0].rstrip("/")
+            if path.endswith("/chat/completions"):
+                self._chat(self._read_json())
+            elif path.endswith("/embeddings"):
+                self._embeddings(self._read_json())
+            else:
+                self._send_json({"error": {"message": f"rota desconhecida: {self.path}"}}, status=404)
+
+        def _embeddings(self, body):
+            config.count("embeddings")
+            config.sleep_latency(config.embedding_latency_ms)
+            inputs = body.get("input")
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            data = []
+            for i, item in enumerate(inputs or []):
+                vector = fake_embedding(item, body.get("dimensions") or config.dim)
+                if body.get("encoding_format") == "base64":
+                    embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+                else:
+                    embedding = vector.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+            tokens = sum(len(i) if isinstance(i, list) else _count_tokens(i) for i in inputs or [])
+            self._send_json({
+                "object": "list",
+                "data": data,
+                "model": body.get("model", "stub-embedding"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            })
+
+        def _chat(self, body):
+            config.count("chat")
+            config.sleep_latency(config.latency_ms)
+            tool_calls, content = plan_response(body, config.script)
+            prompt_tokens = sum(_count_tokens(json.dumps(m, ensure_ascii=False)) for m in body.get("messages", []))
+            completion_tokens = _count_tokens(content) if content else 10 * len(tool_calls)
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                     "total_tokens": prompt_tokens + completion_tokens}
+            finish_reason = "tool_calls" if tool_calls else "stop"
+            base = {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "created": int(time.time()),
+                    "model": body.get("model", "stub-chat")}
+
+            if not body.get("stream"):
+                message = {"role": "assistant", "content": content}
+                if tool_calls:
+                    message["tool_calls"] = tool_calls
+                self._send_json({**base, "object": "chat.completion", "usage": usage,
+                                 "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}]})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            def send(choices, **extra):
+                chunk = {**base, "object": "chat.completion.chunk", "choices": choices, **extra}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            send([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            if tool_calls:
+                deltas = [{"index": i, **call} for i, call in enumerate(tool_calls)]
+                send([{"index": 0, "delta": {"tool_calls": deltas}, "finish_reason": None}])
+            else:
+                # Palavra a palavra, no ritmo configurado
+                words = content.split(" ")
+                delay = 1 / config.tokens_per_second if config.tokens_per_second else 0
+                for i, word in enumerate(words):
+                    send([{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}])
+                    if delay:
+                        time.sleep(delay)
+            send([{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+            if (body.get("stream_options") or {}).get("include_usage"):
+                send([], usage=usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def start_stub_server(config=None, host="127.0.0.1", port=0):
+    """Sobe o stub numa thread; retorna (servidor, base_url). `port=0` escolhe uma porta livre."""
+    config = config or StubConfig()
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, name="stub-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub local da API da OpenAI para benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20)
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--script", help="Arquivo JSON com o roteiro de ferramentas")
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+    config = StubConfig(args.latency_ms, args.jitter_ms, args.embedding_latency_ms, args.tokens_per_second,
+                        script=script)
+    server, base_url = start_stub_server(config, args.host, args.port)
+    print(f"Stub da OpenAI em {base_url} (OPENAI_BASE_URL={base_url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
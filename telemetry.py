@@ -0,0 +1,508 @@
+"""
+Tracing e métricas, com as bibliotecas padrão como dependências opcionais.
+
+Métricas (prometheus_client): contadores e histogramas com labels, expostos
+no formato texto do Prometheus em /api/metrics. Coletores registrados com
+`register_collector` são lidos na hora da coleta (ex.: taxa de acerto de
+caches). Sem o prometheus_client as métricas viram no-op e /api/metrics
+responde 501.
+
+Tracing (opentelemetry-sdk): um `traceparent` W3C recebido na requisição é
+continuado e o da requisição atual volta no cabeçalho da resposta. Spans
+exportados com TRACING_EXPORTER=file (JSON por linha em TRACING_FILE, pode
+ser lido por um OpenTelemetry Collector com filelog), =log ou =otlp (precisa
+do opentelemetry-exporter-otlp; destino em OTEL_EXPORTER_OTLP_ENDPOINT). O
+padrão "none", ou o SDK ausente, não cria spans (custo zero).
+
+O span atual fica em `current_span` (e não no contexto do OpenTelemetry)
+porque os spans do agente são encadeados pelo run_id do LangChain, com as
+ferramentas em outras threads (TracingCallbackHandler).
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+try:
+    import prometheus_client
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:
+    prometheus_client = None
+
+try:
+    from opentelemetry import context as otel_context, trace as otel_trace
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.trace import Status, StatusCode
+    from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+except ImportError:
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()  # none | log | file | otlp
+TRACING_FILE = os.getenv("TRACING_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "traces.jsonl"))
+METRICS_PREFIX = "portfolio_"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# ===================== Métricas =====================
+
+class _Metric:
+    """Métrica do prometheus_client com labels por nome (as que faltam ficam vazias); no-op sem a biblioteca."""
+
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=(), **kwargs):
+        self.name = METRICS_PREFIX + name
+        self.labelnames = tuple(labelnames)
+        self._metric = None
+        if registry is not None:
+            self._metric = self.kind(self.name, documentation, self.labelnames, registry=registry, **kwargs)
+
+    def _child(self, labels):
+        if not self.labelnames:
+            return self._metric
+        return self._metric.labels(**{label: labels.get(label, "") for label in self.labelnames})
+
+    def _sample(self, name, labels):
+        # Lê só desta métrica: registry.get_sample_value rodaria todos os coletores
+        if self._metric is None:
+            return 0
+        wanted = {label: str(labels.get(label, "")) for label in self.labelnames}
+        for family in self._metric.collect():
+            for sample in family.samples:
+                if sample.name == name and sample.labels == wanted:
+                    return sample.value
+        return 0
+
+
+class Counter(_Metric):
+    kind = prometheus_client.Counter if prometheus_client else None
+
+    def inc(self, amount=1, **labels):
+        if self._metric is not None:
+            self._child(labels).inc(amount)
+
+    def value(self, **labels):
+        return self._sample(self.name if self.name.endswith("_total") else self.name + "_total", labels)
+
+
+class Histogram(_Metric):
+    kind = prometheus_client.Histogram if prometheus_client else None
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames, buckets=buckets)
+
+    def observe(self, value, **labels):
+        if self._metric is not None:
+            self._child(labels).observe(value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        return self._sample(self.name + "_count", labels)
+
+    def sum(self, **labels):
+        return self._sample(self.name + "_sum", labels)
+
+
+class _CallbackCollector:
+    """Amostras dos coletores registrados, lidas na hora da coleta."""
+
+    def __init__(self, collectors):
+        self.collectors = collectors
+
+    def collect(self):
+        families = {}
+        for collect in self.collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                logger.warning(f"Coletor de métricas falhou: {e}")
+                continue
+            for name, kind, documentation, labels, value in samples:
+                name = METRICS_PREFIX + name
+                if name not in families:
+                    family = CounterMetricFamily if kind == "counter" else GaugeMetricFamily
+                    families[name] = family(name, documentation, labels=sorted(labels))
+                families[name].add_metric([str(labels[key]) for key in sorted(labels)], value)
+        return families.values()
+
+
+class Registry:
+    def __init__(self):
+        self._registry = prometheus_client.CollectorRegistry() if prometheus_client else None
+        self._collectors = []
+        if self._registry is not None:
+            self._registry.register(_CallbackCollector(self._collectors))
+
+    def counter(self, *args, **kwargs):
+        return Counter(self._registry, *args, **kwargs)
+
+    def histogram(self, *args, **kwargs):
+        return Histogram(self._registry, *args, **kwargs)
+
+    def register_collector(self, collect):
+        """`collect()` retorna [(nome, tipo, documentação, {labels}, valor), ...] na hora da coleta."""
+        self._collectors.append(collect)
+
+    def expose(self):
+        """Texto no formato do Prometheus; None sem o prometheus_client."""
+        if self._registry is None:
+            return None
+        return prometheus_client.generate_latest(self._registry).decode("utf-8")
+
+
+registry = Registry()
+register_collector = registry.register_collector
+
+HTTP_REQUESTS = registry.counter("http_requests_total", "Requisições HTTP por endpoint e status.", ("endpoint", "method", "status"))
+HTTP_LATENCY = registry.histogram("http_request_duration_seconds", "Latência das requisições HTTP.", ("endpoint",))
+LLM_LATENCY = registry.histogram("llm_request_duration_seconds", "Latência de cada chamada ao LLM.", ("model",))
+LLM_TOKENS = registry.counter("llm_tokens_total", "Tokens consumidos pelo LLM.", ("model", "type"))
+TOOL_LATENCY = registry.histogram("tool_duration_seconds", "Tempo de execução das ferramentas do agente.", ("tool",))
+TOOL_CALLS = registry.counter("tool_calls_total", "Chamadas de ferramentas por status.", ("tool", "status"))
+TOOL_ERRORS = registry.counter("tool_errors_total", "Erros tratados dentro das ferramentas (viram texto para o LLM).", ("tool",))
+GRAPH_STEP_LATENCY = registry.histogram("graph_step_duration_seconds", "Duração de cada passo do grafo LangGraph.", ("node",))
+EMBEDDING_LATENCY = registry.histogram("embedding_request_duration_seconds", "Chamadas de embed_query à API (cache miss).")
+RETRIEVAL_LATENCY = registry.histogram("retrieval_duration_seconds", "Busca vetorial/híbrida no backend.", ("backend", "mode"))
+DB_QUERY_LATENCY = registry.histogram("db_query_duration_seconds", "Duração das queries SQL.", ("operation",))
+ERRORS = registry.counter("errors_total", "Erros por componente.", ("component",))
+PREFETCH_OUTCOMES = registry.counter("prefetch_total", "Resultado da busca especulativa por coleção.", ("collection", "outcome"))
+PREFETCH_SAVED = registry.histogram("prefetch_saved_seconds", "Tempo de busca escondido atrás do primeiro turno do LLM (acertos).", ("collection",))
+ADMISSION_WAIT = registry.histogram("admission_wait_seconds", "Espera na fila de admissão antes de chamar o provedor.", ("client",))
+ADMISSION_REJECTED = registry.counter("admission_rejected_total", "Chamadas recusadas pela admissão (viram 429).", ("client", "reason"))
+PROVIDER_RATE_LIMITED = registry.counter("provider_rate_limited_total", "Respostas 429 do provedor.", ("client",))
+
+
+# ===================== Tracing =====================
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+    def set_status(self, status):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+current_span = ContextVar("current_span", default=None)
+_providers = {}  # (exportador, arquivo) -> (TracerProvider, tracer) ou None
+_providers_lock = threading.Lock()
+
+
+class _LogWriter:
+    """Saída do ConsoleSpanExporter no log da aplicação."""
+
+    def write(self, text):
+        logger.info(f"span {text}")
+
+    def flush(self):
+        pass
+
+
+def _build_tracer(exporter_name, path):
+    if exporter_name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    elif exporter_name == "file":
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        exporter = ConsoleSpanExporter(out=open(path, "a", encoding="utf-8"),
+                                       formatter=lambda span: span.to_json(indent=None) + "\n")
+    else:
+        exporter = ConsoleSpanExporter(out=_LogWriter(), formatter=lambda span: span.to_json(indent=None))
+    provider = TracerProvider()
+    # Exportação numa thread própria: terminar um span não espera disco nem rede
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    return provider, provider.get_tracer(__name__)
+
+
+def _get_tracer():
+    if otel_trace is None or TRACING_EXPORTER not in ("log", "file", "otlp"):
+        return None
+    key = (TRACING_EXPORTER, TRACING_FILE)
+    if key not in _providers:
+        with _providers_lock:
+            if key not in _providers:
+                try:
+                    _providers[key] = _build_tracer(*key)
+                except Exception as e:
+                    logger.warning(f"Tracing desligado: exportador '{TRACING_EXPORTER}' indisponível ({e}).")
+                    _providers[key] = None
+    provider = _providers[key]
+    return provider[1] if provider else None
+
+
+def tracing_enabled():
+    return _get_tracer() is not None
+
+
+def flush_spans():
+    """Exporta os spans pendentes (testes e fim de scripts)."""
+    for provider in list(_providers.values()):
+        if provider:
+            provider[0].force_flush()
+
+
+def _attributes(attributes):
+    return {key: value if isinstance(value, (str, bool, int, float)) else str(value)
+            for key, value in (attributes or {}).items()}
+
+
+def start_span(name, parent=None, attributes=None, traceparent=None):
+    """Cria um span filho de `parent` (ou do span atual); não o torna o span atual."""
+    tracer = _get_tracer()
+    if tracer is None:
+        return NOOP_SPAN
+    parent = parent or current_span.get()
+    if parent is not None and parent is not NOOP_SPAN:
+        context = otel_trace.set_span_in_context(parent)
+    elif traceparent:
+        context = TraceContextTextMapPropagator().extract({"traceparent": traceparent})
+    else:
+        context = otel_context.Context()
+    return tracer.start_span(name, context=context, attributes=_attributes(attributes))
+
+
+def record_error(span, exc):
+    span.record_exception(exc)
+    if span is not NOOP_SPAN:
+        span.set_status(Status(StatusCode.ERROR, str(exc)[:500]))
+
+
+def traceparent(span):
+    """Cabeçalho W3C traceparent do span, ou None sem tracing."""
+    if span is NOOP_SPAN:
+        return None
+    carrier = {}
+    TraceContextTextMapPropagator().inject(carrier, context=otel_trace.set_span_in_context(span))
+    return carrier.get("traceparent")
+
+
+@contextmanager
+def span(name, **attributes):
+    """Span como contexto atual (os spans criados dentro dele viram filhos)."""
+    current = start_span(name, attributes=attributes)
+    token = current_span.set(current) if current is not NOOP_SPAN else None
+    try:
+        yield current
+    except Exception as e:
+        record_error(current, e)
+        raise
+    finally:
+        if token is not None:
+            current_span.reset(token)
+        current.end()
+
+
+# ===================== Integrações =====================
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Spans e métricas para chamadas ao LLM, ferramentas e passos do grafo.
+    Os spans são encadeados pelo run_id do LangChain, então a árvore fica correta
+    mesmo com ferramentas executando em outras threads.
+    """
+
+    # Barato e thread-safe: em execuções async roda no próprio event loop, sem ir para o executor
+    run_inline = True
+
+    def __init__(self, root=None):
+        self.root = root
+        self._runs = {}  # run_id -> (span, início, tipo, label)
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, parent_run_id, name, kind, label, attributes=None):
+        with self._lock:
+            parent = self._runs.get(parent_run_id)
+        span_parent = parent[0] if parent else (self.root or current_span.get())
+        new_span = start_span(name, parent=span_parent if span_parent is not NOOP_SPAN else None,
+                              attributes=attributes)
+        with self._lock:
+            self._runs[run_id] = (new_span, time.perf_counter(), kind, label)
+
+    def _finish(self, run_id, error=None):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        run_span, start, kind, label = run
+        elapsed = time.perf_counter() - start
+        if error is not None:
+            record_error(run_span, error)
+        run_span.end()
+        if kind == "llm":
+            LLM_LATENCY.observe(elapsed, model=label)
+        elif kind == "tool":
+            TOOL_LATENCY.observe(elapsed, tool=label)
+            TOOL_CALLS.inc(tool=label, status="error" if error is not None else "ok")
+        elif kind == "step":
+            GRAPH_STEP_LATENCY.observe(elapsed, node=label)
+        if error is not None:
+            ERRORS.inc(component=kind)
+        return run_span, label
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or (serialized or {}).get("name", "llm")
+        self._start(run_id, parent_run_id, "llm.chat", "llm", model, {"llm.model": model})
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or (serialized or {}).get("name", "llm")
+        self._start(run_id, parent_run_id, "llm.completion", "llm", model, {"llm.model": model})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        finished = self._finish(run_id)
+        if finished is None:
+            return
+        run_span, model = finished
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                for kind in ("input_tokens", "output_tokens"):
+                    if usage.get(kind):
+                        LLM_TOKENS.inc(usage[kind], model=model, type=kind.split("_")[0])
+                        run_span.set_attribute(f"llm.usage.{kind}", usage[kind])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._start(run_id, parent_run_id, f"tool {name}", "tool", name, {"tool.name": name})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        # Só os passos do grafo (nós do LangGraph) viram spans; as cadeias internas, não
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self._start(run_id, parent_run_id, f"graph.step {node}", "step", node, {"graph.node": node})
+        else:
+            with self._lock:
+                parent = self._runs.get(parent_run_id)
+            if parent:
+                # Cadeia intermediária: filhos dela penduram no span do passo
+                with self._lock:
+                    self._runs[run_id] = (parent[0], time.perf_counter(), "passthrough", None)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+        if run and run[2] == "passthrough":
+            with self._lock:
+                self._runs.pop(run_id, None)
+            return
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+        if run and run[2] == "passthrough":
+            with self._lock:
+                self._runs.pop(run_id, None)
+            return
+        self._finish(run_id, error)
+
+
+_instrumented_engines = set()
+
+
+def instrument_engine(engine):
+    """Histograma (e spans) de cada query SQL executada pelo engine."""
+    from sqlalchemy import event
+
+    if id(engine) in _instrumented_engines:
+        return
+    _instrumented_engines.add(id(engine))
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(
+            (time.perf_counter(), start_span("db.query", attributes={"db.statement": statement[:300]}))
+        )
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("query_start")
+        if not stack:
+            return
+        start, query_span = stack.pop()
+        query_span.end()
+        DB_QUERY_LATENCY.observe(time.perf_counter() - start, operation=statement.lstrip().split(" ", 1)[0].upper())
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        stack = context.connection.info.get("query_start") if context.connection is not None else None
+        if stack:
+            _, query_span = stack.pop()
+            record_error(query_span, context.original_exception)
+            query_span.end()
+        ERRORS.inc(component="db")
+
+
+def init_app(app):
+    """Span raiz e métricas HTTP por requisição; propaga o traceparent."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request():
+        g._telemetry_start = time.perf_counter()
+        root = start_span(f"{request.method} {request.path}", traceparent=request.headers.get("traceparent"),
+                          attributes={"http.method": request.method, "http.route": request.path})
+        g._telemetry_span = root
+        g._telemetry_token = current_span.set(root) if root is not NOOP_SPAN else None
+
+    @app.after_request
+    def _finish_request(response):
+        start = g.pop("_telemetry_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "unknown"
+            if response.is_streamed:
+                # SSE: a resposta só termina quando o stream fecha, não ao sair da view
+                response.call_on_close(lambda: HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint))
+            else:
+                HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+            HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+            if response.status_code >= 500:
+                ERRORS.inc(component="http")
+        root = g.get("_telemetry_span")
+        if root is not None and root is not NOOP_SPAN:
+            root.set_attribute("http.status_code", response.status_code)
+            response.headers["traceparent"] = traceparent(root)
+        return response
+
+    @app.teardown_request
+    def _end_request(exc=None):
+        root = g.pop("_telemetry_span", None)
+        token = g.pop("_telemetry_token", None)
+        if root is not None:
+            if exc is not None:
+                record_error(root, exc)
+            root.end()
+        if token is not None:
+            try:
+                current_span.reset(token)
+            except ValueError:
+                # Streaming: o teardown pode rodar em outro contexto
+                pass
@@ -0,0 +1,159 @@
+import time
+import asyncio
+import threading
+
+import httpx
+import openai
+import pytest
+
+from admission import AdmissionLimiter, Overloaded, _duration, current_session
+
+
+def _ocupar(limitador):
+    """Ocupa uma vaga numa thread até `liberar.set()`."""
+    dentro, liberar = threading.Event(), threading.Event()
+
+    def executar():
+        with limitador.slot():
+            dentro.set()
+            liberar.wait(5)
+
+    thread = threading.Thread(target=executar)
+    thread.start()
+    assert dentro.wait(5)
+    return liberar, thread
+
+
+def _esperar(condicao):
+    limite = time.monotonic() + 5
+    while not condicao():
+        assert time.monotonic() < limite
+        time.sleep(0.005)
+
+
+def test_limite_de_concorrencia_e_fila_cheia():
+    limitador = AdmissionLimiter("teste", max_concurrency=1, queue_size=1, wait_timeout=5)
+    liberar, ocupante = _ocupar(limitador)
+
+    concluidas = []
+
+    def chamar():
+        with limitador.slot():
+            concluidas.append(True)
+
+    na_fila = threading.Thread(target=chamar)
+    na_fila.start()
+    _esperar(lambda: limitador.queued == 1)
+
+    # Fila cheia: falha rápida, com Retry-After
+    with pytest.raises(Overloaded) as erro:
+        with limitador.slot():
+            pass
+    assert erro.value.reason == "queue_full"
+    assert erro.value.retry_after >= 1
+
+    liberar.set()
+    ocupante.join()
+    na_fila.join()
+    assert concluidas == [True]
+    assert limitador.active == 0 and limitador.queued == 0
+
+
+def test_espera_estourada_sai_da_fila():
+    limitador = AdmissionLimiter("teste", max_concurrency=1, queue_size=5, wait_timeout=0.05)
+    liberar, ocupante = _ocupar(limitador)
+
+    with pytest.raises(Overloaded) as erro:
+        with limitador.slot():
+            pass
+    assert erro.value.reason == "timeout"
+    assert limitador.queued == 0
+
+    liberar.set()
+    ocupante.join()
+    assert limitador.active == 0
+
+
+def test_rodizio_entre_sessoes():
+    """Uma sessão com várias chamadas na fila não passa na frente das outras."""
+    limitador = AdmissionLimiter("teste", max_concurrency=1, queue_size=10, wait_timeout=5)
+    liberar, ocupante = _ocupar(limitador)
+    ordem = []
+
+    def chamar(sessao, rotulo):
+        current_session.set(sessao)
+        with limitador.slot():
+            ordem.append(rotulo)
+
+    threads = []
+    for sessao, rotulo in (("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")):
+        thread = threading.Thread(target=chamar, args=(sessao, rotulo))
+        thread.start()
+        threads.append(thread)
+        _esperar(lambda: limitador.queued == len(threads))
+
+    liberar.set()
+    for thread in [ocupante, *threads]:
+        thread.join()
+    assert ordem == ["a1", "b1", "a2", "a3"]
+
+
+def test_limite_adaptativo_pelos_sinais_do_provedor():
+    limitador = AdmissionLimiter("teste", max_concurrency=8, queue_size=4)
+
+    limitador.observe_headers({"x-ratelimit-remaining-requests": "5", "x-ratelimit-limit-requests": "100"})
+    assert limitador.limit == 7
+    limitador.observe_headers({"x-ratelimit-remaining-tokens": "90000", "x-ratelimit-limit-tokens": "100000"})
+    assert limitador.limit == 7
+
+    limitador.on_rate_limited({"retry-after": "2"})
+    assert limitador.limit == 3
+    with pytest.raises(Overloaded) as erro:
+        limitador.check()
+    assert erro.value.reason == "rate_limited"
+    assert erro.value.retry_after == 2
+
+    # Passada a pausa, cada `limit` sucessos seguidos devolvem uma vaga
+    limitador._paused_until = 0.0
+    for _ in range(3):
+        with limitador.slot():
+            pass
+    assert limitador.limit == 4
+
+
+def test_429_do_provedor_vira_overloaded():
+    limitador = AdmissionLimiter("teste", max_concurrency=4, queue_size=4)
+    resposta = httpx.Response(429, headers={"retry-after": "3"},
+                              request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+    with pytest.raises(Overloaded) as erro:
+        with limitador.slot():
+            raise openai.RateLimitError("limite", response=resposta, body=None)
+    assert erro.value.retry_after == 3
+    assert limitador.limit == 2
+    assert limitador.active == 0
+
+
+def test_duracoes_dos_cabecalhos():
+    assert _duration("20") == 20
+    assert _duration("6m0s") == 360
+    assert _duration("250ms") == 0.25
+    assert _duration(None) is None
+
+
+def test_versao_assincrona_espera_a_vaga():
+    limitador = AdmissionLimiter("teste", max_concurrency=1, queue_size=4, wait_timeout=5)
+    ordem = []
+
+    async def chamar(rotulo, duracao):
+        async with limitador.aslot():
+            ordem.append(f"{rotulo} entrou")
+            await asyncio.sleep(duracao)
+            ordem.append(f"{rotulo} saiu")
+
+    async def executar():
+        await asyncio.gather(chamar("primeira", 0.05), chamar("segunda", 0))
+
+    asyncio.run(executar())
+    assert ordem == ["primeira entrou", "primeira saiu", "segunda entrou", "segunda saiu"]
+    assert limitador.active == 0 and limitador.queued == 0
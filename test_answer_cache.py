@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from answer_cache import AnswerCache, detect_language, used_tools
+
+def test_detecta_idioma():
+    assert detect_language("Qual é a sua experiência com Python?") == "pt"
+    assert detect_language("What is your experience with Python?") == "en"
+
+def test_elegibilidade_apenas_primeiro_turno():
+    cache = AnswerCache(embeddings=None, enabled=True)
+    assert cache.is_eligible("Fale sobre seu TCC", is_first_turn=True)
+    assert not cache.is_eligible("E o segundo capítulo?", is_first_turn=False)
+    assert not cache.is_eligible("x" * 1000, is_first_turn=True)
+    assert not AnswerCache(embeddings=None, enabled=False).is_eligible("Oi", is_first_turn=True)
+
+def test_entrada_vale_so_no_dia_do_prompt():
+    """O prompt traz a data de hoje: respostas de ontem não são reaproveitadas, mesmo dentro do TTL."""
+    cache = AnswerCache(embeddings=None, enabled=True, ttl=24 * 3600)
+    assert cache.valid_since(datetime(2026, 3, 10, 0, 30)) == datetime(2026, 3, 10)
+    assert cache.valid_since(datetime(2026, 3, 10, 18, 0)) == datetime(2026, 3, 10)
+    curto = AnswerCache(embeddings=None, enabled=True, ttl=3600)
+    assert curto.valid_since(datetime(2026, 3, 10, 18, 0)) == datetime(2026, 3, 10, 17, 0)
+
+def test_ferramentas_nao_deterministicas_nao_sao_cacheadas():
+    mensagens = [
+        HumanMessage(content="Quanto custa um app?"),
+        AIMessage(content="", tool_calls=[{"id": "1", "name": "calcular_orcamento_software", "args": {"query": "app"}}]),
+        AIMessage(content="R$ 10.000"),
+    ]
+    assert used_tools(mensagens) == {"calcular_orcamento_software"}
+
+    cache = AnswerCache(embeddings=None, enabled=True)
+    cache.store("Quanto custa um app?", "R$ 10.000", mensagens)  # não toca no banco
+    assert cache.counters["stored"] == 0
@@ -0,0 +1,136 @@
+import os
+import json
+import asyncio
+from unittest.mock import patch, MagicMock, AsyncMock
+
+import pytest
+
+from asgi import app
+from database import init_db
+
+
+@pytest.fixture(autouse=True)
+def banco(monkeypatch):
+    from blueprints.chat import answer_cache
+    monkeypatch.setattr(answer_cache, 'enabled', False)
+    monkeypatch.setattr('prefetch.PREFETCH_ENABLED', False)
+    os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+    init_db()
+
+
+def _requisicao(method, path, body=None, headers=(), query=b""):
+    """Executa uma requisição no app ASGI; retorna (status, headers, corpo)."""
+    corpo = json.dumps(body).encode("utf-8") if body is not None else b""
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": query,
+        "headers": [(b"content-type", b"application/json")] +
+                   [(k.lower().encode(), v.encode()) for k, v in headers],
+        "server": ("testserver", 80), "client": ("127.0.0.1", 1234), "scheme": "http", "http_version": "1.1",
+    }
+    enviadas = []
+
+    async def executar():
+        mensagens = [{"type": "http.request", "body": corpo, "more_body": False}]
+
+        async def receive():
+            if mensagens:
+                return mensagens.pop(0)
+            await asyncio.Future()  # Cliente continua conectado
+
+        async def send(message):
+            enviadas.append(message)
+
+        await app(scope, receive, send)
+
+    asyncio.run(executar())
+    inicio = enviadas[0]
+    cabecalhos = {k.decode(): v.decode() for k, v in inicio["headers"]}
+    return inicio["status"], cabecalhos, b"".join(m.get("body", b"") for m in enviadas[1:])
+
+
+def test_chat_sem_mensagem():
+    status, _, corpo = _requisicao("POST", "/api/chat", {"session_id": "123"})
+    assert status == 400
+    assert 'error' in json.loads(corpo)
+
+
+@patch('blueprints.chat_async.get_agent')
+def test_chat_usa_ainvoke(mock_get_agent):
+    """O modo ASGI executa o grafo com ainvoke, sem bloquear o event loop."""
+    from langchain_core.messages import AIMessage
+    mock_get_agent.return_value.ainvoke = AsyncMock(
+        return_value={"messages": [AIMessage(content="Olá! Sou Gustavo.")]})
+
+    status, headers, corpo = _requisicao("POST", "/api/chat", {"message": "Oi"},
+                                         headers=[("Origin", "http://localhost:3000")])
+
+    assert status == 200
+    data = json.loads(corpo)
+    assert data['response'] == "Olá! Sou Gustavo."
+    assert data['session_id']
+    assert headers['access-control-allow-origin'] == "http://localhost:3000"
+    mock_get_agent.return_value.ainvoke.assert_awaited_once()
+
+
+@patch('blueprints.chat_async.get_agent')
+def test_chat_stream_async(mock_get_agent):
+    from langchain_core.messages import AIMessage, AIMessageChunk
+
+    async def eventos(*args, **kwargs):
+        yield ("messages", (AIMessageChunk(content="Meu TCC"), {"langgraph_node": "chatbot"}))
+        yield ("messages", (AIMessageChunk(content=" trata de IA."), {"langgraph_node": "chatbot"}))
+        yield ("updates", {"chatbot": {"messages": [AIMessage(content="Meu TCC trata de IA.")]}})
+
+    mock_get_agent.return_value.astream = MagicMock(side_effect=eventos)
+
+    status, headers, corpo = _requisicao("POST", "/api/chat/stream", {"message": "Qual o tema do seu TCC?"})
+
+    assert status == 200
+    assert headers['content-type'].startswith('text/event-stream')
+    corpo = corpo.decode("utf-8")
+    assert corpo.count('event: token') == 2
+    assert 'event: done' in corpo
+    assert 'Meu TCC trata de IA.' in corpo
+
+
+def test_historico_async_com_etag():
+    from blueprints.chat import chat_store
+    from database import SessionLocal
+    db = SessionLocal()
+    chat_store.ensure_session(db, "sessao_asgi")
+    for i in range(3):
+        chat_store.add_message(db, "sessao_asgi", "user", f"mensagem {i}")
+    db.close()
+
+    status, headers, corpo = _requisicao("GET", "/api/chat/history", query=b"session_id=sessao_asgi&limit=2")
+    assert status == 200
+    assert [m['content'] for m in json.loads(corpo)['history']] == ['mensagem 1', 'mensagem 2']
+
+    status, _, corpo = _requisicao("GET", "/api/chat/history", query=b"session_id=sessao_asgi&limit=2",
+                                   headers=[("If-None-Match", headers['etag'])])
+    assert status == 304
+    assert corpo == b""
+
+
+def test_stream_sobrecarregado_responde_429(monkeypatch):
+    from admission import Overloaded, llm_limiter
+    def recusar():
+        raise Overloaded("llm", "rate_limited", 3)
+    monkeypatch.setattr(llm_limiter, 'check', recusar)
+
+    status, headers, corpo = _requisicao("POST", "/api/chat/stream", {"message": "Oi"})
+    assert status == 429
+    assert headers['retry-after'] == '3'
+
+
+def test_demais_rotas_pela_ponte_wsgi():
+    """Rotas sem versão assíncrona continuam servidas pelo Flask."""
+    status, _, corpo = _requisicao("GET", "/api/health")
+    assert status == 200
+    assert json.loads(corpo)
+
+
+def test_corpo_acima_do_limite_responde_413():
+    from asgi import ASGI_MAX_BODY_BYTES
+    status, _, _ = _requisicao("POST", "/api/chat", {"message": "x" * ASGI_MAX_BODY_BYTES})
+    assert status == 413
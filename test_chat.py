@@ -6,8 +6,13 @@ from app import app
 from database import init_db, get_db
 
 @pytest.fixture
-def client():
+def client(monkeypatch):
     app.config['TESTING'] = True
+    # Cache semântico desligado por padrão nos testes (evita chamadas de embeddings)
+    from blueprints.chat import answer_cache
+    monkeypatch.setattr(answer_cache, 'enabled', False)
+    # Busca especulativa desligada: o agente é mockado, nenhuma ferramenta seria chamada
+    monkeypatch.setattr('prefetch.PREFETCH_ENABLED', False)
     # Usar um banco de dados em memória ou arquivo temporário para testes
     os.environ['DATABASE_URL'] = 'sqlite:///:memory:' 
     
@@ -24,6 +29,17 @@ def test_chat_history_empty(client):
     assert 'history' in data
     assert data['history'] == []
 
+def test_health_e_readiness(client):
+    """Liveness sempre responde; readiness indica índice vazio com 503."""
+    assert client.get('/api/health').status_code == 200
+    
+    response = client.get('/api/ready')
+    data = json.loads(response.data)
+    assert response.status_code == 503
+    assert data['database'] == 'ok'
+    assert data['ready'] is False
+    assert data['index']['total_chunks'] == 0
+
 def test_chat_missing_message(client):
     """Testa o comportamento da API quando a mensagem não é enviada."""
     response = client.post('/api/chat', json={"session_id": "123"})
@@ -31,13 +47,13 @@ def test_chat_missing_message(client):
     data = json.loads(response.data)
     assert 'error' in data
 
-@patch('langgraph.graph.StateGraph.compile')
-def test_chat_flow_without_tools(mock_compile, client):
+@patch('blueprints.chat.get_agent')
+def test_chat_flow_without_tools(mock_get_agent, client):
     """Testa fluxo de chat simples onde o LLM não precisa chamar nenhuma ferramenta."""
     
-    # Mock do retorno do compile()
+    # Mock do agente pré-compilado
     mock_app = MagicMock()
-    mock_compile.return_value = mock_app
+    mock_get_agent.return_value = mock_app
     
     # Mock do retorno do app.invoke()
     from langchain_core.messages import AIMessage
@@ -51,6 +67,65 @@ def test_chat_flow_without_tools(mock_compile, client):
     assert "Gustavo" in data['response']
     assert 'session_id' in data
 
+    # O prompt do sistema recebe data e dia da semana a cada chamada
+    state = mock_app.invoke.call_args[0][0]
+    assert 'data_extenso' in state and 'dia_semana' in state
+
+@patch('blueprints.chat.get_agent')
+def test_chat_restaura_contexto_da_busca_especulativa(mock_get_agent, client):
+    """A busca adiantada e a reserva de ferramentas não vazam para a próxima requisição da thread."""
+    from langchain_core.messages import AIMessage
+    from prefetch import current_prefetch
+    from context_budget import current_tool_budget
+    mock_get_agent.return_value.invoke.return_value = {"messages": [AIMessage(content="ok")]}
+
+    anterior = object()
+    token = current_prefetch.set(anterior)
+    try:
+        assert client.post('/api/chat', json={"message": "Oi"}).status_code == 200
+        assert current_prefetch.get() is anterior
+        assert current_tool_budget.get() is None
+    finally:
+        current_prefetch.reset(token)
+
+@patch('blueprints.chat.get_agent')
+def test_chat_stream_eventos(mock_get_agent, client):
+    """Testa o endpoint SSE: tokens, eventos de ferramenta e resposta final."""
+    from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+    
+    chamada = {"id": "call_1", "name": "consultar_tcc", "args": {"query": "tema"}}
+    mock_get_agent.return_value.stream.return_value = iter([
+        ("updates", {"chatbot": {"messages": [AIMessage(content="", tool_calls=[chamada])]}}),
+        ("updates", {"tools": {"messages": [ToolMessage(content="trecho", tool_call_id="call_1", name="consultar_tcc")]}}),
+        ("messages", (AIMessageChunk(content="Meu TCC"), {"langgraph_node": "chatbot"})),
+        ("messages", (AIMessageChunk(content=" trata de IA."), {"langgraph_node": "chatbot"})),
+        ("updates", {"chatbot": {"messages": [AIMessage(content="Meu TCC trata de IA.")]}}),
+    ])
+    
+    response = client.post('/api/chat/stream', json={"message": "Qual o tema do seu TCC?"})
+    
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    corpo = response.get_data(as_text=True)
+    assert 'event: tool_start' in corpo
+    assert 'event: tool_end' in corpo
+    assert corpo.count('event: token') == 2
+    assert 'event: done' in corpo
+    assert 'Meu TCC trata de IA.' in corpo
+
+@patch('blueprints.chat.get_agent')
+def test_chat_cache_semantico_pula_o_grafo(mock_get_agent, client, monkeypatch):
+    """Pergunta de primeiro turno já respondida: resposta do cache, sem executar o agente."""
+    from blueprints.chat import answer_cache
+    monkeypatch.setattr(answer_cache, 'enabled', True)
+    monkeypatch.setattr(answer_cache, 'lookup', MagicMock(return_value="Resposta em cache."))
+    
+    response = client.post('/api/chat', json={"message": "Fale sobre seu TCC"})
+    
+    assert response.status_code == 200
+    assert json.loads(response.data)['response'] == "Resposta em cache."
+    mock_get_agent.assert_not_called()
+
 def test_chat_tempo_experiencia_tool(client):
     """Testa a nova ferramenta de tempo de experiência isoladamente."""
     from blueprints.chat import obter_tempo_experiencia
@@ -63,3 +138,68 @@ def test_chat_tempo_experiencia_tool(client):
     resultado_mes = obter_tempo_experiencia.invoke("01/2021")
     assert "ano" in resultado_mes or "mês" in resultado_mes
 
+def test_agent_compilado_uma_vez():
+    """O agente deve ser construído uma única vez e reutilizado."""
+    from agent import AgentHolder
+    
+    factory = MagicMock(side_effect=lambda: object())
+    holder = AgentHolder(factory)
+    
+    primeiro = holder.get()
+    assert holder.get() is primeiro
+    assert factory.call_count == 1
+
+def test_historico_paginado_com_etag(client):
+    """Cursor `before` pagina para trás e If-None-Match sem mudanças devolve 304."""
+    from blueprints.chat import chat_store
+    from database import SessionLocal
+    db = SessionLocal()
+    chat_store.ensure_session(db, "sessao_paginada")
+    for i in range(5):
+        chat_store.add_message(db, "sessao_paginada", "user", f"mensagem {i}")
+    db.close()
+
+    response = client.get('/api/chat/history?session_id=sessao_paginada&limit=2')
+    data = json.loads(response.data)
+    assert [m['content'] for m in data['history']] == ['mensagem 3', 'mensagem 4']
+    assert data['has_more'] is True
+
+    anterior = client.get(f"/api/chat/history?session_id=sessao_paginada&limit=2&before={data['next_cursor']}")
+    assert [m['content'] for m in json.loads(anterior.data)['history']] == ['mensagem 1', 'mensagem 2']
+
+    etag = response.headers['ETag']
+    repetida = client.get('/api/chat/history?session_id=sessao_paginada&limit=2', headers={'If-None-Match': etag})
+    assert repetida.status_code == 304
+
+    assert client.get('/api/chat/history?session_id=sessao_paginada&before=ontem').status_code == 400
+
+def test_chat_sobrecarregado_responde_429(client, monkeypatch):
+    """Sem capacidade no LLM: falha rápida com 429 e Retry-After, sem salvar a mensagem."""
+    from admission import Overloaded, llm_limiter
+    def recusar():
+        raise Overloaded("llm", "queue_full", 7)
+    monkeypatch.setattr(llm_limiter, 'check', recusar)
+
+    response = client.post('/api/chat', json={"message": "Oi", "session_id": "sessao_cheia"})
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '7'
+    assert json.loads(response.data)['retry_after'] == 7
+    assert json.loads(client.get('/api/chat/history?session_id=sessao_cheia').data)['history'] == []
+
+def test_clientes_openai_sem_retentativas_do_sdk():
+    """Cada 429 do provedor chega ao controle de admissão, sem retentativa escondida no SDK."""
+    from blueprints.chat import llm, base_embeddings, OPENAI_MAX_RETRIES
+    assert llm.max_retries == base_embeddings.max_retries == OPENAI_MAX_RETRIES == 0
+
+def test_metricas_prometheus(client):
+    """/api/metrics expõe latência HTTP, caches e pool no formato texto do Prometheus."""
+    pytest.importorskip("prometheus_client")
+    client.get('/api/health')
+    response = client.get('/api/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    texto = response.data.decode('utf-8')
+    assert 'portfolio_http_request_duration_seconds_count{endpoint="health.health"}' in texto
+    assert 'portfolio_cache_hit_ratio{cache="answer"}' in texto
+    assert 'portfolio_db_pool_checkouts_total' in texto
@@ -0,0 +1,189 @@
+from contextlib import contextmanager
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import chat_store
+from chat_store import ChatStore, SessionCache, StoredMessage, _InvalidationListener
+from database import Base, ChatSession, ChatMessage
+
+@pytest.fixture
+def Sessao():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+def _store(Sessao, **kwargs):
+    @contextmanager
+    def session_scope_teste():
+        db = Sessao()
+        try:
+            yield db
+        finally:
+            db.close()
+    return ChatStore(write_behind=True, flush_interval=0.01, session_factory=session_scope_teste, **kwargs)
+
+def test_leitura_apos_escrita_antes_do_flush(Sessao):
+    """Mensagens ainda na fila aparecem no histórico da sessão."""
+    store = _store(Sessao)
+    db = Sessao()
+    with patch.object(store, "_start_writer"):
+        store.ensure_session(db, "s1")
+        store.add_message(db, "s1", "user", "oi")
+        store.add_message(db, "s1", "assistant", "olá!")
+
+    assert db.query(ChatMessage).count() == 0
+    assert [m.content for m in store.recent_messages(db, "s1")] == ["oi", "olá!"]
+    assert [m.content for m in store.recent_messages(db, "s1", limit=1)] == ["olá!"]
+
+def test_flush_em_lote_e_drenagem_no_stop(Sessao):
+    store = _store(Sessao)
+    db = Sessao()
+    store.ensure_session(db, "s1")
+    for i in range(5):
+        store.add_message(db, "s1", "user", f"m{i}")
+    store.stop(timeout=5)
+
+    assert db.query(ChatSession).count() == 1
+    assert [m.content for m in db.query(ChatMessage).order_by(ChatMessage.timestamp)] == [f"m{i}" for i in range(5)]
+    assert store.stats()["queued"] == 0
+    # Nada duplicado entre banco e fila
+    assert len(store.recent_messages(db, "s1")) == 5
+
+def test_item_recusado_nao_trava_a_fila(Sessao):
+    """Um item que o banco sempre recusa é isolado e descartado; os outros do lote e da fila são gravados."""
+    with Sessao.kw["bind"].begin() as conn:
+        conn.exec_driver_sql("CREATE TRIGGER recusa BEFORE INSERT ON chat_messages WHEN NEW.content = 'ruim' "
+                             "BEGIN SELECT RAISE(ABORT, 'conteúdo inválido'); END")
+    store = _store(Sessao, flush_attempts=2)
+    db = Sessao()
+    with patch.object(store, "_start_writer"):
+        store.ensure_session(db, "s1")
+        for conteudo in ("m0", "m1", "ruim", "m2", "m3"):
+            store.add_message(db, "s1", "user", conteudo)
+    store._start_writer()
+    store.add_message(db, "s1", "user", "m4")  # Depois do lote com problema
+    store.stop(timeout=5)
+
+    assert [m.content for m in db.query(ChatMessage).order_by(ChatMessage.id)] == ["m0", "m1", "m2", "m3", "m4"]
+    assert store.counters["dropped"] == 1
+    assert store.stats()["queued"] == 0
+    assert [m.content for m in store.recent_messages(db, "s1")] == ["m0", "m1", "m2", "m3", "m4"]
+
+def test_fila_cheia_grava_sincrono(Sessao):
+    store = _store(Sessao, queue_max=1)
+    db = Sessao()
+    with patch.object(store, "_start_writer"):
+        store.ensure_session(db, "s1")  # ocupa a fila
+        store.add_message(db, "s1", "user", "oi")
+
+    assert store.counters["sync_fallbacks"] == 1
+    assert db.query(ChatMessage).one().content == "oi"
+    assert len(store.recent_messages(db, "s1")) == 1
+
+def _contar_selects(Sessao):
+    """Lista que recebe cada SELECT executado no engine da fixture."""
+    selects = []
+    event.listen(Sessao.kw["bind"], "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: selects.append(statement)
+                 if statement.lstrip().upper().startswith("SELECT") else None)
+    return selects
+
+def test_sessao_ativa_monta_o_contexto_sem_ler_o_banco(Sessao):
+    store = ChatStore(write_behind=False)
+    db = Sessao()
+    store.ensure_session(db, "s1")
+    store.add_message(db, "s1", "user", "oi")
+    store.add_message(db, "s1", "assistant", "olá!")
+
+    selects = _contar_selects(Sessao)
+    store.ensure_session(db, "s1")
+    store.add_message(db, "s1", "user", "tudo bem?")
+    assert [m.content for m in store.recent_messages(db, "s1", limit=30)] == ["oi", "olá!", "tudo bem?"]
+    versao = store.version(db, "s1")
+    assert selects == []
+    assert versao.startswith("3:")
+    assert store.cache.stats()["hits"] >= 3
+
+def test_sessao_existente_e_carregada_uma_vez(Sessao):
+    antigo = ChatStore(write_behind=False, cache_size=0)
+    db = Sessao()
+    antigo.ensure_session(db, "s1")
+    for i in range(5):
+        antigo.add_message(db, "s1", "user", f"m{i}")
+
+    store = ChatStore(write_behind=False, cache_window=3)
+    selects = _contar_selects(Sessao)
+    assert [m.content for m in store.recent_messages(db, "s1", limit=2)] == ["m3", "m4"]
+    assert len(selects) == 1
+    assert [m.content for m in store.recent_messages(db, "s1", limit=3)] == ["m2", "m3", "m4"]
+    assert len(selects) == 1
+    # A janela (3 mensagens) não cobre o histórico inteiro: o resto vem do banco
+    assert [m.content for m in store.recent_messages(db, "s1")] == [f"m{i}" for i in range(5)]
+    assert len(selects) == 2
+    # Versão igual com e sem cache
+    assert store.version(db, "s1") == antigo.version(db, "s1")
+
+def test_cursor_nao_pula_mensagens_com_o_mesmo_timestamp(Sessao):
+    """Páginas de 1 mensagem com o cursor (timestamp, id): nenhuma se perde no empate de timestamp."""
+    db = Sessao()
+    db.add(ChatSession(id="s1"))
+    instante = datetime(2024, 5, 1, 12, 0)
+    db.add_all([ChatMessage(session_id="s1", role="user", content="m0", timestamp=datetime(2024, 5, 1, 11, 0)),
+                ChatMessage(session_id="s1", role="user", content="m1", timestamp=instante),
+                ChatMessage(session_id="s1", role="assistant", content="m2", timestamp=instante)])
+    db.commit()
+
+    # Janela do cache cobrindo a sessão e leitura sempre no banco
+    for store in (ChatStore(write_behind=False, cache_window=10), ChatStore(write_behind=False, cache_size=0)):
+        vistas, before = [], None
+        while True:
+            pagina = store.recent_messages(db, "s1", limit=1, before=before)
+            if not pagina:
+                break
+            vistas.insert(0, pagina[0].content)
+            before = (pagina[0].timestamp, pagina[0].id)
+        assert vistas == ["m0", "m1", "m2"]
+
+def test_escrita_durante_a_carga_descarta_a_janela():
+    cache = SessionCache(max_sessions=10, window=10, ttl=60)
+    entrada = cache.begin_load("s1")
+    cache.append(StoredMessage("s1", "user", "nova", datetime.now()))
+    cache.finish_load("s1", entrada, [], complete=True)
+    assert cache.get("s1") is None
+
+    entrada = cache.begin_load("s1")
+    cache.invalidate("s1")
+    cache.finish_load("s1", entrada, [], complete=True)
+    assert cache.get("s1") is None
+
+def test_lru_e_ttl():
+    agora = [0.0]
+    cache = SessionCache(max_sessions=2, window=10, ttl=60, clock=lambda: agora[0])
+    for sessao in ("a", "b"):
+        cache.create(sessao)
+    cache.get("a")
+    cache.create("c")  # "b" é a menos usada
+    assert cache.get("b") is None and cache.get("a") and cache.get("c")
+    agora[0] = 61
+    assert cache.get("a") is None
+
+def test_notificacao_de_outro_processo_invalida_a_sessao():
+    cache = SessionCache(max_sessions=10, window=10, ttl=60)
+    cache.create("s1")
+    ouvinte = _InvalidationListener.__new__(_InvalidationListener)
+    ouvinte.caches = [cache]
+
+    ouvinte.handle(f"{chat_store._origin()}|s1")  # NOTIFY deste próprio processo
+    assert cache.get("s1") is not None
+    ouvinte.handle("outra-maquina:123|s1")
+    assert cache.get("s1") is None
+    assert cache.stats()["invalidations"] == 1
+
+def test_sem_invalidacao_com_varios_processos_desliga_o_cache():
+    assert ChatStore(write_behind=False, invalidation="none", workers=2).cache is None
+    assert ChatStore(write_behind=False, invalidation="none", workers=1).cache is not None
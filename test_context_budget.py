@@ -0,0 +1,161 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+import context_budget
+from context_budget import ContextBuilder, ToolBudget, TOOL_BUDGET_EXHAUSTED, pack_chunks, usage_report
+from chat_store import StoredMessage
+from database import Base, SessionSummary
+
+@pytest.fixture(autouse=True)
+def sem_tiktoken(monkeypatch):
+    """Estimativa por caracteres (4 por token), sem baixar o encoding nos testes."""
+    monkeypatch.setattr(context_budget, "_get_encoding", lambda: None)
+
+@pytest.fixture
+def Sessao():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+def _historico(n, tamanho=400):
+    inicio = datetime(2026, 1, 1)
+    return [StoredMessage("s1", "user" if i % 2 == 0 else "assistant", f"{i}" * tamanho,
+                          inicio + timedelta(minutes=i)) for i in range(n)]
+
+def test_pack_chunks_respeita_limite():
+    chunks = ["a" * 400, "b" * 400, "c" * 400]  # ~100 tokens cada
+    assert pack_chunks(chunks, max_tokens=250) == "a" * 400 + "\n\n" + "b" * 400
+    # O primeiro chunk é cortado se sozinho não couber
+    assert pack_chunks(chunks, max_tokens=50) == "a" * 200
+    # Chunk grande demais é pulado; um menor depois dele ainda entra
+    assert pack_chunks(["a" * 400, "b" * 800, "c" * 200], max_tokens=160) == "a" * 400 + "\n\n" + "c" * 200
+
+def test_reserva_das_ferramentas_vale_para_a_execucao_inteira():
+    """Cada chamada recebe o que sobrou da reserva; esgotada, a ferramenta manda o LLM parar."""
+    budget = ToolBudget(total=250, per_call=150)
+    chunks = ["a" * 400, "b" * 400]  # ~100 tokens cada
+    assert budget.pack(chunks) == "a" * 400
+    assert budget.pack(chunks) == "a" * 400
+    assert budget.pack(chunks) == "a" * 200  # só 50 tokens restantes
+    assert budget.used == 250
+    assert budget.pack(chunks) == TOOL_BUDGET_EXHAUSTED
+
+def test_historico_cortado_pelo_orcamento_e_resumo_agendado(Sessao):
+    builder = ContextBuilder(MagicMock(), max_tokens=700, tool_reserve=200)
+    historico = _historico(9)  # ~104 tokens por mensagem
+
+    with patch.object(builder, "_schedule_summary") as agendar:
+        mensagens, relatorio = builder.build(Sessao(), "s1", historico, "sistema " * 40)
+
+    # 700 - 200 - 80 (sistema) = 420 -> 4 mensagens mais recentes
+    assert relatorio["history_messages"] == 4
+    assert relatorio["dropped_messages"] == 5
+    assert relatorio["history"] <= 420
+    assert mensagens[-1].content == historico[-1].content
+    assert isinstance(mensagens[-1], HumanMessage) and isinstance(mensagens[0], AIMessage)
+    agendar.assert_called_once_with("s1", historico[:5])
+
+def test_resumo_incremental_usado_na_proxima_requisicao(Sessao, monkeypatch):
+    @contextmanager
+    def session_scope_teste():
+        db = Sessao()
+        try:
+            yield db
+        finally:
+            db.close()
+    monkeypatch.setattr(context_budget, "session_scope", session_scope_teste)
+
+    llm = MagicMock()
+    llm.invoke.return_value = AIMessage(content="Visitante perguntou sobre o TCC.")
+    builder = ContextBuilder(llm, max_tokens=700, tool_reserve=200)
+    historico = _historico(9)
+
+    builder._summarize("s1", historico[:5])
+    db = Sessao()
+    resumo = db.get(SessionSummary, "s1")
+    assert resumo.covered_until == historico[4].timestamp
+
+    with patch.object(builder, "_schedule_summary") as agendar:
+        mensagens, relatorio = builder.build(db, "s1", historico, "sistema")
+    assert isinstance(mensagens[0], SystemMessage) and "TCC" in mensagens[0].content
+    assert relatorio["summary"] > 0
+    # Nada novo para resumir: os turnos que ficaram de fora já estão cobertos
+    agendar.assert_not_called()
+
+def test_usage_report_soma_chamadas_do_llm():
+    mensagens = [
+        HumanMessage(content="oi"),
+        AIMessage(content="", usage_metadata={"input_tokens": 100, "output_tokens": 10, "total_tokens": 110}),
+        AIMessage(content="olá", usage_metadata={"input_tokens": 150, "output_tokens": 20, "total_tokens": 170}),
+    ]
+    assert usage_report(mensagens) == {"input_tokens": 250, "output_tokens": 30, "total_tokens": 280, "llm_calls": 2}
+
+def test_resumo_em_cache_entre_requisicoes(Sessao):
+    db = Sessao()
+    db.add(SessionSummary(session_id="s1", summary="Falaram do TCC.", covered_until=datetime(2026, 1, 1)))
+    db.commit()
+    builder = ContextBuilder(MagicMock(), max_tokens=700, tool_reserve=200)
+
+    with patch.object(builder, "_schedule_summary"), patch.object(db, "get", wraps=db.get) as ler:
+        for _ in range(3):
+            mensagens, _ = builder.build(db, "s1", _historico(2), "sistema")
+    assert "TCC" in mensagens[0].content
+    assert ler.call_count == 1
+
+def test_resumo_em_cache_segue_a_invalidacao_do_chat_store(Sessao):
+    from chat_store import ChatStore, _InvalidationListener
+    db = Sessao()
+    db.add(SessionSummary(session_id="s1", summary="Falaram do TCC.", covered_until=datetime(2026, 1, 1)))
+    db.commit()
+    store = ChatStore(write_behind=False)
+    builder = ContextBuilder(MagicMock(), max_tokens=700, tool_reserve=200, store=store)
+    ouvinte = _InvalidationListener.__new__(_InvalidationListener)
+    ouvinte.caches = store._caches
+
+    with patch.object(builder, "_schedule_summary"), patch.object(db, "get", wraps=db.get) as ler:
+        builder.build(db, "s1", _historico(2), "sistema")
+        builder.build(db, "s1", _historico(2), "sistema")
+        assert ler.call_count == 1
+        ouvinte.handle("outra-maquina:123|s1")  # Outro processo gravou um resumo novo
+        builder.build(db, "s1", _historico(2), "sistema")
+        assert ler.call_count == 2
+
+    # Sem invalidação entre processos o cache de sessões é desligado, e o de resumos junto
+    sem_cache = ContextBuilder(MagicMock(), max_tokens=700, tool_reserve=200,
+                               store=ChatStore(write_behind=False, invalidation="none", workers=2))
+    with patch.object(sem_cache, "_schedule_summary"), patch.object(db, "get", wraps=db.get) as ler:
+        for _ in range(2):
+            sem_cache.build(db, "s1", _historico(2), "sistema")
+    assert ler.call_count == 2
+
+def test_turnos_fora_da_janela_entram_no_resumo(Sessao):
+    """Turnos curtos que saem da janela de CONTEXT_HISTORY_MESSAGES sem corte por tokens também são resumidos."""
+    from database import ChatSession, ChatMessage
+    db = Sessao()
+    db.add(ChatSession(id="s1"))
+    historico = _historico(40, tamanho=5)
+    db.add_all([ChatMessage(session_id=m.session_id, role=m.role, content=m.content, timestamp=m.timestamp)
+                for m in historico])
+    db.commit()
+    builder = ContextBuilder(MagicMock(), max_tokens=6000, tool_reserve=200, history_limit=30)
+
+    with patch.object(builder, "_schedule_summary") as agendar:
+        mensagens, relatorio = builder.build(db, "s1", historico[10:], "sistema")
+    assert relatorio["dropped_messages"] == 0 and len(mensagens) == 30
+    _, turnos = agendar.call_args[0]
+    assert [m.content for m in turnos] == [m.content for m in historico[:10]]
+
+    # Com o resumo cobrindo esses turnos, nada mais a resumir
+    db.add(SessionSummary(session_id="s1", summary="Conversa antiga.", covered_until=historico[9].timestamp))
+    db.commit()
+    builder._summaries.clear()
+    with patch.object(builder, "_schedule_summary") as agendar:
+        builder.build(db, "s1", historico[10:], "sistema")
+    agendar.assert_not_called()
@@ -0,0 +1,55 @@
+import threading
+from flask import Flask
+
+import database
+from database import _engine_options, session_scope, pool_status
+from request_db import get_request_db, init_app
+
+def test_opcoes_do_pool_so_para_postgres(monkeypatch):
+    """SQLite usa o pool padrão; Postgres recebe pool dimensionado ou NullPool com PgBouncer."""
+    assert _engine_options("sqlite:///app.db") == {}
+    # Em memória: uma conexão só, compartilhada entre threads
+    assert _engine_options("sqlite:///:memory:")["poolclass"].__name__ == "StaticPool"
+
+    opcoes = _engine_options("postgresql://u:p@localhost/db")
+    assert opcoes["pool_size"] == database.DB_POOL_SIZE
+    assert opcoes["pool_pre_ping"] is database.DB_POOL_PRE_PING
+
+    monkeypatch.setattr(database, "DB_EXTERNAL_POOLER", "pgbouncer")
+    assert _engine_options("postgresql://u:p@localhost/db")["poolclass"].__name__ == "NullPool"
+
+def test_sessao_da_requisicao_reaproveitada_e_fechada_no_teardown():
+    """Uma sessão por requisição; session_scope nunca a entrega (helpers fazem commit/rollback na sua)."""
+    app = Flask(__name__)
+    init_app(app)
+    vistas = {}
+
+    with app.app_context():
+        db = get_request_db()
+        assert get_request_db() is db
+        with session_scope() as propria:
+            assert propria is not db
+
+        def em_outra_thread():
+            with session_scope() as outra:
+                vistas["outra"] = outra
+        t = threading.Thread(target=em_outra_thread)
+        t.start()
+        t.join()
+        assert vistas["outra"] is not db
+
+        fechada = []
+        db.close = lambda: fechada.append(True)
+    assert fechada == [True]
+
+def test_status_do_pool():
+    status = pool_status()
+    assert status["pool"]
+    assert status["checkouts"] >= 0
+
+def test_ef_search_cobre_os_candidatos_pedidos_ao_indice(monkeypatch):
+    import database
+    monkeypatch.setattr(database, "VECTOR_INDEX_TYPE", "hnsw")
+    assert database.search_param_statements(ef_search=40) == ["SET LOCAL hnsw.ef_search = 40"]
+    assert database.search_param_statements(ef_search=40, candidates=240) == ["SET LOCAL hnsw.ef_search = 240"]
+    assert database.search_param_statements(ef_search=40, candidates=5000) == ["SET LOCAL hnsw.ef_search = 1000"]
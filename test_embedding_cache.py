@@ -0,0 +1,48 @@
+from unittest.mock import MagicMock
+
+from embedding_cache import CachedEmbeddings, cache_key
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+def _cache(**kwargs):
+    base = MagicMock()
+    base.embed_query.side_effect = lambda texto: [float(len(texto))]
+    opcoes = {"persistent": False, "max_size": 2, "ttl": 60}
+    opcoes.update(kwargs)
+    return base, CachedEmbeddings(base, model_name="modelo-teste", **opcoes)
+
+def test_chave_normaliza_consulta():
+    """Caixa e espaços extras não devem gerar chaves diferentes."""
+    assert cache_key("  Qual o tema do   TCC? ", "m") == cache_key("qual o tema do tcc?", "m")
+    assert cache_key("tcc", "m1") != cache_key("tcc", "m2")
+
+def test_cache_em_memoria_evita_nova_chamada():
+    base, cache = _cache()
+
+    primeiro = cache.embed_query("Experiência com Python")
+    segundo = cache.embed_query("experiência com  python")
+
+    assert primeiro == segundo
+    assert base.embed_query.call_count == 1
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_cache_respeita_limite_e_ttl():
+    relogio = Relogio()
+    base, cache = _cache(clock=relogio)
+
+    cache.embed_query("a")
+    cache.embed_query("b")
+    cache.embed_query("c")  # remove "a" (LRU)
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+
+    relogio.agora += 61
+    cache.embed_query("c")  # expirado, recalcula
+    assert cache.stats()["expired"] == 1
+    assert base.embed_query.call_count == 4
@@ -0,0 +1,184 @@
+import os
+from contextlib import contextmanager
+import pytest
+from unittest.mock import MagicMock, patch
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import indexing
+from indexing import embed_chunks, _embed_batch
+from pdf_extraction import prune_text_cache
+from database import Base, DocumentEmbedding, DocumentManifest, EMBEDDING_DIM
+
+def test_embed_chunks_em_lotes_preserva_ordem():
+    """Os vetores devem voltar na mesma ordem dos chunks, mesmo com lotes em paralelo."""
+    modelo = MagicMock()
+    modelo.embed_documents.side_effect = lambda lote: [[float(c)] for c in lote]
+    chunks = [str(i) for i in range(10)]
+
+    vetores = embed_chunks(modelo, chunks, batch_size=3, max_concurrency=4)
+
+    assert vetores == [[float(i)] for i in range(10)]
+    assert modelo.embed_documents.call_count == 4
+
+@patch('indexing.time.sleep')
+def test_embed_batch_retry_com_backoff(mock_sleep):
+    """Falhas transitórias devem ser repetidas com espera crescente."""
+    modelo = MagicMock()
+    modelo.embed_documents.side_effect = [Exception("429"), Exception("429"), [[1.0]]]
+
+    assert _embed_batch(modelo, ["a"], max_retries=3, base_delay=0.01) == [[1.0]]
+    assert mock_sleep.call_count == 2
+    assert mock_sleep.call_args_list[1][0][0] >= mock_sleep.call_args_list[0][0][0]
+
+
+@pytest.fixture
+def cache_texto(monkeypatch, tmp_path_factory):
+    """Cache de texto de PDFs temporário: a limpeza do fim da indexação não toca no .cache real."""
+    cache_dir = str(tmp_path_factory.mktemp("pdf_text"))
+    monkeypatch.setattr(indexing, "prune_text_cache", lambda keep: prune_text_cache(keep, cache_dir=cache_dir))
+    return cache_dir
+
+@pytest.fixture
+def banco(monkeypatch, cache_texto):
+    """Banco SQLite em memória no lugar do Postgres para a indexação."""
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    SessionTeste = sessionmaker(bind=engine)
+
+    @contextmanager
+    def session_scope_teste():
+        db = SessionTeste()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    monkeypatch.setattr(indexing, "session_scope", session_scope_teste)
+    return SessionTeste
+
+def _modelo_falso():
+    modelo = MagicMock()
+    modelo.embed_documents.side_effect = lambda lote: [[0.0] * EMBEDDING_DIM for _ in lote]
+    return modelo
+
+def test_reindexacao_incremental(banco, tmp_path):
+    """Só os chunks alterados são re-gerados; arquivos removidos saem do índice."""
+    paragrafos = [f"Parágrafo {i}: " + ("conteúdo " * 100) for i in range(4)]
+    arquivo = tmp_path / "curriculo.md"
+    arquivo.write_text("\n\n".join(paragrafos), encoding="utf-8")
+    (tmp_path / "outro.md").write_text("Arquivo que será removido.", encoding="utf-8")
+
+    modelo = _modelo_falso()
+    indexing.init_vector_store(modelo, data_dir=str(tmp_path))
+    total_inicial = sum(len(c[0][0]) for c in modelo.embed_documents.call_args_list)
+
+    # Sem mudanças: nenhum embedding novo
+    modelo.embed_documents.reset_mock()
+    indexing.init_vector_store(modelo, data_dir=str(tmp_path))
+    assert modelo.embed_documents.call_count == 0
+
+    # Edita um parágrafo e remove o outro arquivo
+    paragrafos[2] = "Parágrafo editado: " + ("novo " * 150)
+    arquivo.write_text("\n\n".join(paragrafos), encoding="utf-8")
+    os.utime(arquivo, (1, 1))
+    (tmp_path / "outro.md").unlink()
+    indexing.init_vector_store(modelo, data_dir=str(tmp_path))
+
+    gerados = sum(len(c[0][0]) for c in modelo.embed_documents.call_args_list)
+    assert 0 < gerados < total_inicial
+
+    db = banco()
+    assert db.query(DocumentEmbedding).filter_by(source="outro.md").count() == 0
+    assert db.query(DocumentManifest).filter_by(source="outro.md").count() == 0
+    manifesto = db.query(DocumentManifest).filter_by(source="curriculo.md").one()
+    assert db.query(DocumentEmbedding).filter_by(source="curriculo.md").count() == manifesto.chunk_count
+    db.close()
+
+def test_extracao_vazia_mantem_o_indice_e_tenta_de_novo(banco, tmp_path):
+    """Um arquivo que passou a não render texto não apaga seus chunks nem entra no manifesto."""
+    arquivo = tmp_path / "curriculo.md"
+    arquivo.write_text("Experiência com Python e Flask. " * 20, encoding="utf-8")
+    modelo = _modelo_falso()
+    indexing.init_vector_store(modelo, data_dir=str(tmp_path))
+    db = banco()
+    hash_original = db.query(DocumentManifest).one().file_hash
+    chunks = db.query(DocumentEmbedding).count()
+    db.close()
+
+    arquivo.write_text("   \n", encoding="utf-8")
+    os.utime(arquivo, (1, 1))
+    indexing.init_vector_store(modelo, data_dir=str(tmp_path))
+
+    db = banco()
+    assert db.query(DocumentEmbedding).count() == chunks > 0
+    assert db.query(DocumentManifest).one().file_hash == hash_original
+    db.close()
+
+def test_cache_de_texto_so_guarda_os_hashes_do_manifesto(banco, cache_texto, tmp_path):
+    (tmp_path / "curriculo.md").write_text("Experiência com Python e Flask.", encoding="utf-8")
+    for nome in ("antigo.json", "em_gravacao.json.tmp"):
+        open(os.path.join(cache_texto, nome), "w").close()
+    indexing.init_vector_store(_modelo_falso(), data_dir=str(tmp_path))
+
+    db = banco()
+    atual = db.query(DocumentManifest).one().file_hash
+    db.close()
+    open(os.path.join(cache_texto, f"{atual}.json"), "w").close()
+    indexing.init_vector_store(_modelo_falso(), data_dir=str(tmp_path))
+    assert sorted(os.listdir(cache_texto)) == sorted([f"{atual}.json", "em_gravacao.json.tmp"])
+
+def test_colecao_por_arquivo():
+    """Cada arquivo de data/ deve cair na coleção usada pelas ferramentas."""
+    assert indexing.collection_for_source("artigo_base--abtn.pdf") == "tcc"
+    assert indexing.collection_for_source("potencial_hidrodinamica_completo.pdf") == "ic"
+    assert indexing.collection_for_source("calcular_orcamento_de_software.md") == "orcamento"
+    assert indexing.collection_for_source("Currículo (raw) - Gustavo Mota Macedo (backend).pdf") == "curriculo"
+    assert indexing.collection_for_source("artigo_base--abtn.pt.en.pdf") is None
+
+def test_indices_ann_parciais():
+    """Um índice parcial por coleção, com a classe de operadores da distância L2."""
+    from database import vector_index_statements, VECTOR_COLLECTIONS
+
+    hnsw = vector_index_statements("hnsw")
+    assert len(hnsw) == len(VECTOR_COLLECTIONS)
+    assert all("USING hnsw (embedding vector_l2_ops)" in s for s in hnsw)
+    assert "WHERE collection = 'tcc'" in hnsw[0]
+    assert all("lists =" in s for s in vector_index_statements("ivfflat"))
+    assert vector_index_statements("none") == []
+
+def test_indices_quantizados_sao_de_expressao():
+    """halfvec/binário indexam uma expressão sobre `embedding`, com nome próprio (convivem na migração)."""
+    from database import vector_index_statements
+
+    halfvec = vector_index_statements("hnsw", "halfvec", concurrently=True)
+    assert all(s.startswith("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_document_embeddings_halfvec_hnsw_")
+               for s in halfvec)
+    assert "((embedding::halfvec(1536)) halfvec_l2_ops)" in halfvec[0]
+    binario = vector_index_statements("hnsw", "binary")
+    assert "((binary_quantize(embedding)::bit(1536)) bit_hamming_ops)" in binario[0]
+    assert binario[0].split()[5] != vector_index_statements("hnsw", "none")[0].split()[5]
+
+def test_quase_duplicados_agrupados_na_indexacao(banco, tmp_path):
+    """Chunks quase iguais em arquivos da mesma coleção ganham o mesmo cluster_id."""
+    texto = ("Experiência com Python, Flask, LangChain e PostgreSQL em projetos de IA generativa "
+             "para atendimento, com filas Redis, autenticação JWT e deploy contínuo. ") * 3
+    (tmp_path / "curriculo_backend.md").write_text(texto, encoding="utf-8")
+    (tmp_path / "curriculo_fullstack.md").write_text(texto + "React e TypeScript no front-end.", encoding="utf-8")
+    (tmp_path / "calcular_orcamento_de_software.md").write_text("Orçamento por hora de desenvolvimento.",
+                                                                 encoding="utf-8")
+
+    resumo = indexing.init_vector_store(_modelo_falso(), data_dir=str(tmp_path))
+
+    db = banco()
+    linhas = {l.source: l for l in db.query(DocumentEmbedding)}
+    assert linhas["curriculo_backend.md"].cluster_id == linhas["curriculo_fullstack.md"].cluster_id
+    assert linhas["calcular_orcamento_de_software.md"].cluster_id == linhas["calcular_orcamento_de_software.md"].id
+    assert resumo["near_duplicates"] == 2
+    db.close()
+
+    # Nada mudou: os grupos não são recalculados
+    with patch("indexing.assign_clusters") as assign_clusters:
+        indexing.init_vector_store(_modelo_falso(), data_dir=str(tmp_path))
+    assign_clusters.assert_not_called()
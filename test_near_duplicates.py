@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from near_duplicates import minhash, similarity, cluster_ids, collapse, strip_overlaps, NEAR_DUP_THRESHOLD
+
+BASE = ("Desenvolvedor backend com experiência em Python, Flask, FastAPI e PostgreSQL. "
+        "Implementou pipelines de autenticação, filas com Redis e integrações com LLMs "
+        "para atendimento automatizado, com testes e deploy contínuo em nuvem.")
+
+
+def test_minhash_estima_jaccard():
+    """Texto quase igual (acentos/caixa/pontuação) fica acima do limiar; texto diferente, abaixo."""
+    variante = BASE.replace("experiência", "EXPERIENCIA").replace(",", ";") + " Disponível para projetos."
+    outro = "O potencial de matéria escura em galáxias espirais foi estimado a partir das curvas de rotação."
+
+    assert minhash(BASE) == minhash(BASE)
+    assert similarity(minhash(BASE), minhash(variante)) >= 0.7
+    assert similarity(minhash(BASE), minhash(outro)) < 0.2
+
+
+def test_cluster_ids_usa_menor_id_e_fecho_transitivo():
+    a = BASE
+    b = BASE + " Inglês avançado."
+    c = b + " Inglês avançado e espanhol básico."
+    itens = [(5, minhash(a)), (2, minhash(b)), (9, minhash(c)), (4, minhash("texto sem relação nenhuma com o resto")),
+             (6, minhash(""))]
+
+    grupos = cluster_ids(itens)
+
+    assert grupos[5] == grupos[2] == grupos[9] == 2
+    assert grupos[4] == 4
+    assert grupos[6] == 6  # chunk vazio não agrupa
+
+
+def test_collapse_mantem_o_mais_relevante():
+    chunks = [SimpleNamespace(id=i, cluster_id=c) for i, c in [(1, 10), (2, 10), (3, None), (4, None), (5, 11)]]
+    assert [c.id for c in collapse(chunks)] == [1, 3, 4, 5]
+    assert [c.id for c in collapse(chunks, k=2)] == [1, 3]
+
+
+def test_overlap_do_splitter_cortado_na_montagem():
+    """Vizinhos do splitter não são quase duplicados; o trecho repetido sai da saída da ferramenta."""
+    texto = " ".join(f"Projeto {i}: API em Python com Flask, filas Redis e deploy número {i}." for i in range(40))
+    primeiro, segundo = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200).split_text(texto)[:2]
+    repetido = segundo[:100]
+    assert repetido in primeiro
+    assert similarity(minhash(primeiro), minhash(segundo)) < NEAR_DUP_THRESHOLD
+
+    # O segundo veio antes (mais relevante): o fim do primeiro, que ele repete, sai
+    mais_relevante, cortado = strip_overlaps([segundo, primeiro])
+    assert mais_relevante == segundo
+    assert primeiro.startswith(cortado) and repetido not in cortado
+    # Na ordem inversa sai o começo do segundo
+    assert repetido not in strip_overlaps([primeiro, segundo])[1]
+    # Chunk inteiramente repetido sai; textos sem overlap ficam intactos
+    assert strip_overlaps([primeiro, primeiro[-150:]]) == [primeiro]
+    assert strip_overlaps([BASE, primeiro]) == [BASE, primeiro]
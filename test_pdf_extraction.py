@@ -0,0 +1,50 @@
+import os
+import glob
+import pytest
+from unittest.mock import patch
+
+import pdf_extraction
+from pdf_extraction import needs_layout, extract_pdf_pages, extract_pdf_text
+
+PDFS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "*.pdf")))
+
+
+def test_needs_layout_detecta_texto_ruim():
+    """Texto vazio, palavras grudadas ou linhas picotadas vão para o pdfplumber."""
+    assert needs_layout("")
+    assert needs_layout("Experiênciaprofissionalcomdesenvolvimentobackend" * 3)
+    assert needs_layout("\n".join("a" for _ in range(20)) + "\nlinha normal de texto aqui")
+    assert not needs_layout("Experiência profissional com desenvolvimento backend em Python e Flask.")
+
+
+def test_cache_evita_nova_extracao(tmp_path):
+    """Com o mesmo hash, a segunda chamada lê o cache e não abre o PDF."""
+    with patch("pdf_extraction._page_count", return_value=2), \
+         patch("pdf_extraction.extract_pages", return_value=[("um", "pypdf"), ("", "pdfplumber")]) as extrair:
+        primeira = extract_pdf_pages("x.pdf", "abc", workers=1, cache_dir=str(tmp_path))
+        segunda = extract_pdf_pages("x.pdf", "abc", workers=1, cache_dir=str(tmp_path))
+
+    assert extrair.call_count == 1
+    assert primeira == segunda == [{"text": "um", "engine": "pypdf"}, {"text": "", "engine": "pdfplumber"}]
+    with patch("pdf_extraction._page_count", side_effect=AssertionError):
+        assert extract_pdf_text("x.pdf", "abc", cache_dir=str(tmp_path)) == "um\n"
+
+
+def test_cache_de_versao_antiga_e_ignorado(tmp_path):
+    with patch("pdf_extraction._page_count", return_value=1), \
+         patch("pdf_extraction.extract_pages", return_value=[("v1", "pypdf")]):
+        extract_pdf_pages("x.pdf", "abc", workers=1, cache_dir=str(tmp_path))
+    with patch.object(pdf_extraction, "EXTRACTOR_VERSION", 2), \
+         patch("pdf_extraction._page_count", return_value=1), \
+         patch("pdf_extraction.extract_pages", return_value=[("v2", "pypdf")]):
+        assert extract_pdf_pages("x.pdf", "abc", workers=1, cache_dir=str(tmp_path))[0]["text"] == "v2"
+
+
+@pytest.mark.skipif(not PDFS, reason="sem PDFs em data/")
+def test_extracao_paralela_igual_a_sequencial():
+    """As faixas de páginas processadas no pool voltam na ordem original."""
+    arquivo = min(PDFS, key=os.path.getsize)
+    sequencial = extract_pdf_pages(arquivo, None, workers=1)
+    paralelo = extract_pdf_pages(arquivo, None, workers=2, min_parallel_pages=1)
+    assert paralelo == sequencial
+    assert any(page["text"] for page in sequencial)
@@ -0,0 +1,146 @@
+import time
+import asyncio
+import threading
+from typing import Annotated, TypedDict
+
+import pytest
+from langgraph.graph import StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode, tools_condition
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+
+import prefetch
+from prefetch import Prefetch, compatible, current_prefetch, predict
+from retrieval import RetrievedChunk
+from telemetry import PREFETCH_OUTCOMES, PREFETCH_SAVED
+
+
+class MotorFalso:
+    """RetrievalEngine de mentira: registra as consultas e devolve um chunk por coleção."""
+
+    def __init__(self, atraso=0.0):
+        self.atraso = atraso
+        self.consultas = []
+        self.threads = set()
+
+    def _resultado(self, query, collections):
+        self.consultas.append((query, tuple(collections)))
+        self.threads.add(threading.get_ident())
+        return {name: [RetrievedChunk(id=1, content=f"trecho de {name}", source="x", collection=name, distance=0.1)]
+                for name in collections}
+
+    def search(self, query, collections, k=None):
+        time.sleep(self.atraso)
+        return self._resultado(query, collections)
+
+    async def asearch(self, query, collections, k=None):
+        await asyncio.sleep(self.atraso)
+        return self._resultado(query, collections)
+
+
+def test_classificador_de_intencao():
+    assert predict("Qual o tema do seu TCC?") == ["tcc"]
+    assert predict("Quais tecnologias você usa no backend?") == ["curriculo"]
+    assert predict("Me fale da sua Iniciação Científica") == ["ic"]
+    assert predict("Oi, tudo bem?") == []
+
+
+def test_consulta_compativel_com_a_mensagem():
+    mensagem = "Qual o tema do seu TCC?"
+    assert compatible("tema do TCC", mensagem)
+    assert not compatible("orientador banca avaliadora", mensagem)
+    assert not compatible("", mensagem)
+
+
+def test_acerto_reaproveita_a_busca_adiantada():
+    pytest.importorskip("prometheus_client")
+    motor = MotorFalso(atraso=0.05)
+    acertos = PREFETCH_OUTCOMES.value(collection="tcc", outcome="hit")
+    economias = PREFETCH_SAVED.count(collection="tcc")
+
+    busca = Prefetch.start(motor, "Qual o tema do seu TCC?")
+    time.sleep(0.1)  # "primeiro turno do LLM"
+    chunks = busca.take("tcc", "tema TCC")
+
+    assert [c.content for c in chunks] == ["trecho de tcc"]
+    assert motor.consultas == [("Qual o tema do seu TCC?", ("tcc",))]
+    # Segunda chamada da mesma coleção busca normalmente
+    assert busca.take("tcc", "tema TCC") is None
+    busca.finish()
+    assert PREFETCH_OUTCOMES.value(collection="tcc", outcome="hit") == acertos + 1
+    assert PREFETCH_SAVED.count(collection="tcc") == economias + 1
+
+
+def test_consulta_diferente_e_colecao_nao_prevista_buscam_normalmente():
+    pytest.importorskip("prometheus_client")
+    motor = MotorFalso()
+    nao_previstas = PREFETCH_OUTCOMES.value(collection="curriculo", outcome="unpredicted")
+    nao_usadas = PREFETCH_OUTCOMES.value(collection="tcc", outcome="unused")
+
+    busca = Prefetch.start(motor, "Qual o tema do seu TCC?")
+    assert busca.take("curriculo", "tema TCC") is None
+    busca.finish()
+
+    assert PREFETCH_OUTCOMES.value(collection="curriculo", outcome="unpredicted") == nao_previstas + 1
+    assert PREFETCH_OUTCOMES.value(collection="tcc", outcome="unused") == nao_usadas + 1
+
+    busca = Prefetch.start(motor, "Qual o tema do seu TCC?")
+    assert busca.take("tcc", "orientador banca avaliadora") is None
+    assert busca.outcomes == {"tcc": "mismatch"}
+
+
+def test_desligado_ou_sem_intencao_nao_busca(monkeypatch):
+    motor = MotorFalso()
+    assert Prefetch.start(motor, "Oi, tudo bem?") is None
+    monkeypatch.setattr(prefetch, "PREFETCH_ENABLED", False)
+    assert Prefetch.start(motor, "Qual o tema do seu TCC?") is None
+    assert motor.consultas == []
+
+
+def test_versao_assincrona():
+    motor = MotorFalso(atraso=0.05)
+
+    async def executar():
+        busca = Prefetch.astart(motor, "Qual o tema do seu TCC?")
+        chunks = await busca.atake("tcc", "tema do TCC")
+        busca.finish()
+        return busca, chunks
+
+    busca, chunks = asyncio.run(executar())
+    assert chunks[0].content == "trecho de tcc"
+    assert busca.outcomes == {"tcc": "hit"}
+
+
+def test_ferramenta_do_grafo_usa_o_resultado_adiantado(monkeypatch):
+    """O ToolNode executa a ferramenta em outra thread: o contexto da requisição precisa chegar lá."""
+    import blueprints.chat as chat
+    motor = MotorFalso()
+    monkeypatch.setattr(chat, "retrieval_engine", motor)
+
+    llm = FakeMessagesListChatModel(responses=[
+        AIMessage(content="", tool_calls=[{"name": "consultar_tcc", "args": {"query": "tema do TCC"}, "id": "1"}]),
+        AIMessage(content="fim"),
+    ])
+
+    class Estado(TypedDict):
+        messages: Annotated[list, add_messages]
+
+    grafo = StateGraph(Estado)
+    grafo.add_node("chatbot", lambda state: {"messages": [llm.invoke(state["messages"])]})
+    grafo.add_node("tools", ToolNode([chat.consultar_tcc]))
+    grafo.add_conditional_edges("chatbot", tools_condition)
+    grafo.add_edge("tools", "chatbot")
+    grafo.set_entry_point("chatbot")
+
+    busca = Prefetch.start(motor, "Qual o tema do seu TCC?")
+    token = current_prefetch.set(busca)
+    try:
+        estado = grafo.compile().invoke({"messages": [HumanMessage(content="Qual o tema do seu TCC?")]})
+    finally:
+        current_prefetch.reset(token)
+        busca.finish()
+
+    assert busca.outcomes == {"tcc": "hit"}
+    assert len(motor.consultas) == 1
+    assert "trecho de tcc" in estado["messages"][2].content
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from quantization import exact_top_k, load_corpus, recall_at_k, sample_queries
+from database import Base, DocumentEmbedding, QueryEmbeddingCache, EMBEDDING_DIM, EMBEDDING_MODEL
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+def _unitario(v):
+    return v / np.linalg.norm(v)
+
+def test_referencia_exata_e_recall(db):
+    rng = np.random.default_rng(0)
+    vetores = [_unitario(rng.normal(size=EMBEDDING_DIM)).astype(np.float32) for _ in range(12)]
+    for i, v in enumerate(vetores):
+        db.add(DocumentEmbedding(content=f"chunk {i}", source="x", chunk_hash=str(i),
+                                 collection="tcc" if i % 2 else "ic", embedding=v.tolist()))
+    db.commit()
+
+    corpus = load_corpus(db)
+    assert sorted(corpus) == ["ic", "tcc"] and corpus["tcc"][1].shape == (6, EMBEDDING_DIM)
+
+    esperado = exact_top_k(corpus, vetores[3], {"tcc": 2, "ic": 2, "curriculo": 5})
+    assert esperado["tcc"][0] == 4  # id do próprio chunk (ids começam em 1)
+    assert "curriculo" not in esperado  # coleção vazia não entra na média
+    assert recall_at_k(esperado, esperado) == 1.0
+    assert recall_at_k({"tcc": esperado["tcc"][:1], "ic": []}, esperado) == 0.25
+
+def test_consultas_reais_completadas_com_chunks_ruidosos(db):
+    rng = np.random.default_rng(0)
+    real = _unitario(rng.normal(size=EMBEDDING_DIM))
+    db.add(QueryEmbeddingCache(key="k", model=EMBEDDING_MODEL, query="tema do TCC", embedding=real.tolist()))
+    chunk = _unitario(rng.normal(size=EMBEDDING_DIM)).astype(np.float32)
+    db.add(DocumentEmbedding(content="c", source="x", chunk_hash="c", collection="tcc", embedding=chunk.tolist()))
+    db.commit()
+
+    consultas = sample_queries(db, 3, rng, load_corpus(db))
+    assert len(consultas) == 3
+    assert np.allclose(consultas[0], real, atol=1e-6)
+    # Perto do chunk, mas não igual a ele
+    assert 0.8 < float(consultas[1] @ chunk) < 0.999
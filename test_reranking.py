@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from reranking import tokenize, bm25_scores, rerank
+
+
+def _chunk(id, content, embedding, distance=0.0):
+    return SimpleNamespace(id=id, content=content, embedding=embedding, distance=distance, relevance=None)
+
+
+def test_tokenize_sem_acentos_e_stopwords():
+    assert tokenize("Experiência com o Flask e a API") == ["experiencia", "flask", "api"]
+
+
+def test_bm25_favorece_termo_exato():
+    scores = bm25_scores("Django", ["Python e Flask", "Python, Django e PostgreSQL", "Java"])
+    assert scores[1] > 0 and scores[0] == scores[2] == 0
+
+
+def test_mmr_troca_quase_duplicado_por_chunk_diverso():
+    """Com vetores quase iguais, o segundo escolhido é o diverso, não a cópia."""
+    q = [1.0, 0.0, 0.0]
+    chunks = [
+        _chunk(1, "experiencia backend python", [0.9, 0.1, 0.0]),
+        _chunk(2, "experiencia backend python", [0.9, 0.11, 0.0]),
+        _chunk(3, "formacao academica", [0.6, 0.0, 0.8]),
+    ]
+
+    assert [c.id for c in rerank("backend", q, list(chunks), k=2, mmr_lambda=1.0)] == [1, 2]
+    escolhidos = rerank("backend", q, list(chunks), k=2, mmr_lambda=0.3)
+    assert [c.id for c in escolhidos] == [1, 3]
+    assert escolhidos[0].relevance >= escolhidos[1].relevance
+
+
+def test_peso_lexical_reordena_candidatos():
+    q = np.array([1.0, 0.0])
+    chunks = [_chunk(1, "linguagens diversas", [1.0, 0.0]), _chunk(2, "projeto com Django", [0.95, 0.31])]
+    assert rerank("Django", q, list(chunks), k=1, lexical_weight=0.0)[0].id == 1
+    assert rerank("Django", q, list(chunks), k=1, lexical_weight=0.6)[0].id == 2
+
+
+def test_sem_vetores_usa_distancia():
+    chunks = [_chunk(1, "a", None, 0.5), _chunk(2, "b", None, 0.1)]
+    assert [c.id for c in rerank("x", [0.0], chunks, k=2)] == [2, 1]
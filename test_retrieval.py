@@ -0,0 +1,164 @@
+from contextlib import nullcontext
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from sqlalchemy.dialects import postgresql
+
+from retrieval import RetrievalEngine, PgVectorBackend, RetrievedChunk
+
+def _linha(id, collection, distance):
+    return SimpleNamespace(id=id, content=f"chunk {id}", source=f"{collection}.pdf",
+                           collection=collection, distance=distance)
+
+def test_uma_consulta_sql_para_varias_colecoes():
+    """Várias coleções: um embedding, um UNION ALL com LIMIT por coleção."""
+    embeddings = MagicMock()
+    embeddings.embed_query.return_value = [0.0, 1.0]
+    db = MagicMock()
+    db.get_bind.return_value.dialect.name = "postgresql"
+    db.execute.return_value.all.return_value = [
+        _linha(2, "tcc", 0.4), _linha(1, "tcc", 0.2), _linha(3, "curriculo", 0.1),
+    ]
+
+    engine = RetrievalEngine(embeddings, backend=PgVectorBackend())
+    with patch("retrieval.session_scope", lambda: nullcontext(db)), patch("retrieval.apply_search_params"):
+        resultados = engine.search("python", ["tcc", "curriculo"], k={"tcc": 2})
+
+    assert embeddings.embed_query.call_count == 1
+    assert db.execute.call_count == 1
+    assert [c.id for c in resultados["tcc"]] == [1, 2]
+    assert [c.id for c in resultados["curriculo"]] == [3]
+
+    query = engine.backend._build_query([0.0, 1.0], {"tcc": 5, "curriculo": 10})
+    sql = str(query.compile(dialect=postgresql.dialect()))
+    assert "UNION ALL" in sql
+    assert sql.count("LIMIT") == 2
+    assert "ILIKE" not in sql.upper()
+
+def test_colecao_desconhecida_e_ignorada():
+    engine = RetrievalEngine(MagicMock(), backend=PgVectorBackend())
+    assert engine.search_by_vector([0.0], ["inexistente"]) == {}
+
+def test_backend_numpy_igual_busca_exata(tmp_path, monkeypatch):
+    """Snapshot + argpartition deve retornar o mesmo top-k de uma busca exata."""
+    import numpy as np
+    import vector_snapshot
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from database import Base, DocumentEmbedding, EMBEDDING_DIM
+
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Sessao = sessionmaker(bind=engine)
+    monkeypatch.setattr(vector_snapshot, "session_scope", lambda: nullcontext(Sessao()))
+
+    rng = np.random.default_rng(42)
+    vetores = rng.normal(size=(30, EMBEDDING_DIM)).astype(np.float32)
+    db = Sessao()
+    for i, v in enumerate(vetores):
+        db.add(DocumentEmbedding(content=f"chunk {i}", source="x", chunk_hash=str(i),
+                                 collection="tcc" if i % 3 else "ic", embedding=v.tolist()))
+    db.commit()
+
+    versao = vector_snapshot.write_snapshot(str(tmp_path))
+    assert vector_snapshot.write_snapshot(str(tmp_path)) == versao  # índice igual, sem reescrita
+
+    backend = vector_snapshot.NumpyBackend(snapshot_dir=str(tmp_path))
+    consulta = rng.normal(size=EMBEDDING_DIM).astype(np.float32)
+    resultado = backend.search(consulta.tolist(), {"tcc": 4, "ic": 3})
+
+    tcc = [i for i in range(30) if i % 3]
+    esperado = sorted(tcc, key=lambda i: np.linalg.norm(vetores[i] - consulta))[:4]
+    assert [c.content for c in resultado["tcc"]] == [f"chunk {i}" for i in esperado]
+    assert len(resultado["ic"]) == 3
+    assert all(c.collection == "ic" for c in resultado["ic"])
+
+def test_modo_hibrido_funde_rankings_em_uma_query():
+    """Modo híbrido: RRF entre vetorial e full-text, um ramo por coleção."""
+    backend = PgVectorBackend(mode="hybrid")
+    statement, params = backend._build_hybrid_query([0.0, 1.0], "Python Django", {"tcc": 5, "curriculo": 10})
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+
+    assert sql.count("UNION ALL") == 1
+    assert "FULL OUTER JOIN" in sql
+    assert "plainto_tsquery('portuguese'" in sql and "plainto_tsquery('english'" in sql
+    assert params["collection_0"] == "tcc" and params["k_1"] == 10
+
+    db = MagicMock()
+    db.execute.return_value.all.return_value = [
+        SimpleNamespace(**vars(_linha(1, "tcc", 0.2)), score=0.01),
+        SimpleNamespace(**vars(_linha(2, "tcc", 0.5)), score=0.03),
+    ]
+    with patch("retrieval.session_scope", lambda: nullcontext(db)), patch("retrieval.apply_search_params"):
+        resultados = backend.search([0.0, 1.0], {"tcc": 5}, query_text="Python Django")
+    assert [c.id for c in resultados["tcc"]] == [2, 1]  # ordenado pela pontuação RRF
+
+    # Sem texto da consulta o modo híbrido cai para a busca vetorial
+    db.execute.reset_mock()
+    with patch("retrieval.session_scope", lambda: nullcontext(db)), patch("retrieval.apply_search_params"):
+        backend.search([0.0, 1.0], {"tcc": 5})
+    assert "UNION" not in str(db.execute.call_args[0][0]) and "plainto" not in str(db.execute.call_args[0][0])
+
+def test_quase_duplicados_colapsados_no_top_k():
+    """Busca o dobro de candidatos e devolve só o mais relevante de cada grupo."""
+    backend = MagicMock()
+    backend.search.return_value = {"curriculo": [
+        RetrievedChunk(id=1, content="a", source="backend.pdf", collection="curriculo", distance=0.1, cluster_id=1),
+        RetrievedChunk(id=7, content="a'", source="fullstack.pdf", collection="curriculo", distance=0.2, cluster_id=1),
+        RetrievedChunk(id=3, content="b", source="backend.pdf", collection="curriculo", distance=0.3),
+        RetrievedChunk(id=4, content="c", source="backend.pdf", collection="curriculo", distance=0.4, cluster_id=4),
+    ]}
+    engine = RetrievalEngine(MagicMock(), backend=backend, collapse_duplicates=True, overfetch=2)
+
+    resultado = engine.search_by_vector([0.0], ["curriculo"], k=2)
+
+    assert backend.search.call_args[0][1] == {"curriculo": 4}
+    assert [c.id for c in resultado["curriculo"]] == [1, 3]
+
+def test_consulta_em_texto_passa_pelo_reranking():
+    """Com texto: busca k * RERANK_OVERFETCH candidatos com vetores e re-ranqueia localmente."""
+    import numpy as np
+    rng = np.random.default_rng(0)
+    backend = MagicMock()
+    backend.search.return_value = {"tcc": [
+        RetrievedChunk(id=i, content=f"chunk {i}" + (" Django" if i == 5 else ""), source="tcc.pdf",
+                       collection="tcc", distance=0.1 * i, embedding=rng.normal(size=8).tolist())
+        for i in range(6)
+    ]}
+    embeddings = MagicMock()
+    embeddings.embed_query.return_value = rng.normal(size=8).tolist()
+    engine = RetrievalEngine(embeddings, backend=backend, collapse_duplicates=False, rerank=True, rerank_overfetch=3)
+
+    resultado = engine.search("Django", ["tcc"], k=2)["tcc"]
+
+    args, kwargs = backend.search.call_args
+    assert args[1] == {"tcc": 6} and kwargs["with_vectors"] is True
+    assert len(resultado) == 2
+    assert all(c.relevance is not None for c in resultado)
+
+def test_quantizado_busca_grosso_no_indice_e_reordena_pela_distancia_exata():
+    """Passo grosso pela expressão do índice quantizado, com mais candidatos, e ORDER BY exato por fora."""
+    meia = PgVectorBackend(mode="vector", quantization="halfvec")
+    sql = str(meia._build_query([0.0, 1.0], {"tcc": 5}).compile(dialect=postgresql.dialect()))
+    assert "ORDER BY CAST(document_embeddings.embedding AS HALFVEC(1536)) <->" in sql
+    assert sql.count("LIMIT") == 2 and "ORDER BY anon_2.distance" in sql
+
+    binario = PgVectorBackend(mode="vector", quantization="binary")
+    consulta = binario._build_query([0.0, 1.0], {"tcc": 5})
+    sql = str(consulta.compile(dialect=postgresql.dialect()))
+    assert "CAST(binary_quantize(document_embeddings.embedding) AS BIT(1536)) <~> binary_quantize(" in sql
+    assert sorted(consulta.compile().params[p] for p in ("param_2", "param_3")) == [5, 5 * binario.coarse_overfetch]
+
+    statement, params = binario._build_hybrid_query([0.0, 1.0], "Python", {"tcc": 5})
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert "ORDER BY binary_quantize(embedding)::bit(1536) <~>" in sql
+    assert params["coarse_candidates"] == params["candidates"] * binario.coarse_overfetch
+
+    # O HNSW devolve no máximo ef_search linhas: a busca pede pelo menos os candidatos do passo grosso
+    db = MagicMock()
+    db.execute.return_value.all.return_value = []
+    with patch("retrieval.session_scope", lambda: nullcontext(db)), \
+            patch("retrieval.apply_search_params") as parametros:
+        binario.search([0.0, 1.0], {"tcc": 5, "curriculo": 30})
+    assert parametros.call_args.kwargs["candidates"] == 30 * binario.coarse_overfetch
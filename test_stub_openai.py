@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+from langchain_core.messages import HumanMessage, ToolMessage
+from langchain_core.tools import tool
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from stub_openai import StubConfig, start_stub_server, plan_response, fake_embedding
+
+FERRAMENTAS = [{"type": "function", "function": {"name": "consultar_curriculo",
+                "parameters": {"properties": {"query": {"type": "string"}}, "required": ["query"]}}}]
+
+def test_roteiro_chama_ferramenta_e_depois_responde():
+    roteiro = {"steps": [["consultar_curriculo"]], "answer": "fim"}
+    corpo = {"messages": [{"role": "user", "content": "python?"}], "tools": FERRAMENTAS}
+    chamadas, conteudo = plan_response(corpo, roteiro)
+    assert conteudo is None
+    assert json.loads(chamadas[0]["function"]["arguments"]) == {"query": "python?"}
+
+    corpo["messages"] += [{"role": "assistant", "tool_calls": chamadas},
+                          {"role": "tool", "tool_call_id": chamadas[0]["id"], "content": "ok"}]
+    assert plan_response(corpo, roteiro) == (None, "fim")
+
+def test_clientes_langchain_falam_com_o_stub():
+    """Chat (com e sem streaming) e embeddings passam pelo cliente oficial sem tocar a rede."""
+    servidor, url = start_stub_server(StubConfig(latency_ms=0, jitter_ms=0, embedding_latency_ms=0,
+                                                 tokens_per_second=0))
+    try:
+        @tool
+        def consultar_curriculo(query: str):
+            """Busca no currículo."""
+            return "Python"
+
+        llm = ChatOpenAI(model="gpt-4o-mini", base_url=url, api_key="x", stream_usage=True)
+        resposta = llm.bind_tools([consultar_curriculo]).invoke("quais tecnologias?")
+        assert resposta.tool_calls[0]["name"] == "consultar_curriculo"
+
+        mensagens = [HumanMessage(content="quais tecnologias?"), resposta,
+                     ToolMessage(content="Python", tool_call_id=resposta.tool_calls[0]["id"])]
+        pedacos = list(llm.bind_tools([consultar_curriculo]).stream(mensagens))
+        assert "".join(p.content for p in pedacos).startswith("Tenho experiência")
+        assert any(p.usage_metadata for p in pedacos)
+
+        embeddings = OpenAIEmbeddings(model="text-embedding-3-small", base_url=url, api_key="x",
+                                      check_embedding_ctx_length=False)
+        vetor = embeddings.embed_query("oi")
+        assert np.allclose(vetor, fake_embedding("oi", 1536), atol=1e-6)
+        assert servidor.config.requests == {"chat": 2, "embeddings": 1}
+    finally:
+        servidor.shutdown()
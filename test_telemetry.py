@@ -0,0 +1,124 @@
+import json
+import time
+from typing import Annotated, TypedDict
+
+from langgraph.graph import StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode, tools_condition
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.tools import tool
+import pytest
+
+import telemetry
+from telemetry import Registry, TracingCallbackHandler
+
+def _hex(span, campo):
+    contexto = span.get_span_context()
+    return "0x" + format(getattr(contexto, campo), "032x" if campo == "trace_id" else "016x")
+
+def test_exposicao_no_formato_prometheus():
+    pytest.importorskip("prometheus_client")
+    registro = Registry()
+    contador = registro.counter("teste_total", "Teste.", ("tool",))
+    histograma = registro.histogram("teste_seconds", "Teste.", ("tool",), buckets=(0.1, 1.0))
+    contador.inc(tool="consultar_tcc")
+    histograma.observe(0.05, tool="consultar_tcc")
+    histograma.observe(0.5, tool="consultar_tcc")
+    registro.register_collector(lambda: [("cache_hit_ratio", "gauge", "Taxa.", {"cache": "answer"}, 0.5)])
+
+    texto = registro.expose()
+    assert 'portfolio_teste_total{tool="consultar_tcc"} 1.0' in texto
+    assert 'portfolio_teste_seconds_bucket{le="0.1",tool="consultar_tcc"} 1.0' in texto
+    assert 'portfolio_teste_seconds_bucket{le="+Inf",tool="consultar_tcc"} 2.0' in texto
+    assert 'portfolio_teste_seconds_count{tool="consultar_tcc"} 2.0' in texto
+    assert contador.value(tool="consultar_tcc") == 1
+    assert histograma.count(tool="consultar_tcc") == 2
+    assert "# TYPE portfolio_cache_hit_ratio gauge" in texto
+    assert 'portfolio_cache_hit_ratio{cache="answer"} 0.5' in texto
+
+def test_spans_do_grafo_formam_uma_arvore(monkeypatch, tmp_path):
+    """LLM dentro do passo chatbot, ferramenta dentro do passo tools, tudo sob o span raiz."""
+    pytest.importorskip("opentelemetry.sdk")
+    pytest.importorskip("prometheus_client")
+    arquivo = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(telemetry, "TRACING_EXPORTER", "file")
+    monkeypatch.setattr(telemetry, "TRACING_FILE", str(arquivo))
+
+    @tool
+    def consultar_tcc(query: str):
+        """Busca no TCC."""
+        return "ok"
+
+    llm = FakeMessagesListChatModel(responses=[
+        AIMessage(content="", tool_calls=[{"name": "consultar_tcc", "args": {"query": "tema"}, "id": "1"}]),
+        AIMessage(content="fim"),
+    ])
+
+    class Estado(TypedDict):
+        messages: Annotated[list, add_messages]
+
+    grafo = StateGraph(Estado)
+    grafo.add_node("chatbot", lambda state: {"messages": [llm.invoke(state["messages"])]})
+    grafo.add_node("tools", ToolNode([consultar_tcc]))
+    grafo.add_conditional_edges("chatbot", tools_condition)
+    grafo.add_edge("tools", "chatbot")
+    grafo.set_entry_point("chatbot")
+
+    chamadas = telemetry.TOOL_CALLS.value(tool="consultar_tcc", status="ok")
+    with telemetry.span("POST /api/chat") as raiz:
+        grafo.compile().invoke({"messages": [HumanMessage(content="oi")]},
+                               config={"callbacks": [TracingCallbackHandler(raiz)]})
+    telemetry.flush_spans()
+
+    spans = {s["name"]: s for s in map(json.loads, arquivo.read_text().splitlines())}
+    assert {s["context"]["trace_id"] for s in spans.values()} == {_hex(raiz, "trace_id")}
+    assert spans["graph.step tools"]["parent_id"] == _hex(raiz, "span_id")
+    assert spans["tool consultar_tcc"]["parent_id"] == spans["graph.step tools"]["context"]["span_id"]
+    assert spans["llm.chat"]["parent_id"] != _hex(raiz, "span_id")
+    assert telemetry.TOOL_CALLS.value(tool="consultar_tcc", status="ok") == chamadas + 1
+
+def test_latencia_do_stream_vai_ate_o_fim_da_resposta():
+    """SSE: a latência HTTP é registrada quando o stream fecha, não ao sair da view."""
+    pytest.importorskip("prometheus_client")
+    from flask import Flask, Response
+
+    app = Flask(__name__)
+    telemetry.init_app(app)
+
+    @app.route("/stream")
+    def stream():
+        def eventos():
+            yield "a"
+            time.sleep(0.05)
+            yield "b"
+        return Response(eventos(), mimetype="text/event-stream")
+
+    antes = telemetry.HTTP_LATENCY.count(endpoint="stream")
+    with app.test_client() as client:
+        response = client.get("/stream")
+        assert telemetry.HTTP_LATENCY.count(endpoint="stream") == antes
+        assert response.get_data() == b"ab"
+        response.close()
+    assert telemetry.HTTP_LATENCY.count(endpoint="stream") == antes + 1
+    assert telemetry.HTTP_LATENCY.sum(endpoint="stream") >= 0.05
+
+def test_traceparent_w3c(monkeypatch, tmp_path):
+    """Um traceparent recebido é continuado; um inválido começa um trace novo."""
+    pytest.importorskip("opentelemetry.sdk")
+    monkeypatch.setattr(telemetry, "TRACING_EXPORTER", "file")
+    monkeypatch.setattr(telemetry, "TRACING_FILE", str(tmp_path / "traces.jsonl"))
+
+    raiz = telemetry.start_span("GET /", traceparent="00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01")
+    assert telemetry.traceparent(raiz).startswith("00-4bf92f3577b34da6a3ce929d0e0e4736-")
+    assert _hex(raiz, "span_id") != "0x00f067aa0ba902b7"
+    nova = telemetry.start_span("GET /", traceparent="lixo")
+    assert not telemetry.traceparent(nova).startswith("00-4bf92f3577b34da6a3ce929d0e0e4736-")
+    raiz.end()
+    nova.end()
+
+def test_sem_tracing_nao_cria_spans(monkeypatch):
+    monkeypatch.setattr(telemetry, "TRACING_EXPORTER", "none")
+    with telemetry.span("qualquer") as atual:
+        assert atual is telemetry.NOOP_SPAN
+    assert telemetry.traceparent(atual) is None
@@ -0,0 +1,216 @@
+"""
+Backend de busca exata em memória (NumPy) para corpora pequenos.
+
+Os vetores de document_embeddings são exportados para um snapshot em disco:
+uma matriz float32 contígua (N x D), com as linhas agrupadas por coleção, e
+um JSON com ids, conteúdos e o intervalo de linhas de cada coleção. O
+arquivo da matriz é aberto com memmap, então vários workers no mesmo host
+compartilham as mesmas páginas do cache do sistema operacional.
+
+Layout de VECTOR_SNAPSHOT_DIR:
+    CURRENT                  -> versão ativa (trocado atomicamente)
+    vectors-<versão>.f32     -> matriz float32
+    meta-<versão>.json       -> metadados
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+import telemetry
+from database import session_scope, DocumentEmbedding, EMBEDDING_DIM
+from retrieval import RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+VECTOR_SNAPSHOT_DIR = os.getenv(
+    "VECTOR_SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "vector_snapshot"),
+)
+# Intervalo mínimo (s) entre verificações de snapshot novo
+VECTOR_SNAPSHOT_CHECK_INTERVAL = float(os.getenv("VECTOR_SNAPSHOT_CHECK_INTERVAL", "5"))
+# Quantas versões antigas manter no disco (workers podem ainda estar lendo)
+VECTOR_SNAPSHOT_KEEP = 2
+
+
+def _current_path(snapshot_dir):
+    return os.path.join(snapshot_dir, "CURRENT")
+
+
+def read_current_version(snapshot_dir=VECTOR_SNAPSHOT_DIR):
+    try:
+        with open(_current_path(snapshot_dir), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_snapshot(snapshot_dir=VECTOR_SNAPSHOT_DIR):
+    """
+    Exporta os vetores do banco para um novo snapshot e o torna o atual.
+    Se o conteúdo não mudou desde o último snapshot, nada é reescrito.
+    Retorna a versão ativa.
+    """
+    with session_scope() as db:
+        rows = db.query(
+            DocumentEmbedding.id,
+            DocumentEmbedding.content,
+            DocumentEmbedding.source,
+            DocumentEmbedding.collection,
+            DocumentEmbedding.chunk_hash,
+            DocumentEmbedding.cluster_id,
+            DocumentEmbedding.embedding,
+        ).filter(
+            DocumentEmbedding.collection.isnot(None)
+        ).order_by(DocumentEmbedding.collection, DocumentEmbedding.id).all()
+    return write_snapshot_from_rows(rows, snapshot_dir)
+
+
+def write_snapshot_from_rows(rows, snapshot_dir=VECTOR_SNAPSHOT_DIR):
+    """
+    Grava um snapshot a partir de linhas (id, content, source, collection, chunk_hash, embedding
+    e, opcional, cluster_id) já ordenadas por coleção. Usado pelo export do banco e pelos benchmarks.
+    """
+    digest = hashlib.sha256()
+    for row in rows:
+        # cluster_id entra na versão: re-agrupar os quase duplicados gera um snapshot novo
+        digest.update(f"{row.id}:{row.collection}:{row.chunk_hash}:{getattr(row, 'cluster_id', None)}\n"
+                      .encode("utf-8"))
+    version = digest.hexdigest()[:16]
+
+    if version == read_current_version(snapshot_dir):
+        return version
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    matrix = np.zeros((len(rows), EMBEDDING_DIM), dtype=np.float32)
+    ranges = {}
+    for i, row in enumerate(rows):
+        matrix[i] = np.asarray(row.embedding, dtype=np.float32)
+        start, _ = ranges.get(row.collection, (i, i))
+        ranges[row.collection] = (start, i + 1)
+
+    meta = {
+        "version": version,
+        "dim": EMBEDDING_DIM,
+        "count": len(rows),
+        "ranges": ranges,
+        "ids": [row.id for row in rows],
+        "sources": [row.source for row in rows],
+        "contents": [row.content for row in rows],
+        "clusters": [getattr(row, "cluster_id", None) for row in rows],
+    }
+
+    # Escreve os arquivos da versão e só então troca o ponteiro CURRENT
+    matrix.tofile(os.path.join(snapshot_dir, f"vectors-{version}.f32"))
+    with open(os.path.join(snapshot_dir, f"meta-{version}.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    tmp = _current_path(snapshot_dir) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp, _current_path(snapshot_dir))
+
+    _cleanup_old_versions(snapshot_dir, version)
+    logger.info(f"Snapshot de vetores {version} gravado ({len(rows)} chunks).")
+    return version
+
+
+def _cleanup_old_versions(snapshot_dir, current):
+    versions = sorted(
+        (os.path.getmtime(os.path.join(snapshot_dir, name)), name[len("meta-"):-len(".json")])
+        for name in os.listdir(snapshot_dir)
+        if name.startswith("meta-") and name.endswith(".json")
+    )
+    old = [v for _, v in versions if v != current][:-VECTOR_SNAPSHOT_KEEP or None]
+    for version in old:
+        for name in (f"vectors-{version}.f32", f"meta-{version}.json"):
+            try:
+                os.remove(os.path.join(snapshot_dir, name))
+            except FileNotFoundError:
+                pass
+
+
+class _LoadedSnapshot:
+    def __init__(self, snapshot_dir, version):
+        with open(os.path.join(snapshot_dir, f"meta-{version}.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.version = version
+        self.ranges = {name: tuple(bounds) for name, bounds in meta["ranges"].items()}
+        self.ids = meta["ids"]
+        self.sources = meta["sources"]
+        self.contents = meta["contents"]
+        self.clusters = meta.get("clusters") or [None] * meta["count"]
+        if meta["count"]:
+            self.matrix = np.memmap(
+                os.path.join(snapshot_dir, f"vectors-{version}.f32"),
+                dtype=np.float32, mode="r", shape=(meta["count"], meta["dim"]),
+            )
+            # ||x||² por linha, para L2² = ||x||² - 2 x·q + ||q||²
+            self.sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        else:
+            self.matrix = np.zeros((0, meta["dim"]), dtype=np.float32)
+            self.sq_norms = np.zeros(0, dtype=np.float32)
+
+
+class NumpyBackend:
+    """Top-k exato por coleção com matmul vetorizado + argpartition."""
+
+    def __init__(self, snapshot_dir=VECTOR_SNAPSHOT_DIR, check_interval=VECTOR_SNAPSHOT_CHECK_INTERVAL):
+        self.snapshot_dir = snapshot_dir
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _current(self):
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._last_check < self.check_interval:
+            return self._snapshot
+
+        with self._lock:
+            self._last_check = now
+            version = read_current_version(self.snapshot_dir)
+            if version is None:
+                # Primeiro uso sem snapshot: exporta a partir do banco
+                version = write_snapshot(self.snapshot_dir)
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = _LoadedSnapshot(self.snapshot_dir, version)
+                logger.info(f"Snapshot de vetores {version} carregado ({len(self._snapshot.ids)} chunks).")
+            return self._snapshot
+
+    def search(self, query_vector, k_by_name, query_text=None, with_vectors=False):
+        # Só busca vetorial: o modo híbrido depende do full-text do Postgres
+        with telemetry.span("retrieval.numpy", collections=",".join(k_by_name)), \
+                telemetry.RETRIEVAL_LATENCY.time(backend="numpy", mode="vector"):
+            return self._search(query_vector, k_by_name, with_vectors)
+
+    def _search(self, query_vector, k_by_name, with_vectors=False):
+        snapshot = self._current()
+        q = np.asarray(query_vector, dtype=np.float32)
+        q_sq = float(q @ q)
+
+        results = {name: [] for name in k_by_name}
+        for name, k in k_by_name.items():
+            start, end = snapshot.ranges.get(name, (0, 0))
+            if end <= start:
+                continue
+            distances = snapshot.sq_norms[start:end] - 2.0 * (snapshot.matrix[start:end] @ q) + q_sq
+            k = min(k, end - start)
+            top = np.argpartition(distances, k - 1)[:k]
+            top = top[np.argsort(distances[top])]
+            for offset in top:
+                row = start + int(offset)
+                results[name].append(RetrievedChunk(
+                    id=snapshot.ids[row],
+                    content=snapshot.contents[row],
+                    source=snapshot.sources[row],
+                    collection=name,
+                    distance=float(np.sqrt(max(distances[offset], 0.0))),
+                    cluster_id=snapshot.clusters[row],
+                    embedding=snapshot.matrix[row] if with_vectors else None,
+                ))
+        return results